@@ -0,0 +1,174 @@
+import base64
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Keyset theo (timestamp, id) dùng index idx_chat_messages_session_ts (session_id, timestamp, id);
+# điều kiện viết dạng OR thay vì so sánh bộ (a, b) < (x, y) để MySQL chắc chắn dùng range scan
+SELECT_PAGE_SQL = (
+    "SELECT id, message_uid, question, answer, timestamp FROM chat_messages "
+    "WHERE session_id = %s AND (timestamp < %s OR (timestamp = %s AND id < %s)) "
+    "ORDER BY timestamp DESC, id DESC LIMIT %s"
+)
+SELECT_NEWEST_SQL = (
+    "SELECT id, message_uid, question, answer, timestamp FROM chat_messages "
+    "WHERE session_id = %s ORDER BY timestamp DESC, id DESC LIMIT %s"
+)
+SELECT_KEYSET_BY_UID_SQL = "SELECT id, timestamp FROM chat_messages WHERE message_uid = %s"
+
+
+class InvalidCursor(ValueError):
+    """Cursor `before` không giải mã được"""
+
+
+def encode_cursor(data: Dict[str, Any]) -> str:
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+    if not isinstance(data, dict) or data.get("src") not in ("redis", "mysql"):
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
+    if data["src"] == "mysql":
+        try:
+            data["ts"] = datetime.fromisoformat(data["ts"])
+            data["id"] = int(data["id"])
+        except (KeyError, TypeError, ValueError) as e:
+            raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+    return data
+
+
+def redis_cursor(offset: int, entry: Dict[str, Any]) -> str:
+    """Cursor sau một tin nhắn lấy từ danh sách Redis (uid để định vị lại khi danh sách dịch chuyển)"""
+    return encode_cursor({"src": "redis", "uid": entry.get("message_uid"), "offset": offset})
+
+
+def mysql_cursor(row: Dict[str, Any]) -> str:
+    return encode_cursor({"src": "mysql", "ts": row["timestamp"].isoformat(), "id": row["id"]})
+
+
+def format_message(entry: Dict[str, Any]) -> Dict[str, Any]:
+    message = {"question": entry["question"], "answer": entry["answer"]}
+    timestamp = entry.get("timestamp")
+    if timestamp:
+        message["timestamp"] = timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp
+    return message
+
+
+class ChatHistoryReader:
+    """
+    Lịch sử chat phân trang theo cursor, ghép Redis và MySQL (mới nhất trước).
+
+    - Trang mới nhất lấy từ danh sách `session:{id}:history` trong Redis, không chạm MySQL.
+    - Các trang cũ hơn đọc MySQL theo keyset (timestamp, id) nên chi phí mỗi trang không
+      phụ thuộc độ sâu, khác với OFFSET.
+    - Tin nhắn còn trong Redis nhưng đã (hoặc chưa) được MessagePersister ghi xuống MySQL
+      được khử trùng theo message_uid, nên phần đuôi chưa đồng bộ không bị mất hay lặp.
+
+    Cursor `before` là chuỗi mờ (base64 JSON): hoặc vị trí trong danh sách Redis,
+    hoặc khóa (timestamp, id) của bản ghi MySQL cuối cùng đã trả về.
+    """
+
+    def __init__(self, session_store, mysql_pool_getter):
+        self.session_store = session_store
+        # Hàm trả về pool hiện tại (ném lỗi nếu MySQL chưa sẵn sàng); chỉ gọi khi cần đọc MySQL
+        self.mysql_pool_getter = mysql_pool_getter
+
+    async def page(self, session_id: str, limit: int, before: Optional[str] = None,
+                   question_count: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Args:
+            question_count: bộ đếm câu hỏi trong Redis nếu có; mỗi tin nhắn ứng với một lần tăng
+                bộ đếm nên khi bộ đếm không vượt quá độ dài danh sách Redis thì MySQL không có gì thêm
+
+        Returns:
+            (danh sách tin nhắn mới nhất trước, cursor cho trang kế tiếp hoặc None nếu hết)
+        """
+        cursor = decode_cursor(before) if before else None
+        recent = await self.session_store.recent_messages(session_id)
+        # Phần tử kiểu cũ (không có message_uid) không khử trùng được với MySQL, nơi chúng đã được
+        # lưu; chúng luôn ở cuối danh sách (cũ hơn) nên chỉ phục vụ phần đầu có uid từ Redis
+        legacy_start = next((i for i, entry in enumerate(recent) if not entry.get("message_uid")), None)
+        if legacy_start is not None:
+            recent = recent[:legacy_start]
+        recent_uids = {entry["message_uid"] for entry in recent if entry.get("message_uid")}
+
+        if cursor is not None and cursor["src"] == "mysql":
+            return await self._mysql_page(session_id, limit, [], (cursor["ts"], cursor["id"]), recent_uids)
+
+        start = 0
+        if cursor is not None:
+            start = await self._resolve_redis_cursor(cursor, recent)
+            if isinstance(start, tuple):
+                # Tin nhắn ở cursor đã bị đẩy khỏi danh sách Redis; tiếp tục từ bản ghi MySQL của nó
+                return await self._mysql_page(session_id, limit, [], start, recent_uids)
+
+        messages = recent[start:start + limit]
+        end = start + len(messages)
+        if len(messages) == limit and end < len(recent):
+            return messages, redis_cursor(end, messages[-1])
+        if question_count is not None and question_count <= len(recent):
+            return messages, None
+
+        # Hết phần Redis: đọc tiếp MySQL bên dưới tin nhắn Redis cũ nhất. Nếu tin nhắn đó chưa
+        # được đồng bộ thì đọc từ đầu và bỏ các uid đã có trong Redis.
+        keyset = await self._keyset_of(recent[-1]) if recent else None
+        return await self._mysql_page(session_id, limit, messages, keyset, recent_uids,
+                                      last_redis_offset=end if messages else None)
+
+    async def _resolve_redis_cursor(self, cursor: Dict[str, Any], recent: List[Dict[str, Any]]):
+        """Vị trí bắt đầu trong danh sách Redis, hoặc keyset MySQL nếu tin nhắn không còn trong Redis"""
+        uid = cursor.get("uid")
+        if uid:
+            for index, entry in enumerate(recent):
+                if entry.get("message_uid") == uid:
+                    return index + 1
+            keyset = await self._keyset_of({"message_uid": uid})
+            if keyset is not None:
+                return keyset
+        # Phần tử kiểu cũ không có uid: dùng vị trí đã lưu
+        return max(int(cursor.get("offset", 0)), 0)
+
+    async def _keyset_of(self, entry: Dict[str, Any]) -> Optional[Tuple[datetime, int]]:
+        uid = entry.get("message_uid")
+        if not uid:
+            return None
+        async with self.mysql_pool_getter().acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(SELECT_KEYSET_BY_UID_SQL, (uid,))
+                row = await cursor.fetchone()
+        return (row["timestamp"], row["id"]) if row else None
+
+    async def _mysql_page(self, session_id: str, limit: int, messages: List[Dict[str, Any]],
+                          keyset: Optional[Tuple[datetime, int]], exclude_uids, last_redis_offset: Optional[int] = None):
+        needed = limit - len(messages)
+        # Lấy dư số uid cần loại (tối đa độ dài danh sách Redis) + 1 để biết còn trang sau
+        fetch = needed + len(exclude_uids) + 1
+        async with self.mysql_pool_getter().acquire() as conn:
+            async with conn.cursor() as cursor:
+                if keyset is None:
+                    await cursor.execute(SELECT_NEWEST_SQL, (session_id, fetch))
+                else:
+                    ts, row_id = keyset
+                    await cursor.execute(SELECT_PAGE_SQL, (session_id, ts, ts, row_id, fetch))
+                rows = await cursor.fetchall()
+
+        rows = [row for row in rows if row["message_uid"] not in exclude_uids]
+        taken = rows[:needed]
+        messages = messages + taken
+        if len(rows) <= needed:
+            return messages, None
+        if taken:
+            return messages, mysql_cursor(taken[-1])
+        # Trang kết thúc đúng ở tin nhắn Redis cuối cùng
+        return messages, redis_cursor(last_redis_offset, messages[-1])
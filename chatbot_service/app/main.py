@@ -1,24 +1,39 @@
+import time
+# Mốc thời gian bắt đầu import, để báo cáo thời gian khởi động đầy đủ
+_import_started = time.perf_counter()
+
 import logging
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import os
 import sys
 import re
+import json
 from dotenv import load_dotenv
 from typing import Dict, Any
-import google.generativeai as genai
 from datetime import datetime
-import redis
-import pymysql
+import redis.asyncio as aioredis
 import asyncio
-import time
-import threading
 import uuid
 
 # Add the parent directory to sys.path to allow imports from src
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from src.prompt import create_rag_chain
+from src.prompt import get_rag_chain, rag_chain_loaded, start_rag_chain
+from src.pipeline import answer_question, stream_answer, translation_cache, PIPELINE_MODE
+from src.cache import SingleFlight, normalize_text
+from src.helper import download_hugging_face_embeddings
+from src.semantic_cache import SemanticCache
+from src.startup import StartupManager
+from src.llm_scheduler import LLMOverloadedError, llm_scheduler
+from src.metrics import (CONTENT_TYPE_LATEST, observe_stage, observe_stage_seconds, render_metrics,
+                         stats_collector, track_request)
+from app.session_store import SessionStore, SESSION_FORBIDDEN, SESSION_MISSING, QUOTA_EXCEEDED
+from app.mysql_pool import MySQLPool
+from app.sync_engine import SyncEngine
+from app.message_log import MessagePersister
+from app.chat_history import ChatHistoryReader, InvalidCursor, format_message
 
 # Ensure environment variables are loaded
 load_dotenv()
@@ -27,6 +42,14 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Các bước khởi động (Redis, MySQL, RAG chain) chạy nền với timeout; /ready báo khi xong
+startup = StartupManager(started=_import_started)
+startup.record("imports", time.perf_counter() - _import_started)
+STARTUP_REDIS_TIMEOUT = float(os.getenv("STARTUP_REDIS_TIMEOUT", "5"))
+STARTUP_MYSQL_TIMEOUT = float(os.getenv("STARTUP_MYSQL_TIMEOUT", "10"))
+STARTUP_MODEL_TIMEOUT = float(os.getenv("STARTUP_MODEL_TIMEOUT", "180"))
+STARTUP_RETRY_INTERVAL = float(os.getenv("STARTUP_RETRY_INTERVAL", "5"))
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Family Menu Suggestion System",
@@ -43,6 +66,9 @@ app.add_middleware(
     allow_headers=["*"],  # Cho phép tất cả các header
 )
 
+# Histogram thời gian theo endpoint; endpoint hiện tại được gắn cho các bước đo bên trong
+app.middleware("http")(track_request)
+
 class QueryRequest(BaseModel):
     question: str
     session_id: str | None = None  # Optional session_id, nếu không cung cấp sẽ tạo mới
@@ -51,125 +77,147 @@ class QueryRequest(BaseModel):
 class NewSessionRequest(BaseModel):
     pass  # Không cần dữ liệu, chỉ để tạo session mới
 
-# Initialize the RAG chain once at startup
-rag_chain = None
+# RAG chain dùng chung cả tiến trình nằm trong src.prompt (get_rag_chain)
+semantic_cache = None
 redis_client = None
-mysql_conn = None
+mysql_pool = None
+sync_engine = None
+message_persister = None
+
+# Cấu hình cache câu trả lời theo ngữ nghĩa
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
 
 # Các biến cho cơ chế đồng bộ bất đồng bộ
 sync_interval = int(os.getenv("SYNC_INTERVAL", "300"))  # 5 phút
-sync_thread = None
-stop_sync_thread = False
-
-# Configure Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))  # Thêm GEMINI_API_KEY vào .env
-model = genai.GenerativeModel("gemini-2.0-flash-lite")
-
-# Function to translate text using Gemini API
-def translate_with_gemini(text, source_lang="vi", target_lang="en"):
-    """Translate text using Gemini API and return only the translated text."""
-    prompt = (
-        f"Translate this text from {source_lang} to {target_lang} accurately, "
-        f"ensuring proper Vietnamese characters if translating to Vietnamese, "
-        f"and return only the translated text without additional explanation: '{text}'"
-    )
-    try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
-    except Exception as e:
-        logger.error(f"Translation error: {str(e)}")
-        return text  # Fallback to original text if translation fails
+sync_task = None
+persister_task = None
+startup_task = None
+
+# Gemini được cấu hình ở lần gọi đầu tiên (src.prompt.configure_gemini), không phải lúc import
 
-# Khởi tạo Redis client
-redis_client = redis.Redis(
+# Khởi tạo Redis client bất đồng bộ (kết nối được mở khi có lệnh đầu tiên)
+redis_client = aioredis.Redis(
     host=os.getenv("REDIS_HOST"),
     port=int(os.getenv("REDIS_PORT")),
-    db=int(os.getenv("REDIS_DB"))
+    db=int(os.getenv("REDIS_DB")),
+    socket_connect_timeout=STARTUP_REDIS_TIMEOUT
 )
 
-# Khởi tạo MySQL connection
-def get_mysql_connection():
-    return pymysql.connect(
-        host=os.getenv("MYSQL_HOST"),
-        user=os.getenv("MYSQL_USER"),
-        password=os.getenv("MYSQL_PASSWORD"),
-        database=os.getenv("MYSQL_DATABASE"),
-        cursorclass=pymysql.cursors.DictCursor
+# Dùng Redis làm tầng cache thứ hai cho bản dịch để mọi worker cùng hưởng lợi
+translation_cache.attach_redis(redis_client)
+
+# Gộp các câu hỏi giống nhau đang được xử lý đồng thời (không phụ thuộc lịch sử)
+question_flight = SingleFlight()
+
+# Bookkeeping phiên chat trên Redis (script Lua + pipeline)
+session_store = SessionStore(redis_client, stream_maxlen=int(os.getenv("MESSAGE_STREAM_MAXLEN", "100000")))
+
+# Lịch sử chat phân trang: trang mới nhất từ Redis, trang cũ hơn từ MySQL
+chat_history_reader = ChatHistoryReader(session_store, lambda: require_mysql_pool())
+
+def embedding_cache_stats():
+    # Chỉ báo cáo khi model embedding đã được tải, tránh tải model chỉ để lấy thống kê
+    if download_hugging_face_embeddings.cache_info().currsize:
+        return download_hugging_face_embeddings().stats()
+    return None
+
+async def message_stream_stats():
+    # Độ dài stream tin nhắn, số tin nhắn pending và dead letter (cần gọi Redis nên là nguồn bất đồng bộ)
+    if message_persister is None:
+        return None
+    return await message_persister.stats()
+
+# Gauge cho /metrics: pool, các cache và hàng đợi, đọc từ stats() tại thời điểm scrape
+stats_collector.register("mysql_pool", lambda: mysql_pool.stats() if mysql_pool is not None else None)
+stats_collector.register("translation_cache", translation_cache.stats)
+stats_collector.register("semantic_cache", lambda: semantic_cache.stats() if semantic_cache is not None else None)
+stats_collector.register("embedding_cache", embedding_cache_stats)
+stats_collector.register("question_coalescing", question_flight.stats)
+stats_collector.register("llm_scheduler", llm_scheduler.stats)
+stats_collector.register_async("message_stream", message_stream_stats)
+
+def create_semantic_cache():
+    """Tạo cache ngữ nghĩa dùng chung model embedding với retriever"""
+    cache = SemanticCache(
+        download_hugging_face_embeddings(),
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+        capacity=int(os.getenv("SEMANTIC_CACHE_SIZE", "2048")),
+        ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
     )
-
-mysql_conn = get_mysql_connection()
+    cache.attach_redis(redis_client)
+    return cache
 
 # Hàm đồng bộ dữ liệu từ Redis xuống MySQL
-def sync_to_mysql():
-    global stop_sync_thread
-    logger.info("Bắt đầu thread đồng bộ dữ liệu từ Redis tới MySQL")
+async def sync_to_mysql():
+    logger.info("Bắt đầu tác vụ đồng bộ dữ liệu từ Redis tới MySQL")
     
-    while not stop_sync_thread:
+    # Tin nhắn xếp hàng theo định dạng cũ của các phiên không còn request nào
+    try:
+        await sync_engine.requeue_legacy_pending()
+    except Exception as e:
+        logger.error(f"Lỗi khi quét tin nhắn chờ theo định dạng cũ: {str(e)}")
+    
+    while True:
         try:
-            # Lấy danh sách các session cần đồng bộ
-            session_keys = redis_client.keys("session:*:count")
-            
-            if session_keys:
-                logger.info(f"Đang đồng bộ {len(session_keys)} session")
-                
-                # Khởi tạo kết nối MySQL mới cho thread này
-                conn = get_mysql_connection()
-                
-                for key in session_keys:
-                    session_id = key.decode('utf-8').split(':')[1]
-                    
-                    # Lấy số lượng câu hỏi từ Redis
-                    redis_count = int(redis_client.get(f"session:{session_id}:count") or 0)
-                    
-                    try:
-                        with conn.cursor() as cursor:
-                            # Kiểm tra xem session đã tồn tại trong MySQL chưa
-                            cursor.execute("SELECT question_count FROM chat_sessions WHERE session_id = %s", (session_id,))
-                            result = cursor.fetchone()
-                            
-                            if result:
-                                # Cập nhật question_count trong MySQL
-                                cursor.execute(
-                                    "UPDATE chat_sessions SET question_count = %s WHERE session_id = %s",
-                                    (redis_count, session_id)
-                                )
-                            else:
-                                # Không thể tìm thấy session trong MySQL (hiếm khi xảy ra)
-                                logger.warning(f"Session {session_id} không tồn tại trong MySQL nhưng tồn tại trong Redis")
-                            
-                        conn.commit()
-                    except Exception as e:
-                        logger.error(f"Lỗi đồng bộ session {session_id}: {str(e)}")
-                
-                # Đóng kết nối sau khi hoàn thành
-                conn.close()
+            # Chỉ đồng bộ các session đã thay đổi (tập sessions:dirty)
+            result = await sync_engine.sync_once()
+            if result["sessions"]:
+                logger.info(f"Đã đồng bộ {result['sessions']} session và {result['messages']} tin nhắn")
             
             # Đợi cho đến chu kỳ đồng bộ tiếp theo
-            time.sleep(sync_interval)
+            await asyncio.sleep(sync_interval)
             
+        except asyncio.CancelledError:
+            break
         except Exception as e:
             logger.error(f"Lỗi trong quá trình đồng bộ: {str(e)}")
-            time.sleep(30)  # Đợi 30 giây trước khi thử lại
+            await asyncio.sleep(30)  # Đợi 30 giây trước khi thử lại
+
+async def connect_redis():
+    await redis_client.ping()
+
+async def open_mysql():
+    """Mở pool MySQL và khởi động các tác vụ đồng bộ nền dùng pool đó"""
+    global mysql_pool, sync_engine, message_persister, sync_task, persister_task
+    # Pool kết nối có giới hạn, tự ping/kết nối lại sau wait_timeout của MySQL
+    mysql_pool = await MySQLPool.from_env().open()
+    sync_engine = SyncEngine(redis_client, mysql_pool)
+    message_persister = MessagePersister.from_env(redis_client, mysql_pool)
+    # Khởi động tác vụ đồng bộ chạy nền trên event loop
+    sync_task = asyncio.create_task(sync_to_mysql())
+    # Ghi tin nhắn từ Redis Stream xuống MySQL gần như ngay lập tức
+    persister_task = asyncio.create_task(message_persister.run())
+    logger.info("Đã khởi động tác vụ đồng bộ dữ liệu")
+
+async def initialize_storage():
+    # Redis trước: session store, stream tin nhắn và tác vụ đồng bộ đều cần nó
+    await startup.run_until_ok("redis", connect_redis, STARTUP_REDIS_TIMEOUT, STARTUP_RETRY_INTERVAL)
+    await startup.run_until_ok("mysql", open_mysql, STARTUP_MYSQL_TIMEOUT, STARTUP_RETRY_INTERVAL)
+
+async def initialize_models():
+    # Tải model embedding và mở vector store; bước chậm nhất nên chạy song song với phần lưu trữ
+    await start_rag_chain(startup, STARTUP_MODEL_TIMEOUT, STARTUP_RETRY_INTERVAL)
+    if SEMANTIC_CACHE_ENABLED:
+        await startup.run("semantic_cache", ensure_semantic_cache, STARTUP_MODEL_TIMEOUT, required=False)
+
+async def initialize_dependencies():
+    """Khởi tạo các phụ thuộc theo từng bước có timeout; bước lỗi được thử lại, không làm dừng server"""
+    for name in ("redis", "mysql", "rag_chain", "warmup"):
+        startup.declare(name)
+    await asyncio.gather(initialize_storage(), initialize_models())
+    startup.done()
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize resources on startup"""
-    global rag_chain, sync_thread
-    try:
-        if rag_chain is None:
-            logger.info("Initializing RAG chain...")
-            rag_chain = create_rag_chain()
-            logger.info("RAG chain initialized successfully")
-        else:
-            logger.info("RAG chain already initialized")
-        
-        # Khởi động thread đồng bộ
-        sync_thread = threading.Thread(target=sync_to_mysql, daemon=True)
-        sync_thread.start()
-        logger.info("Đã khởi động thread đồng bộ dữ liệu")
-    except Exception as e:
-        logger.error(f"Failed to initialize RAG chain: {str(e)}")
-        # Continue startup - we'll initialize on first request if needed
+    """Không chặn khởi động: server nhận request ngay, các phụ thuộc được khởi tạo nền"""
+    global startup_task
+    startup_task = asyncio.create_task(initialize_dependencies())
+
+def require_mysql_pool() -> MySQLPool:
+    """Pool MySQL, hoặc 503 nếu MySQL chưa sẵn sàng"""
+    if mysql_pool is None:
+        raise HTTPException(status_code=503, detail="MySQL is not ready yet")
+    return mysql_pool
 
 @app.get("/")
 async def root():
@@ -184,78 +232,134 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: chỉ sẵn sàng khi Redis, MySQL và RAG chain đã khởi tạo và warm-up xong (/health chỉ báo tiến trình còn sống)"""
+    if startup.ready:
+        return {"status": "ready"}
+    return JSONResponse(status_code=503, content={"status": "starting", "waiting_for": startup.not_ready()})
+
+@app.get("/startup_stats")
+async def startup_stats():
+    """Thời gian và trạng thái từng bước khởi động"""
+    return startup.report()
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """Thống kê hit-rate và thời gian tiết kiệm được của các cache"""
+    stats = {"translation": translation_cache.stats()}
+    if semantic_cache is not None:
+        stats["semantic"] = semantic_cache.stats()
+    stats["coalescing"] = question_flight.stats()
+    embedding_stats = embedding_cache_stats()
+    if embedding_stats is not None:
+        stats["embedding"] = embedding_stats
+    return stats
+
+@app.get("/llm_stats")
+async def llm_stats():
+    """Thống kê scheduler gọi Gemini: số lời gọi đang chạy, độ sâu hàng đợi, thời gian chờ, lỗi quota"""
+    return llm_scheduler.stats()
+
+@app.get("/pool_stats")
+async def pool_stats():
+    """Thống kê pool kết nối MySQL (số kết nối đang dùng, thời gian chờ)"""
+    if mysql_pool is None:
+        raise HTTPException(status_code=503, detail="MySQL pool is not initialized")
+    return {"mysql": mysql_pool.stats()}
+
+@app.get("/metrics")
+async def metrics():
+    """Histogram thời gian từng bước xử lý và gauge pool/cache/hàng đợi theo định dạng Prometheus"""
+    return Response(content=await render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
 @app.post("/new_session")
 async def new_session(request: NewSessionRequest):
     """Create a new chat session"""
     session_id = str(uuid.uuid4())  # Tạo session_id mới bằng UUID
     try:
-        with mysql_conn.cursor() as cursor:
-            cursor.execute("INSERT INTO chat_sessions (session_id, question_count) VALUES (%s, %s)", (session_id, 0))
-            mysql_conn.commit()
-        # Khởi tạo trong Redis
-        redis_client.set(f"session:{session_id}:count", 0, ex=86400)  # TTL 24 giờ
+        # Chỉ tạo trong Redis; dòng MySQL được ghi write-behind khi phiên có câu hỏi đầu tiên
+        await session_store.create(session_id)
         logger.info(f"New session created: {session_id}")
         return {"session_id": session_id, "message": "New session created successfully"}
     except Exception as e:
         logger.error(f"Error creating new session: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error creating new session: {str(e)}")
 
-@app.post("/query")
-async def query(request: QueryRequest):
-    """Process a nutrition or menu query using RAG with Gemini translation"""
-    global rag_chain
+async def prepare_session(request: QueryRequest):
+    """
+    Tạo hoặc xác thực session, kiểm tra giới hạn câu hỏi và tăng bộ đếm.
 
+    Returns:
+        (session_id, lịch sử chat dạng chuỗi cho prompt)
+    """
     # If no session_id provided, create new one
     if request.session_id is None:
         session_id = str(uuid.uuid4())
-        with mysql_conn.cursor() as cursor:
-            # Sửa để cho phép NULL trong user_id
-            user_id_value = request.user_id if request.user_id is not None else None
-            cursor.execute(
-                "INSERT INTO chat_sessions (session_id, user_id, question_count) VALUES (%s, %s, %s)", 
-                (session_id, user_id_value, 0)
-            )
-            mysql_conn.commit()
-        redis_client.set(f"session:{session_id}:count", 0, ex=86400)
+        # Sửa để cho phép NULL trong user_id
+        user_id_value = request.user_id if request.user_id is not None else None
+        # Phiên chỉ nằm trong Redis cho tới lượt đồng bộ write-behind (SyncEngine/MessagePersister)
+        with observe_stage("session_redis"):
+            await session_store.create(session_id, user_id_value)
         logger.info(f"New session created for user {user_id_value}: {session_id}")
     else:
         session_id = request.session_id
-        # Bỏ xác thực user_id nếu không có request.user_id
-        if request.user_id is not None:
-            with mysql_conn.cursor() as cursor:
-                cursor.execute(
-                    "SELECT user_id FROM chat_sessions WHERE session_id = %s",
-                    (session_id,)
-                )
-                result = cursor.fetchone()
-                # Chỉ xác thực nếu có user_id trong DB và có user_id trong request
-                if result and result['user_id'] is not None and str(result['user_id']) != str(request.user_id):
-                    raise HTTPException(
-                        status_code=403, 
-                        detail="Not authorized to access this chat session"
-                    )
 
-    # Kiểm tra session_id có tồn tại không trong Redis
-    if not redis_client.exists(f"session:{session_id}:count"):
-        # Thử lấy từ MySQL nếu không có trong Redis
-        with mysql_conn.cursor() as cursor:
-            cursor.execute("SELECT question_count FROM chat_sessions WHERE session_id = %s", (session_id,))
-            result = cursor.fetchone()
-            if not result:
-                raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
-            # Khôi phục dữ liệu từ MySQL vào Redis
-            redis_client.set(f"session:{session_id}:count", result['question_count'], ex=86400)
-    
     logger.info(f"Session ID: {session_id}")
 
-    # Lấy và tăng số câu hỏi trong Redis
-    question_count = int(redis_client.get(f"session:{session_id}:count") or 0)
-    
-    if question_count >= 30:
+    # Kiểm tra chủ phiên (chỉ khi request có user_id), giới hạn, tăng số câu hỏi và lấy lịch sử
+    # trong một lệnh nguyên tử trên hash thông tin phiên
+    with observe_stage("session_redis"):
+        status, _, history = await session_store.check_and_increment(session_id, request.user_id)
+    if status == SESSION_MISSING:
+        # Nạp thông tin phiên từ MySQL một lần; các request sau dùng hash trong Redis
+        with observe_stage("session_mysql"):
+            async with require_mysql_pool().acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        "SELECT user_id, question_count, created_at FROM chat_sessions WHERE session_id = %s",
+                        (session_id,)
+                    )
+                    result = await cursor.fetchone()
+        if not result:
+            raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+        with observe_stage("session_redis"):
+            await session_store.restore(session_id, result['question_count'], result['user_id'], result['created_at'])
+            status, _, history = await session_store.check_and_increment(session_id, request.user_id)
+
+    if status == SESSION_FORBIDDEN:
+        # Chỉ từ chối khi phiên có chủ và khác user_id của request
+        raise HTTPException(
+            status_code=403,
+            detail="Not authorized to access this chat session"
+        )
+    if status == QUOTA_EXCEEDED:
         raise HTTPException(status_code=429, detail="Giới hạn 30 câu hỏi mỗi phiên đã đạt. Vui lòng bắt đầu phiên mới.")
 
-    # Tăng số lượng câu hỏi ngay lập tức trong Redis
-    redis_client.incr(f"session:{session_id}:count")
+    return session_id, "\n".join(history)
+
+async def ensure_rag_chain():
+    """RAG chain dùng chung của tiến trình; request đến trong lúc khởi động chờ chung lần khởi tạo đó"""
+    if rag_chain_loaded():
+        return get_rag_chain()
+    # Tải model embedding trong thread riêng để không chặn event loop
+    return await asyncio.to_thread(get_rag_chain)
+
+async def ensure_semantic_cache():
+    """Khởi tạo cache ngữ nghĩa nếu chưa được tạo lúc startup"""
+    global semantic_cache
+    if semantic_cache is None:
+        semantic_cache = await asyncio.to_thread(create_semantic_cache)
+    return semantic_cache
+
+async def save_exchange(session_id: str, user_id, question: str, answer: str):
+    """Lưu câu hỏi/trả lời vào lịch sử Redis và đánh dấu tin nhắn chờ đồng bộ"""
+    await session_store.save_exchange(session_id, user_id, question, answer)
+
+@app.post("/query")
+async def query(request: QueryRequest):
+    """Process a nutrition or menu query using RAG with Gemini"""
+    session_id, chat_history_str = await prepare_session(request)
     
     question = request.question
     logger.info(f"Received query: {question}")
@@ -264,74 +368,46 @@ async def query(request: QueryRequest):
     start_time = time.time()
 
     try:
-        # Initialize RAG chain if not done during startup
-        if rag_chain is None:
-            logger.info("Initializing RAG chain on first request...")
-            rag_chain = create_rag_chain()
-            logger.info("RAG chain initialized successfully on first request")
-
-        # Lấy lịch sử chat từ Redis
-        chat_history = redis_client.lrange(f"session:{session_id}:history", 0, -1)
-        chat_history_str = "\n".join([msg.decode('utf-8') for msg in chat_history]) if chat_history else ""
-
-        # Phát hiện ngôn ngữ (giả sử câu hỏi bằng tiếng Việt, có thể thêm logic phát hiện sau)
-        detected_lang = "vi"  # Để đơn giản, giả định luôn là tiếng Việt
-
-        # Dịch câu hỏi từ tiếng Việt sang tiếng Anh nếu cần
-        if detected_lang == "vi":
-            question_en = translate_with_gemini(question, "vi", "en")
-            logger.info(f"Translated query to English: {question_en}")
-        else:
-            question_en = question
-
-        # Thêm bối cảnh từ chat history vào prompt
-        full_input = "User: " + question_en
-
-        # Thêm độ trễ nhân tạo để mô phỏng thời gian suy nghĩ
-        # Chỉ thêm khi không phải câu hỏi bắt đầu phiên chat mới
-        if question.lower() != "xin chào" and not question.lower().startswith("hello"):
-            await asyncio.sleep(1)  # Độ trễ 1 giây
-
-        # Process the query with history if available
-        if chat_history_str:
-            response = rag_chain.invoke({"input": full_input, "history": chat_history_str})
-        else:
-            response = rag_chain.invoke({"input": full_input})
-
-        if isinstance(response, dict) and "answer" in response:
-            answer = response["answer"]
-        else:
-            answer = str(response)
-
-        # Dịch câu trả lời từ tiếng Anh về tiếng Việt nếu câu hỏi gốc là tiếng Việt
-        if detected_lang == "vi":
-            answer_vi = translate_with_gemini(answer, "en", "vi")
-            logger.info(f"Translated answer to Vietnamese: {answer_vi}")
-        else:
-            answer_vi = answer
-
-        # Lưu câu hỏi và trả lời vào Redis
-        redis_client.lpush(f"session:{session_id}:history", f"User: {question}\nAI: {answer_vi}")
-        redis_client.ltrim(f"session:{session_id}:history", 0, 9)  # Giới hạn lịch sử 10 tin nhắn cuối
-        
-        # Lưu thông tin tin nhắn vào Redis để đồng bộ sau
-        chat_msg_key = f"session:{session_id}:msg:{int(time.time())}"
-        message_data = {
-            "question": question,
-            "answer": answer_vi,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        # Chỉ thêm user_id vào dữ liệu nếu có
-        if request.user_id is not None:
-            message_data["user_id"] = request.user_id
-            
-        redis_client.hmset(chat_msg_key, message_data)
-        redis_client.expire(chat_msg_key, 86400)  # TTL 24 giờ
-        
-        # Cache tin nhắn cần đồng bộ
-        redis_client.sadd(f"session:{session_id}:pending_msgs", chat_msg_key)
-        redis_client.expire(f"session:{session_id}:pending_msgs", 86400)
+        with observe_stage("chain_init"):
+            rag_chain = await ensure_rag_chain()
+
+        # Câu hỏi không phụ thuộc lịch sử có thể dùng lại câu trả lời của câu hỏi gần nghĩa
+        answer_vi = None
+        question_vector = None
+        use_semantic_cache = SEMANTIC_CACHE_ENABLED and not chat_history_str
+        if use_semantic_cache:
+            with observe_stage("semantic_cache"):
+                cache = await ensure_semantic_cache()
+                answer_vi, question_vector = await cache.lookup(question)
+            if answer_vi is not None:
+                logger.info("Semantic cache hit")
+
+        async def compute_answer():
+            # Thêm độ trễ nhân tạo để mô phỏng thời gian suy nghĩ
+            # Chỉ thêm khi không phải câu hỏi bắt đầu phiên chat mới
+            if question.lower() != "xin chào" and not question.lower().startswith("hello"):
+                with observe_stage("thinking_delay"):
+                    await asyncio.sleep(1)  # Độ trễ 1 giây
+
+            # Trả lời theo chế độ pipeline đã cấu hình (QUERY_PIPELINE_MODE);
+            # các bước dịch, truy xuất và sinh câu trả lời được đo bên trong pipeline/chain
+            # Lỗi Gemini được ném ra (trả 500/503) thay vì trả câu xin lỗi, nên chỉ câu trả lời thật được cache
+            answer = await answer_question(rag_chain, question, chat_history_str)
+
+            if use_semantic_cache:
+                cache.add(question, answer, question_vector)
+            return answer
+
+        if answer_vi is None:
+            if chat_history_str:
+                # Câu trả lời phụ thuộc lịch sử riêng của phiên nên không gộp
+                answer_vi = await compute_answer()
+            else:
+                flight_key = f"{PIPELINE_MODE}:{normalize_text(question)}"
+                answer_vi = await question_flight.do(flight_key, compute_answer)
+
+        with observe_stage("save_redis"):
+            await save_exchange(session_id, request.user_id, question, answer_vi)
         
         # Tính thời gian xử lý
         processing_time = time.time() - start_time
@@ -343,6 +419,11 @@ async def query(request: QueryRequest):
             "processing_time": processing_time
         }
 
+    except LLMOverloadedError as e:
+        # Hết suất / quota Gemini trước hạn chót: báo client thử lại sau thay vì trả câu xin lỗi
+        logger.warning(f"LLM overloaded: {str(e)}")
+        raise HTTPException(status_code=503, detail="Hệ thống đang quá tải, vui lòng thử lại sau.",
+                            headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Error processing query: {str(e)}")
         raise HTTPException(
@@ -350,127 +431,133 @@ async def query(request: QueryRequest):
             detail=f"An error occurred while processing your request: {str(e)}"
         )
 
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Định dạng một sự kiện Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/query/stream")
+async def query_stream(request: QueryRequest):
+    """Stream câu trả lời theo từng đoạn qua Server-Sent Events"""
+    session_id, chat_history_str = await prepare_session(request)
+    
+    question = request.question
+    logger.info(f"Received streaming query: {question}")
+    start_time = time.time()
+
+    try:
+        rag_chain = await ensure_rag_chain()
+        use_semantic_cache = SEMANTIC_CACHE_ENABLED and not chat_history_str
+        cache = await ensure_semantic_cache() if use_semantic_cache else None
+    except Exception as e:
+        logger.error(f"Error preparing streaming query: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred while processing your request: {str(e)}"
+        )
+
+    async def event_stream():
+        yield sse_event("session", {"session_id": session_id})
+        try:
+            answer_vi = None
+            question_vector = None
+            if cache is not None:
+                answer_vi, question_vector = await cache.lookup(question)
+
+            first_token_time = None
+            if answer_vi is not None:
+                logger.info("Semantic cache hit")
+                first_token_time = time.time() - start_time
+                yield sse_event("token", {"text": answer_vi})
+            else:
+                # Không thêm độ trễ nhân tạo: thời gian tới token đầu tiên là chỉ số chính ở đây
+                parts = []
+                async for chunk in stream_answer(rag_chain, question, chat_history_str):
+                    if first_token_time is None:
+                        first_token_time = time.time() - start_time
+                        observe_stage_seconds("first_token", first_token_time)
+                    parts.append(chunk)
+                    yield sse_event("token", {"text": chunk})
+                answer_vi = "".join(parts).strip()
+                # Lỗi Gemini được ném ra trong lúc stream (sự kiện error bên dưới) nên chỉ câu trả lời thật được cache
+                if cache is not None and answer_vi:
+                    cache.add(question, answer_vi, question_vector)
+
+            # Ghi lịch sử và tin nhắn chờ đồng bộ giống /query sau khi stream kết thúc
+            with observe_stage("save_redis"):
+                await save_exchange(session_id, request.user_id, question, answer_vi)
+
+            processing_time = time.time() - start_time
+            logger.info(f"Streaming query processed in {processing_time:.2f} seconds "
+                        f"(first token after {first_token_time or 0:.2f} seconds)")
+            yield sse_event("done", {
+                "answer": answer_vi,
+                "processing_time": processing_time,
+                "time_to_first_token": first_token_time
+            })
+        except Exception as e:
+            logger.error(f"Error streaming query: {str(e)}")
+            yield sse_event("error", {"detail": f"An error occurred while processing your request: {str(e)}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/sync_now")
 async def force_sync():
     """Endpoint để kích hoạt đồng bộ dữ liệu ngay lập tức"""
+    if sync_engine is None:
+        raise HTTPException(status_code=503, detail="MySQL is not ready yet")
     try:
-        # Lấy danh sách tất cả session có tin nhắn đang chờ đồng bộ
-        session_keys = redis_client.keys("session:*:pending_msgs")
-        sync_count = 0
-        
-        if session_keys:
-            conn = get_mysql_connection()
-            
-            for key in session_keys:
-                session_id = key.decode('utf-8').split(':')[1]
-                pending_msgs = redis_client.smembers(f"session:{session_id}:pending_msgs")
-                
-                if not pending_msgs:
-                    continue
-                
-                # Cập nhật question_count trong MySQL
-                redis_count = int(redis_client.get(f"session:{session_id}:count") or 0)
-                with conn.cursor() as cursor:
-                    cursor.execute(
-                        "UPDATE chat_sessions SET question_count = %s WHERE session_id = %s",
-                        (redis_count, session_id)
-                    )
-                
-                # Đồng bộ tất cả tin nhắn đang chờ
-                for msg_key in pending_msgs:
-                    msg_data = redis_client.hgetall(msg_key.decode('utf-8'))
-                    if msg_data:
-                        # Chuyển đổi bytes sang str
-                        msg = {k.decode('utf-8'): v.decode('utf-8') for k, v in msg_data.items()}
-                        
-                        try:
-                            with conn.cursor() as cursor:
-                                # Kiểm tra xem có user_id trong dữ liệu tin nhắn không
-                                user_id_value = msg.get('user_id', None)
-                                
-                                # Tạo câu query SQL dựa trên có hay không user_id
-                                if user_id_value:
-                                    cursor.execute(
-                                        "INSERT INTO chat_messages (session_id, user_id, question, answer) VALUES (%s, %s, %s, %s)",
-                                        (session_id, user_id_value, msg['question'], msg['answer'])
-                                    )
-                                else:
-                                    cursor.execute(
-                                        "INSERT INTO chat_messages (session_id, question, answer) VALUES (%s, %s, %s)",
-                                        (session_id, msg['question'], msg['answer'])
-                                    )
-                            # Xóa tin nhắn khỏi danh sách chờ
-                            redis_client.srem(f"session:{session_id}:pending_msgs", msg_key)
-                            sync_count += 1
-                        except Exception as e:
-                            logger.error(f"Lỗi đồng bộ tin nhắn {msg_key}: {str(e)}")
-            
-            conn.commit()
-            conn.close()
-        
+        await sync_engine.requeue_legacy_pending()
+        result = await sync_engine.sync_once()
+        sync_count = result["messages"] + await message_persister.drain()
         return {"message": f"Đã đồng bộ thành công {sync_count} tin nhắn"}
     except Exception as e:
         logger.error(f"Lỗi khi đồng bộ dữ liệu: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Lỗi khi đồng bộ dữ liệu: {str(e)}")
 
+@app.get("/sync_stats")
+async def sync_stats():
+    """Thống kê hàng đợi ghi tin nhắn (stream, pending, dead letter)"""
+    if message_persister is None:
+        raise HTTPException(status_code=503, detail="Message persister not initialized")
+    return await message_persister.stats()
+
 @app.get("/chat_history/{session_id}")
-async def get_chat_history(session_id: str):
-    """Lấy lịch sử trò chuyện dựa trên session_id"""
+async def get_chat_history(session_id: str, limit: int = Query(20, ge=1, le=100), before: str | None = None):
+    """
+    Lấy lịch sử trò chuyện dựa trên session_id, mới nhất trước, phân trang theo cursor.
+
+    Trang đầu lấy từ lịch sử Redis; truyền `next_before` của trang trước vào `before`
+    để lấy các tin nhắn cũ hơn (đọc từ MySQL theo keyset).
+    """
     try:
-        # Kiểm tra xem session_id có tồn tại không
-        with mysql_conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM chat_sessions WHERE session_id = %s", (session_id,))
-            session = cursor.fetchone()
+        # Phiên còn trong Redis thì không cần MySQL để kiểm tra tồn tại
+        redis_count = await session_store.get_count(session_id)
+        question_count = redis_count
+        if question_count is None:
+            async with require_mysql_pool().acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("SELECT question_count FROM chat_sessions WHERE session_id = %s", (session_id,))
+                    session = await cursor.fetchone()
             if not session:
                 raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
-            
-            # Lấy lịch sử trò chuyện từ MySQL, sắp xếp theo thời gian giảm dần (mới nhất lên đầu)
-            cursor.execute(
-                "SELECT question, answer, timestamp FROM chat_messages WHERE session_id = %s ORDER BY timestamp DESC", 
-                (session_id,)
-            )
-            messages = cursor.fetchall()
-            
-            # Nếu không có tin nhắn trong MySQL, thử lấy từ Redis
-            if not messages:
-                # Lấy lịch sử chat từ Redis
-                chat_history = redis_client.lrange(f"session:{session_id}:history", 0, -1)
-                
-                if chat_history:
-                    # Chuyển đổi định dạng
-                    messages = []
-                    # Redis lưu tin nhắn mới nhất ở đầu (LPUSH), nên không cần đảo ngược lại
-                    for msg in chat_history:
-                        msg_str = msg.decode('utf-8')
-                        # Chia thành câu hỏi và trả lời
-                        parts = msg_str.split("\nAI: ")
-                        if len(parts) == 2:
-                            question = parts[0].replace("User: ", "")
-                            answer = parts[1]
-                            messages.append({
-                                "question": question,
-                                "answer": answer,
-                                "timestamp": None  # Redis không lưu timestamp
-                            })
-            
-            # Định dạng lại lịch sử trò chuyện để trả về
-            formatted_messages = []
-            for msg in messages:
-                formatted_msg = {
-                    "question": msg["question"],
-                    "answer": msg["answer"]
-                }
-                # Thêm timestamp nếu có
-                if "timestamp" in msg and msg["timestamp"]:
-                    formatted_msg["timestamp"] = msg["timestamp"].isoformat()
-                
-                formatted_messages.append(formatted_msg)
-            
-            return {
-                "session_id": session_id,
-                "messages": formatted_messages,
-                "question_count": session["question_count"]
-            }
+            question_count = session["question_count"]
+
+        # Chỉ bộ đếm Redis mới chắc chắn không nhỏ hơn số tin nhắn (bản MySQL có thể chưa được đồng bộ)
+        messages, next_before = await chat_history_reader.page(session_id, limit, before, question_count=redis_count)
+        return {
+            "session_id": session_id,
+            "messages": [format_message(msg) for msg in messages],
+            "question_count": question_count,
+            "next_before": next_before
+        }
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching chat history: {str(e)}")
         raise HTTPException(
@@ -481,12 +568,14 @@ async def get_chat_history(session_id: str):
 @app.on_event("shutdown")
 async def shutdown_event():
     """Close connections and stop threads on shutdown"""
-    global stop_sync_thread
-    
-    # Dừng thread đồng bộ
-    stop_sync_thread = True
-    if sync_thread:
-        sync_thread.join(timeout=5)
+    # Dừng tác vụ khởi động (nếu còn chạy) và tác vụ đồng bộ
+    for task in (startup_task, sync_task, persister_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
     
     # Đồng bộ lần cuối trước khi tắt
     try:
@@ -497,10 +586,11 @@ async def shutdown_event():
         logger.error(f"Lỗi khi đồng bộ dữ liệu lần cuối: {str(e)}")
     
     # Đóng các kết nối
-    if mysql_conn:
-        mysql_conn.close()
+    if mysql_pool:
+        await mysql_pool.close()
+    await redis_client.aclose()
     
-    logger.info("Đã đóng tất cả kết nối và dừng các thread")
+    logger.info("Đã đóng tất cả kết nối và dừng các tác vụ nền")
 
 if __name__ == "__main__":
     import uvicorn
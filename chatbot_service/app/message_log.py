@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from app.session_store import MESSAGE_STREAM_KEY, load_session_meta, session_row
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MESSAGE_GROUP = "mysql-writer"
+DEAD_LETTER_STREAM_KEY = "chat:messages:dead"
+
+# Ghi trùng (do giao lại sau khi worker chết giữa chừng) bị bỏ qua nhờ khóa UNIQUE message_uid
+INSERT_MESSAGES_SQL = (
+    "INSERT INTO chat_messages (message_uid, session_id, user_id, question, answer, timestamp) "
+    "VALUES (%s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE id = id"
+)
+
+# Phiên chỉ được tạo trong Redis; tạo dòng chat_sessions (nếu chưa có) trước khi ghi tin nhắn
+# để thỏa khóa ngoại. question_count do SyncEngine cập nhật.
+ENSURE_SESSIONS_SQL = (
+    "INSERT INTO chat_sessions (session_id, user_id, question_count, created_at) "
+    "VALUES (%s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE session_id = session_id"
+)
+
+
+class MessagePersister:
+    """
+    Consumer group đọc Redis Stream `chat:messages` và ghi tin nhắn xuống MySQL.
+
+    - Mỗi lượt XREADGROUP tối đa `batch_size` tin nhắn, ghi bằng một executemany
+      trong một giao dịch rồi XACK; tin nhắn chỉ được xác nhận sau khi đã commit.
+    - Nếu cả lô lỗi, thử ghi từng tin nhắn để cô lập bản ghi hỏng; phần còn lại
+      nằm trong pending list và được XCLAIM lại sau `claim_idle_ms`.
+    - Tin nhắn đã giao quá `max_deliveries` lần được chuyển sang stream
+      `chat:messages:dead` kèm lỗi cuối cùng để xử lý tay.
+    - Phiên của lô chưa có trong MySQL (tạo write-behind) được ghi cùng giao dịch,
+      với user_id/created_at lấy từ hash meta của phiên trong Redis.
+    - Nhiều worker dùng chung group nên việc ghi chia đều và không mất tin nhắn
+      khi một worker dừng đột ngột.
+    """
+
+    def __init__(self, redis_client, mysql_pool, stream: str = MESSAGE_STREAM_KEY, group: str = MESSAGE_GROUP,
+                 consumer: str = None, batch_size: int = 200, block_ms: int = 1000,
+                 claim_idle_ms: int = 60000, max_deliveries: int = 5,
+                 dead_letter_stream: str = DEAD_LETTER_STREAM_KEY):
+        self.redis_client = redis_client
+        self.mysql_pool = mysql_pool
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self.dead_letter_stream = dead_letter_stream
+        self._group_ready = False
+        self._last_error: Dict[str, str] = {}
+
+        self.persisted = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.reclaimed = 0
+        self.dead_lettered = 0
+
+    @classmethod
+    def from_env(cls, redis_client, mysql_pool) -> "MessagePersister":
+        return cls(
+            redis_client,
+            mysql_pool,
+            batch_size=int(os.getenv("MESSAGE_PERSIST_BATCH", "200")),
+            block_ms=int(os.getenv("MESSAGE_PERSIST_BLOCK_MS", "1000")),
+            claim_idle_ms=int(os.getenv("MESSAGE_CLAIM_IDLE_MS", "60000")),
+            max_deliveries=int(os.getenv("MESSAGE_MAX_DELIVERIES", "5")),
+        )
+
+    async def ensure_group(self):
+        """Tạo consumer group (và stream) nếu chưa có"""
+        if self._group_ready:
+            return
+        try:
+            await self.redis_client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    async def run(self):
+        """Vòng lặp nền: đọc tin nhắn mới, định kỳ nhận lại tin nhắn treo"""
+        await self.ensure_group()
+        logger.info(f"Message persister '{self.consumer}' started on {self.stream}")
+        while True:
+            try:
+                await self.reclaim()
+                await self.process_new(block_ms=self.block_ms)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Message persister error: {str(e)}")
+                await asyncio.sleep(5)
+
+    async def drain(self) -> int:
+        """Ghi ngay mọi tin nhắn đang chờ (dùng cho /sync_now và lúc tắt)"""
+        await self.ensure_group()
+        total = 0
+        while True:
+            written = await self.process_new(block_ms=None)
+            if not written:
+                break
+            total += written
+        return total
+
+    async def process_new(self, block_ms=None) -> int:
+        """Đọc một lô tin nhắn chưa giao cho ai và ghi xuống MySQL"""
+        response = await self.redis_client.xreadgroup(
+            self.group, self.consumer, {self.stream: ">"}, count=self.batch_size, block=block_ms
+        )
+        if not response:
+            return 0
+        entries = response[0][1]
+        return await self._persist(entries)
+
+    async def reclaim(self) -> int:
+        """Nhận lại tin nhắn treo quá `claim_idle_ms`; chuyển sang dead letter nếu giao quá nhiều lần"""
+        pending = await self.redis_client.xpending_range(
+            self.stream, self.group, min="-", max="+", count=self.batch_size, idle=self.claim_idle_ms
+        )
+        if not pending:
+            return 0
+
+        retry_ids, dead_ids = [], []
+        for item in pending:
+            if item["times_delivered"] >= self.max_deliveries:
+                dead_ids.append(item["message_id"])
+            else:
+                retry_ids.append(item["message_id"])
+
+        if dead_ids:
+            await self._dead_letter(dead_ids)
+
+        if not retry_ids:
+            return 0
+        # XCLAIM tăng times_delivered; chỉ nhận những tin nhắn vẫn còn treo đủ lâu
+        entries = await self.redis_client.xclaim(
+            self.stream, self.group, self.consumer, self.claim_idle_ms, retry_ids
+        )
+        entries = [(msg_id, fields) for msg_id, fields in entries if fields]
+        self.reclaimed += len(entries)
+        return await self._persist(entries) if entries else 0
+
+    async def _persist(self, entries: List[Tuple[Any, Dict]]) -> int:
+        rows, ids, bad_ids = [], [], []
+        for msg_id, fields in entries:
+            try:
+                rows.append(self._to_row(fields))
+                ids.append(msg_id)
+            except Exception as e:
+                # Bản ghi không đọc được thì không bao giờ ghi được, chuyển thẳng sang dead letter
+                self._last_error[self._id_str(msg_id)] = f"Invalid message: {str(e)}"
+                bad_ids.append(msg_id)
+        if bad_ids:
+            await self._dead_letter(bad_ids)
+        if not rows:
+            return 0
+        sessions = await self._session_rows(rows)
+
+        try:
+            await self._insert(rows, [sessions[sid] for sid in sorted(sessions)])
+            acked = ids
+        except Exception as e:
+            self.failed_batches += 1
+            logger.warning(f"Batch insert of {len(rows)} messages failed, retrying one by one: {str(e)}")
+            acked = []
+            for msg_id, row in zip(ids, rows):
+                try:
+                    await self._insert([row], [sessions[row[1]]])
+                    acked.append(msg_id)
+                except Exception as row_error:
+                    # Giữ trong pending list để XCLAIM thử lại sau
+                    self._last_error[self._id_str(msg_id)] = str(row_error)
+
+        if acked:
+            await self.redis_client.xack(self.stream, self.group, *acked)
+            for msg_id in acked:
+                self._last_error.pop(self._id_str(msg_id), None)
+            self.persisted += len(acked)
+            self.batches += 1
+        return len(acked)
+
+    async def _session_rows(self, rows: List[Tuple]) -> Dict[str, Tuple]:
+        """Dòng chat_sessions cho mỗi phiên trong lô; hash meta hết hạn thì dùng dữ liệu tin nhắn đầu tiên"""
+        first = {}
+        for row in rows:
+            first.setdefault(row[1], row)
+        metas = await load_session_meta(self.redis_client, first)
+        return {
+            session_id: session_row(session_id, metas.get(session_id), user_id=row[2], created_at=row[5])
+            for session_id, row in first.items()
+        }
+
+    async def _insert(self, rows: List[Tuple], sessions: List[Tuple]):
+        async with self.mysql_pool.acquire() as conn:
+            await conn.begin()
+            try:
+                async with conn.cursor() as cursor:
+                    # Thứ tự session_id cố định (như SyncEngine) để hai bên không khóa chéo nhau
+                    await cursor.executemany(ENSURE_SESSIONS_SQL, sessions)
+                    await cursor.executemany(INSERT_MESSAGES_SQL, rows)
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+    async def _dead_letter(self, msg_ids: List[Any]):
+        """Chép tin nhắn sang stream dead letter rồi XACK khỏi group"""
+        for msg_id in msg_ids:
+            entries = await self.redis_client.xrange(self.stream, min=msg_id, max=msg_id)
+            fields = dict(entries[0][1]) if entries else {}
+            fields[b"original_id"] = msg_id
+            fields[b"error"] = self._last_error.pop(self._id_str(msg_id), "max deliveries exceeded")
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.xadd(self.dead_letter_stream, fields)
+                pipe.xack(self.stream, self.group, msg_id)
+                await pipe.execute()
+            self.dead_lettered += 1
+            logger.error(f"Message {self._id_str(msg_id)} moved to {self.dead_letter_stream}")
+
+    @staticmethod
+    def _id_str(msg_id) -> str:
+        return msg_id.decode('utf-8') if isinstance(msg_id, bytes) else str(msg_id)
+
+    @staticmethod
+    def _to_row(fields: Dict) -> Tuple:
+        msg = {
+            (k.decode('utf-8') if isinstance(k, bytes) else k): (v.decode('utf-8') if isinstance(v, bytes) else v)
+            for k, v in fields.items()
+        }
+        timestamp = msg.get('timestamp')
+        return (
+            msg['message_uid'],
+            msg['session_id'],
+            msg.get('user_id') or None,
+            msg['question'],
+            msg['answer'],
+            datetime.fromisoformat(timestamp) if timestamp else datetime.now()
+        )
+
+    async def stats(self) -> Dict[str, Any]:
+        stream_length = await self.redis_client.xlen(self.stream)
+        dead_length = await self.redis_client.xlen(self.dead_letter_stream)
+        pending = 0
+        if self._group_ready:
+            summary = await self.redis_client.xpending(self.stream, self.group)
+            pending = summary["pending"]
+        return {
+            "consumer": self.consumer,
+            "stream_length": stream_length,
+            "pending": pending,
+            "dead_letter_length": dead_length,
+            "persisted": self.persisted,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "reclaimed": self.reclaimed,
+            "dead_lettered": self.dead_lettered,
+        }
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -237,8 +237,13 @@ class ChatSessions(Base):
 
 class ChatMessages(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # Phân trang keyset của /chat_history (migrations/002)
+        Index("idx_chat_messages_session_ts", "session_id", "timestamp", "id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
+    message_uid = Column(String(32), unique=True, nullable=True)
     session_id = Column(String(255), ForeignKey("chat_sessions.session_id"))
     user_id = Column(Integer, ForeignKey("users.user_id"))
     question = Column(Text, nullable=False)
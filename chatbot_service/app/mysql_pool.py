@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict
+
+import aiomysql
+from dotenv import load_dotenv
+
+# Ensure environment variables are loaded
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class MySQLPool:
+    """
+    Pool kết nối MySQL bất đồng bộ có giới hạn, tự phục hồi.
+
+    - Mỗi request mượn một kết nối riêng qua `acquire()` và trả lại khi xong.
+    - Kết nối bị đóng và mở lại sau `pool_recycle` giây (nhỏ hơn `wait_timeout` của MySQL).
+    - Kết nối nhàn rỗi lâu hơn `ping_interval` giây được ping (kèm reconnect) trước khi dùng.
+    - Thống kê số lần mượn, thời gian chờ và số lần hết thời gian chờ.
+    """
+
+    def __init__(self, host, port, user, password, db, minsize: int = 1, maxsize: int = 10,
+                 acquire_timeout: float = 5.0, pool_recycle: int = 3600, ping_interval: float = 30.0):
+        self._connect_kwargs = {
+            "host": host,
+            "port": port,
+            "user": user,
+            "password": password,
+            "db": db,
+            "charset": "utf8mb4",
+        }
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.acquire_timeout = acquire_timeout
+        self.pool_recycle = pool_recycle
+        self.ping_interval = ping_interval
+        self._pool = None
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.pings = 0
+        self.ping_failures = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.waiting = 0
+
+    @classmethod
+    def from_env(cls) -> "MySQLPool":
+        return cls(
+            host=os.getenv("MYSQL_HOST"),
+            port=int(os.getenv("MYSQL_PORT", "3306")),
+            user=os.getenv("MYSQL_USER"),
+            password=os.getenv("MYSQL_PASSWORD"),
+            db=os.getenv("MYSQL_DATABASE"),
+            minsize=int(os.getenv("MYSQL_POOL_MIN_SIZE", "1")),
+            maxsize=int(os.getenv("MYSQL_POOL_SIZE", "10")),
+            acquire_timeout=float(os.getenv("MYSQL_POOL_TIMEOUT", "5")),
+            pool_recycle=int(os.getenv("MYSQL_POOL_RECYCLE", "3600")),
+            ping_interval=float(os.getenv("MYSQL_POOL_PING_INTERVAL", "30")),
+        )
+
+    async def open(self):
+        # autocommit để truy vấn SELECT không giữ snapshot giao dịch cũ giữa các lần mượn
+        self._pool = await aiomysql.create_pool(
+            minsize=self.minsize,
+            maxsize=self.maxsize,
+            pool_recycle=self.pool_recycle,
+            autocommit=True,
+            cursorclass=aiomysql.DictCursor,
+            **self._connect_kwargs
+        )
+        logger.info(f"MySQL pool opened (size {self.minsize}-{self.maxsize})")
+        return self
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Mượn một kết nối, ping nếu đã nhàn rỗi lâu, rồi trả lại pool khi xong"""
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            conn = await asyncio.wait_for(self._pool.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise TimeoutError(f"Timed out after {self.acquire_timeout}s waiting for a MySQL connection")
+        finally:
+            self.waiting -= 1
+        wait = time.perf_counter() - start
+        self.checkouts += 1
+        self.wait_seconds_total += wait
+        self.wait_seconds_max = max(self.wait_seconds_max, wait)
+
+        try:
+            last_used = getattr(conn, "_pool_last_used", None)
+            if last_used is None or time.monotonic() - last_used > self.ping_interval:
+                self.pings += 1
+                try:
+                    await conn.ping(reconnect=True)
+                except Exception:
+                    self.ping_failures += 1
+                    raise
+            yield conn
+        except BaseException:
+            # Không trả về pool một kết nối đang dở giao dịch hoặc đã hỏng
+            conn.close()
+            raise
+        finally:
+            conn._pool_last_used = time.monotonic()
+            self._pool.release(conn)
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        size = self._pool.size if self._pool is not None else 0
+        free = self._pool.freesize if self._pool is not None else 0
+        return {
+            "size": size,
+            "max_size": self.maxsize,
+            "in_use": size - free,
+            "idle": free,
+            "waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "pings": self.pings,
+            "ping_failures": self.ping_failures,
+            "wait_seconds_total": round(self.wait_seconds_total, 4),
+            "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 4) if self.checkouts else 0.0,
+            "wait_seconds_max": round(self.wait_seconds_max, 4),
+        }
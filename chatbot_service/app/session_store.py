@@ -0,0 +1,249 @@
+import json
+import logging
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tập các session có thay đổi chưa được đồng bộ xuống MySQL
+DIRTY_SESSIONS_KEY = "sessions:dirty"
+
+# Redis Stream ghi lại mọi tin nhắn đã trả lời (write-behind log xuống MySQL)
+MESSAGE_STREAM_KEY = "chat:messages"
+
+def meta_key(session_id: str) -> str:
+    """Hash thông tin phiên: user_id (chủ phiên), count (số câu hỏi), created_at"""
+    return f"session:{session_id}:meta"
+
+
+def legacy_count_key(session_id: str) -> str:
+    """Bộ đếm riêng theo định dạng cũ; chỉ còn được đọc khi khôi phục/đồng bộ phiên cũ"""
+    return f"session:{session_id}:count"
+
+
+async def load_session_meta(redis_client, session_ids) -> Dict[str, Dict[str, str]]:
+    """Đọc hash thông tin của nhiều phiên trong một round trip (phiên không còn trong Redis bị bỏ qua)"""
+    session_ids = list(session_ids)
+    if not session_ids:
+        return {}
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for session_id in session_ids:
+            pipe.hgetall(meta_key(session_id))
+        results = await pipe.execute()
+    return {
+        session_id: {k.decode('utf-8'): v.decode('utf-8') for k, v in meta.items()}
+        for session_id, meta in zip(session_ids, results) if meta
+    }
+
+
+def session_row(session_id: str, meta: Optional[Dict[str, str]], question_count: int = 0,
+                user_id=None, created_at: Optional[datetime] = None) -> Tuple:
+    """
+    Dòng (session_id, user_id, question_count, created_at) cho chat_sessions; ưu tiên thông tin
+    trong hash meta, nếu hết hạn thì dùng giá trị dự phòng của người gọi.
+    """
+    meta = meta or {}
+    owner = meta.get("user_id") or user_id or None
+    created = meta.get("created_at")
+    return (
+        session_id,
+        int(owner) if owner is not None else None,
+        question_count,
+        datetime.fromisoformat(created) if created else (created_at or datetime.now())
+    )
+
+
+# Kết quả của bước kiểm tra giới hạn câu hỏi
+SESSION_FORBIDDEN = -2  # user_id của request khác chủ phiên
+SESSION_MISSING = -1  # Không có thông tin phiên trong Redis, cần khôi phục từ MySQL
+QUOTA_EXCEEDED = 0
+QUOTA_OK = 1
+
+# Kiểm tra chủ phiên + giới hạn + tăng bộ đếm + lấy lịch sử trong một lệnh nguyên tử.
+# KEYS[1] = session:{id}:meta, KEYS[2] = session:{id}:history, KEYS[3] = sessions:dirty,
+# KEYS[4] = session:{id}:count (định dạng cũ, được gộp vào hash ở lần hỏi đầu tiên)
+# ARGV[1] = số câu hỏi tối đa mỗi phiên, ARGV[2] = session_id, ARGV[3] = user_id của request ('' nếu không có),
+# ARGV[4] = TTL (giây, được làm mới mỗi lần hỏi để thông tin phiên đang dùng không hết hạn)
+CHECK_AND_INCREMENT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {-1, 0, {}}
+end
+if ARGV[3] ~= '' then
+    local owner = redis.call('HGET', KEYS[1], 'user_id')
+    if owner and owner ~= ARGV[3] then
+        return {-2, 0, {}}
+    end
+end
+local count = redis.call('HGET', KEYS[1], 'count')
+if not count then
+    count = redis.call('GET', KEYS[4])
+    if not count then
+        return {-1, 0, {}}
+    end
+    redis.call('HSET', KEYS[1], 'count', count)
+    redis.call('DEL', KEYS[4])
+end
+if tonumber(count) >= tonumber(ARGV[1]) then
+    return {0, tonumber(count), {}}
+end
+count = redis.call('HINCRBY', KEYS[1], 'count', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('SADD', KEYS[3], ARGV[2])
+return {1, count, redis.call('LRANGE', KEYS[2], 0, -1)}
+"""
+
+# Nạp thông tin phiên từ MySQL nếu chưa có request khác nạp trước (HSETNX không ghi đè).
+# Bộ đếm cũ (nếu còn) có thể đi trước MySQL do chưa đồng bộ, nên lấy giá trị lớn hơn.
+# KEYS[1] = session:{id}:meta, KEYS[2] = session:{id}:count (định dạng cũ)
+# ARGV[1] = question_count, ARGV[2] = created_at, ARGV[3] = TTL, ARGV[4] = user_id ('' nếu không có)
+RESTORE_SCRIPT = """
+local count = math.max(tonumber(ARGV[1]), tonumber(redis.call('GET', KEYS[2]) or '0'))
+redis.call('HSETNX', KEYS[1], 'count', count)
+redis.call('HSETNX', KEYS[1], 'created_at', ARGV[2])
+if ARGV[4] ~= '' then
+    redis.call('HSETNX', KEYS[1], 'user_id', ARGV[4])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('DEL', KEYS[2])
+return 1
+"""
+
+
+def encode_history_entry(message_uid: str, question: str, answer: str, timestamp: str) -> str:
+    """Một phần tử của `session:{id}:history` (JSON, giữ message_uid để khử trùng với MySQL)."""
+    return json.dumps(
+        {"message_uid": message_uid, "question": question, "answer": answer, "timestamp": timestamp},
+        ensure_ascii=False
+    )
+
+
+def decode_history_entry(raw) -> Optional[Dict[str, Any]]:
+    """
+    Đọc một phần tử lịch sử; phần tử kiểu cũ "User: ...\nAI: ..." (ghi trước khi đổi sang JSON)
+    vẫn đọc được nhưng không có message_uid/timestamp.
+    """
+    text = raw.decode('utf-8') if isinstance(raw, bytes) else raw
+    if text.startswith("{"):
+        try:
+            return json.loads(text)
+        except ValueError:
+            pass
+    parts = text.split("\nAI: ", 1)
+    if len(parts) != 2:
+        return None
+    return {"message_uid": None, "question": parts[0].replace("User: ", "", 1), "answer": parts[1], "timestamp": None}
+
+
+def format_history_entry(entry: Dict[str, Any]) -> str:
+    """Dạng dùng trong prompt"""
+    return f"User: {entry['question']}\nAI: {entry['answer']}"
+
+
+class SessionStore:
+    """
+    Bookkeeping phiên chat trên Redis với số round trip tối thiểu.
+
+    - `check_and_increment`: một lời gọi script Lua kiểm tra chủ phiên, giới hạn
+      câu hỏi, tăng bộ đếm và trả về lịch sử; chạy nguyên tử nên hai request đồng
+      thời không thể cùng vượt giới hạn.
+    - `save_exchange`: một pipeline MULTI/EXEC ghi lịch sử và nối tin nhắn vào
+      Redis Stream `chat:messages` để MessagePersister ghi xuống MySQL. Phần tử
+      lịch sử là JSON kèm message_uid nên /chat_history ghép được với MySQL.
+
+    Mỗi lần tăng bộ đếm đánh dấu session vào `sessions:dirty` để SyncEngine
+    chỉ đồng bộ question_count của những session thực sự thay đổi.
+
+    Thông tin phiên (chủ phiên, bộ đếm, thời điểm tạo) nằm trong một hash
+    `session:{id}:meta`; khi hash hết hạn, `restore` nạp lại một lần từ MySQL nên
+    /query ở trạng thái ổn định không chạm MySQL.
+
+    Phiên mới chỉ được tạo trong Redis (`create`); dòng chat_sessions được ghi
+    write-behind khi phiên có câu hỏi đầu tiên (SyncEngine hoặc MessagePersister,
+    bên nào chạy trước). Phiên hết hạn mà chưa hỏi gì không bao giờ xuống MySQL.
+    """
+
+    def __init__(self, redis_client, question_limit: int = 30, ttl: int = 86400, history_length: int = 10,
+                 stream_maxlen: int = 100000):
+        self.redis_client = redis_client
+        self.question_limit = question_limit
+        self.ttl = ttl
+        self.history_length = history_length
+        self.stream_maxlen = stream_maxlen
+        self._check_and_increment = redis_client.register_script(CHECK_AND_INCREMENT_SCRIPT)
+        self._restore = redis_client.register_script(RESTORE_SCRIPT)
+
+    async def create(self, session_id: str, user_id: Optional[int] = None, question_count: int = 0):
+        """Khởi tạo thông tin cho phiên mới (chỉ trong Redis)"""
+        meta = {"count": question_count, "created_at": datetime.now().isoformat()}
+        if user_id is not None:
+            meta["user_id"] = user_id
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(meta_key(session_id), mapping=meta)
+            pipe.expire(meta_key(session_id), self.ttl)
+            await pipe.execute()
+
+    async def restore(self, session_id: str, question_count: int, user_id: Optional[int] = None,
+                      created_at: Optional[datetime] = None):
+        """Khôi phục thông tin phiên từ MySQL; không ghi đè nếu request khác đã khôi phục trước"""
+        await self._restore(
+            keys=[meta_key(session_id), legacy_count_key(session_id)],
+            args=[question_count, (created_at or datetime.now()).isoformat(), self.ttl,
+                  "" if user_id is None else user_id]
+        )
+
+    async def check_and_increment(self, session_id: str, user_id: Optional[int] = None) -> Tuple[int, int, List[str]]:
+        """
+        Returns:
+            (trạng thái, số câu hỏi hiện tại, lịch sử mới nhất trước) với trạng thái là
+            QUOTA_OK, QUOTA_EXCEEDED, SESSION_FORBIDDEN hoặc SESSION_MISSING
+        """
+        status, count, history = await self._check_and_increment(
+            keys=[meta_key(session_id), f"session:{session_id}:history", DIRTY_SESSIONS_KEY,
+                  legacy_count_key(session_id)],
+            args=[self.question_limit, session_id, "" if user_id is None else user_id, self.ttl]
+        )
+        entries = (decode_history_entry(msg) for msg in history)
+        return int(status), int(count), [format_history_entry(entry) for entry in entries if entry]
+
+    async def recent_messages(self, session_id: str) -> List[Dict[str, Any]]:
+        """Các tin nhắn còn trong danh sách lịch sử Redis, mới nhất trước"""
+        history = await self.redis_client.lrange(f"session:{session_id}:history", 0, -1)
+        entries = (decode_history_entry(msg) for msg in history)
+        return [entry for entry in entries if entry]
+
+    async def get_count(self, session_id: str) -> Optional[int]:
+        """Số câu hỏi hiện tại trong Redis (None nếu phiên không còn trong Redis)"""
+        count = await self.redis_client.hget(meta_key(session_id), "count")
+        return int(count) if count is not None else None
+
+    async def save_exchange(self, session_id: str, user_id: Optional[int], question: str, answer: str) -> str:
+        """
+        Ghi câu hỏi/trả lời vào lịch sử và log tin nhắn trong một round trip.
+
+        Returns:
+            message_uid duy nhất của tin nhắn (dùng làm khóa chống trùng khi ghi MySQL)
+        """
+        history_key = f"session:{session_id}:history"
+        message_uid = uuid.uuid4().hex
+        timestamp = datetime.now().isoformat()
+        message_data = {
+            "message_uid": message_uid,
+            "session_id": session_id,
+            "question": question,
+            "answer": answer,
+            "timestamp": timestamp
+        }
+        # Chỉ thêm user_id vào dữ liệu nếu có
+        if user_id is not None:
+            message_data["user_id"] = user_id
+
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.lpush(history_key, encode_history_entry(message_uid, question, answer, timestamp))
+            pipe.ltrim(history_key, 0, self.history_length - 1)
+            pipe.expire(history_key, self.ttl)
+            pipe.xadd(MESSAGE_STREAM_KEY, message_data, maxlen=self.stream_maxlen, approximate=True)
+            await pipe.execute()
+        return message_uid
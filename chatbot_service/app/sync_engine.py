@@ -0,0 +1,146 @@
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+from app.session_store import DIRTY_SESSIONS_KEY, legacy_count_key, meta_key, session_row
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class SyncEngine:
+    """
+    Đồng bộ write-behind từ Redis xuống MySQL dựa trên tập session thay đổi.
+
+    Mỗi lượt lấy (SPOP) tối đa `batch_size` session từ `sessions:dirty`, đọc hash
+    `session:{id}:meta` bằng pipeline, rồi ghi xuống MySQL bằng một câu upsert nhiều
+    dòng cho question_count. Chi phí tỉ lệ với lượng dữ liệu thay đổi thay vì tổng số session.
+
+    Phiên được tạo chỉ trong Redis, nên upsert này cũng là lần đầu phiên xuất hiện trong
+    MySQL (user_id, created_at lấy từ cùng hash đó).
+
+    Tin nhắn mới được ghi qua Redis Stream bởi MessagePersister; tập `pending_msgs`
+    chỉ còn được đọc để xả nốt các tin nhắn ghi theo định dạng cũ. Phiên có tin nhắn cũ
+    nhưng không còn request nào (nên không vào tập dirty) được `requeue_legacy_pending`
+    đưa vào tập dirty lúc khởi động và khi gọi /sync_now.
+    """
+
+    def __init__(self, redis_client, mysql_pool, batch_size: int = 500):
+        self.redis_client = redis_client
+        self.mysql_pool = mysql_pool
+        self.batch_size = batch_size
+
+    async def requeue_legacy_pending(self) -> int:
+        """
+        Đánh dấu dirty mọi phiên còn tập `session:{id}:pending_msgs` (định dạng trước write-behind
+        qua Stream), để lượt đồng bộ kế tiếp ghi nốt tin nhắn của chúng xuống MySQL.
+
+        Returns:
+            Số phiên được đưa lại vào tập dirty
+        """
+        session_ids = []
+        async for key in self.redis_client.scan_iter(match="session:*:pending_msgs", count=1000):
+            key = key.decode('utf-8') if isinstance(key, bytes) else key
+            session_ids.append(key[len("session:"):-len(":pending_msgs")])
+        for i in range(0, len(session_ids), self.batch_size):
+            await self.redis_client.sadd(DIRTY_SESSIONS_KEY, *session_ids[i:i + self.batch_size])
+        if session_ids:
+            logger.info(f"Requeued {len(session_ids)} sessions with legacy pending messages")
+        return len(session_ids)
+
+    async def sync_once(self) -> Dict[str, int]:
+        """Đồng bộ toàn bộ session đang có trong tập dirty"""
+        totals = {"sessions": 0, "messages": 0}
+        while True:
+            raw_ids = await self.redis_client.spop(DIRTY_SESSIONS_KEY, self.batch_size)
+            if not raw_ids:
+                break
+            # Sắp xếp để khóa dòng chat_sessions theo cùng thứ tự với MessagePersister
+            session_ids = sorted(sid.decode('utf-8') for sid in raw_ids)
+            try:
+                synced = await self._sync_batch(session_ids)
+            except Exception:
+                # Trả lại các session vào tập dirty để lượt sau thử lại
+                await self.redis_client.sadd(DIRTY_SESSIONS_KEY, *session_ids)
+                raise
+            totals["sessions"] += synced["sessions"]
+            totals["messages"] += synced["messages"]
+        return totals
+
+    async def _sync_batch(self, session_ids: List[str]) -> Dict[str, int]:
+        # Đọc bộ đếm và danh sách tin nhắn chờ của cả lô trong một round trip
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for session_id in session_ids:
+                pipe.hgetall(meta_key(session_id))
+                pipe.smembers(f"session:{session_id}:pending_msgs")
+                pipe.get(legacy_count_key(session_id))
+            results = await pipe.execute()
+
+        counts = []
+        pending = []  # (session_id, msg_key)
+        for i, session_id in enumerate(session_ids):
+            meta, msg_keys, legacy_count = results[3 * i], results[3 * i + 1], results[3 * i + 2]
+            meta = {k.decode('utf-8'): v.decode('utf-8') for k, v in meta.items()}
+            count = meta.get("count", legacy_count)
+            if count is not None:
+                counts.append(session_row(session_id, meta, int(count)))
+            pending.extend((session_id, key.decode('utf-8')) for key in msg_keys)
+
+        # Đọc nội dung tất cả tin nhắn chờ trong một round trip
+        messages = []
+        if pending:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for _, msg_key in pending:
+                    pipe.hgetall(msg_key)
+                hashes = await pipe.execute()
+            for (session_id, msg_key), msg_data in zip(pending, hashes):
+                if not msg_data:
+                    continue  # Tin nhắn đã hết hạn trong Redis
+                msg = {k.decode('utf-8'): v.decode('utf-8') for k, v in msg_data.items()}
+                timestamp = msg.get('timestamp')
+                messages.append((
+                    session_id,
+                    msg.get('user_id') or None,
+                    msg['question'],
+                    msg['answer'],
+                    datetime.fromisoformat(timestamp) if timestamp else datetime.now()
+                ))
+
+        if not counts and not messages:
+            return {"sessions": 0, "messages": 0}
+
+        async with self.mysql_pool.acquire() as conn:
+            await conn.begin()
+            try:
+                async with conn.cursor() as cursor:
+                    if counts:
+                        placeholders = ", ".join(["(%s, %s, %s, %s)"] * len(counts))
+                        params = [value for row in counts for value in row]
+                        await cursor.execute(
+                            "INSERT INTO chat_sessions (session_id, user_id, question_count, created_at) "
+                            f"VALUES {placeholders} "
+                            "ON DUPLICATE KEY UPDATE question_count = VALUES(question_count)",
+                            params
+                        )
+                    if messages:
+                        await cursor.executemany(
+                            "INSERT INTO chat_messages (session_id, user_id, question, answer, timestamp) "
+                            "VALUES (%s, %s, %s, %s, %s)",
+                            messages
+                        )
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+        # Xóa các tin nhắn đã ghi xuống MySQL khỏi hàng đợi
+        if pending:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for session_id, msg_key in pending:
+                    pipe.srem(f"session:{session_id}:pending_msgs", msg_key)
+                    pipe.delete(msg_key)
+                await pipe.execute()
+
+        logger.info(f"Synced {len(counts)} sessions and {len(messages)} messages to MySQL")
+        return {"sessions": len(counts), "messages": len(messages)}
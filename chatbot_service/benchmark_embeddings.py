@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Script so sánh backend embedding "torch" (HuggingFaceEmbeddings) và "onnx" (onnxruntime int8):
+thời gian tải, RSS bộ nhớ, độ trễ embed_query / embed_documents, và mức độ
+trùng khớp kết quả truy xuất so với model torch (cosine và overlap top-k).
+
+Mỗi backend chạy trong một tiến trình con riêng để đo bộ nhớ chính xác.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Add the parent directory to sys.path to allow imports from src
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_QUESTIONS = [
+    "Chế độ ăn uống lành mạnh là gì?",
+    "Tôi muốn giảm cân, nên ăn gì?",
+    "Thực phẩm nào giàu vitamin C?",
+    "Phụ nữ mang thai nên bổ sung chất gì?",
+    "Trẻ em bị dị ứng sữa bò nên ăn gì thay thế?",
+]
+
+def percentile(values, pct):
+    """Tính percentile theo phương pháp nearest-rank."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def rss_mb():
+    """RSS hiện tại của tiến trình (MB), đọc từ /proc."""
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+def load_corpus(max_docs):
+    """Lấy các đoạn văn bản từ thư mục Data giống lúc tạo index."""
+    from src.helper import load_pdf_file, text_split
+    data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data")
+    chunks = text_split(load_pdf_file(data_directory))
+    return [chunk.page_content for chunk in chunks[:max_docs]]
+
+def run_backend(backend, corpus_file, questions_file, output_dir, repeat):
+    """Chạy trong tiến trình con: đo một backend và lưu vector ra file .npy."""
+    from src.embeddings import create_embeddings
+
+    with open(corpus_file, encoding="utf-8") as f:
+        corpus = json.load(f)
+    with open(questions_file, encoding="utf-8") as f:
+        questions = json.load(f)
+
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    embeddings = create_embeddings(backend)
+    embeddings.embed_query("khởi động")  # warm-up
+    load_seconds = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(repeat):
+        for question in questions:
+            t = time.perf_counter()
+            embeddings.embed_query(question)
+            latencies.append(time.perf_counter() - t)
+
+    t = time.perf_counter()
+    doc_vectors = np.asarray(embeddings.embed_documents(corpus), dtype=np.float32)
+    documents_seconds = time.perf_counter() - t
+    query_vectors = np.asarray([embeddings.embed_query(q) for q in questions], dtype=np.float32)
+
+    np.save(os.path.join(output_dir, f"{backend}_docs.npy"), doc_vectors)
+    np.save(os.path.join(output_dir, f"{backend}_queries.npy"), query_vectors)
+    print(json.dumps({
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "rss_mb": rss_mb(),
+        "model_rss_mb": rss_mb() - rss_before,
+        "query_p50_ms": percentile(latencies, 50) * 1000,
+        "query_p95_ms": percentile(latencies, 95) * 1000,
+        "query_mean_ms": statistics.mean(latencies) * 1000,
+        "docs_per_second": len(corpus) / documents_seconds if documents_seconds else 0.0,
+    }))
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def agreement(output_dir, baseline, candidate, k):
+    """So sánh vector và top-k truy xuất của candidate với baseline."""
+    base_docs = normalize(np.load(os.path.join(output_dir, f"{baseline}_docs.npy")))
+    cand_docs = normalize(np.load(os.path.join(output_dir, f"{candidate}_docs.npy")))
+    base_queries = normalize(np.load(os.path.join(output_dir, f"{baseline}_queries.npy")))
+    cand_queries = normalize(np.load(os.path.join(output_dir, f"{candidate}_queries.npy")))
+
+    cosines = np.concatenate([(base_docs * cand_docs).sum(axis=1), (base_queries * cand_queries).sum(axis=1)])
+    k = min(k, len(base_docs))
+    base_top = np.argsort(-(base_queries @ base_docs.T), axis=1)[:, :k]
+    cand_top = np.argsort(-(cand_queries @ cand_docs.T), axis=1)[:, :k]
+    overlaps = [len(set(b) & set(c)) / k for b, c in zip(base_top, cand_top)]
+    return {
+        "mean_cosine": float(cosines.mean()),
+        "min_cosine": float(cosines.min()),
+        f"top{k}_overlap": float(np.mean(overlaps)),
+        "top1_match": float(np.mean(base_top[:, 0] == cand_top[:, 0])),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh backend embedding torch và onnx")
+    parser.add_argument("--backends", type=str, default="torch,onnx", help="Danh sách backend, cách nhau bởi dấu phẩy")
+    parser.add_argument("--questions", type=str, help="File chứa câu hỏi, mỗi dòng một câu")
+    parser.add_argument("--max-docs", type=int, default=500, help="Số đoạn văn bản tối đa dùng làm corpus")
+    parser.add_argument("--repeat", type=int, default=20, help="Số lần lặp lại bộ câu hỏi khi đo độ trễ")
+    parser.add_argument("--top-k", type=int, default=3, help="k khi so sánh kết quả truy xuất")
+    parser.add_argument("--run-backend", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_backend:
+        run_backend(args.run_backend, os.path.join(args.workdir, "corpus.json"),
+                    os.path.join(args.workdir, "questions.json"), args.workdir, args.repeat)
+        return
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, "corpus.json"), "w", encoding="utf-8") as f:
+            json.dump(load_corpus(args.max_docs), f, ensure_ascii=False)
+        with open(os.path.join(workdir, "questions.json"), "w", encoding="utf-8") as f:
+            json.dump(questions, f, ensure_ascii=False)
+
+        results = []
+        for backend in backends:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--run-backend", backend,
+                 "--workdir", workdir, "--repeat", str(args.repeat)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+        print(f"{'backend':<8} {'load s':>7} {'RSS MB':>8} {'model MB':>9} {'p50 ms':>8} {'p95 ms':>8} {'docs/s':>8}")
+        for r in results:
+            print(f"{r['backend']:<8} {r['load_seconds']:>7.2f} {r['rss_mb']:>8.0f} {r['model_rss_mb']:>9.0f} "
+                  f"{r['query_p50_ms']:>8.1f} {r['query_p95_ms']:>8.1f} {r['docs_per_second']:>8.1f}")
+
+        baseline = backends[0]
+        for candidate in backends[1:]:
+            print(f"\nAgreement {candidate} vs {baseline}: "
+                  f"{json.dumps(agreement(workdir, baseline, candidate, args.top_k))}")
+
+if __name__ == "__main__":
+    main()
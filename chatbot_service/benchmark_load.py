@@ -0,0 +1,581 @@
+#!/usr/bin/env python3
+"""
+Benchmark tải chạy hoàn toàn offline cho chatbot service.
+
+App FastAPI được gọi trực tiếp qua ASGI trong cùng tiến trình, với:
+- Gemini giả: câu trả lời xác định theo prompt, độ trễ cấu hình được, vẫn đi qua
+  GeminiLLM, LLMScheduler và cache dịch như khi chạy thật
+- Redis giả trong tiến trình (fakeredis, có Lua và Streams)
+- SQLite thay MySQL (hoặc MySQL thật trong container local với --mysql)
+- Index vector cục bộ (LocalVectorStore) dựng từ corpus tổng hợp
+
+Trong lúc gửi /new_session, /query và /chat_history với số request đồng thời cho
+trước, SyncEngine và MessagePersister chạy nền như trong app. Kết quả là thông
+lượng và p50/p95/p99 của từng endpoint; --baseline so với một lần chạy trước và
+trả exit code 1 khi p95 tệ hơn ngưỡng cho phép, để bắt regression trước khi deploy.
+
+Cài phụ thuộc riêng cho benchmark: pip install -r requirements-dev.txt
+
+Ví dụ:
+    python benchmark_load.py --requests 300 --concurrency 32 --llm-latency 0.3
+    python benchmark_load.py --output bench.json
+    python benchmark_load.py --baseline bench.json --max-regression 0.2
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+# Add the parent directory to sys.path to allow imports from src
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_QUESTIONS = [
+    "Bạn có thể giới thiệu về chế độ ăn uống lành mạnh không?",
+    "Tôi muốn giảm cân, nên ăn gì?",
+    "Có thực đơn nào phù hợp cho người cao huyết áp?",
+    "Tôi nên ăn gì để tăng cơ bắp?",
+    "Thực phẩm nào giàu vitamin C?",
+    "Có thể gợi ý món ăn cho bữa sáng không?",
+    "Làm thế nào để có một chế độ ăn cân bằng?",
+    "Trái cây nào tốt cho sức khỏe?",
+    "Tôi nên ăn bao nhiêu calo mỗi ngày?",
+    "Có món ăn nào dễ làm cho người bận rộn?",
+]
+
+QUESTION_LIMIT = 30  # Giới hạn câu hỏi mỗi phiên của SessionStore
+
+def percentile(values, pct):
+    """Tính percentile theo phương pháp nearest-rank."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+# --- Gemini giả ---
+
+class FakeGeminiModel:
+    """
+    Thay genai.GenerativeModel: nội dung và độ trễ chỉ phụ thuộc prompt, nên hai lần chạy
+    cùng cấu hình cho cùng tải. Độ trễ = latency + jitter * (0..1 suy ra từ hash của prompt).
+    """
+
+    def __init__(self, latency: float, jitter: float):
+        self.latency = latency
+        self.jitter = jitter
+
+    def _reply(self, prompt: str):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        delay = self.latency + self.jitter * int(digest[:4], 16) / 0xFFFF
+        text = f"Câu trả lời mẫu {digest[4:12]}: nên ăn đa dạng rau, đạm nạc và ngũ cốc nguyên hạt."
+        usage = SimpleNamespace(
+            prompt_token_count=len(prompt) // 4,
+            candidates_token_count=len(text) // 4,
+            total_token_count=(len(prompt) + len(text)) // 4,
+        )
+        return SimpleNamespace(text=text, usage_metadata=usage), delay
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        response, delay = self._reply(str(prompt))
+        time.sleep(delay)
+        return [response] if stream else response
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        response, delay = self._reply(str(prompt))
+        await asyncio.sleep(delay)
+        if stream:
+            async def chunks():
+                yield response
+            return chunks()
+        return response
+
+def create_fake_llm(model: FakeGeminiModel):
+    """GeminiLLM dùng model giả: vẫn đi qua scheduler, token_usage và metrics như thật."""
+    from langchain_core.language_models import LLM
+    from src.prompt import GeminiLLM
+
+    class FakeGeminiLLM(GeminiLLM):
+        def __init__(self):
+            LLM.__init__(self)
+            self.model_name = "fake-gemini"
+            self.model = model
+
+    return FakeGeminiLLM()
+
+# --- SQLite thay MySQL ---
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    session_id TEXT PRIMARY KEY,
+    user_id INTEGER,
+    question_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_uid TEXT UNIQUE,
+    session_id TEXT NOT NULL,
+    user_id INTEGER,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_ts ON chat_messages (session_id, timestamp, id);
+"""
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda raw: datetime.fromisoformat(raw.decode("utf-8")))
+
+def to_sqlite(sql: str) -> str:
+    """Chuyển các câu lệnh MySQL mà app dùng sang cú pháp SQLite."""
+    sql = sql.replace("%s", "?")
+    sql = sql.replace("ON DUPLICATE KEY UPDATE id = id", "ON CONFLICT DO NOTHING")
+    sql = sql.replace("ON DUPLICATE KEY UPDATE", "ON CONFLICT DO UPDATE SET")
+    return re.sub(r"VALUES\((\w+)\)", r"excluded.\1", sql)
+
+class SQLiteCursor:
+    """Giao diện con trỏ aiomysql.DictCursor; lệnh SQLite chạy trong thread như I/O mạng."""
+
+    def __init__(self, connection: "SQLiteConnection"):
+        self._connection = connection
+        self._cursor = connection.raw.cursor()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._cursor.close()
+
+    async def _run(self, fn, *args):
+        if self._connection.latency:
+            await asyncio.sleep(self._connection.latency)
+        return await asyncio.to_thread(fn, *args)
+
+    async def execute(self, sql, params=()):
+        await self._run(self._cursor.execute, to_sqlite(sql), tuple(params or ()))
+        return self._cursor.rowcount
+
+    async def executemany(self, sql, rows):
+        await self._run(self._cursor.executemany, to_sqlite(sql), [tuple(row) for row in rows])
+        return self._cursor.rowcount
+
+    def _as_dict(self, row):
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    async def fetchone(self):
+        row = await asyncio.to_thread(self._cursor.fetchone)
+        return self._as_dict(row) if row is not None else None
+
+    async def fetchall(self):
+        return [self._as_dict(row) for row in await asyncio.to_thread(self._cursor.fetchall)]
+
+class SQLiteConnection:
+    def __init__(self, path: str, latency: float):
+        # isolation_level=None: tự quản lý giao dịch qua begin/commit giống aiomysql (autocommit)
+        self.raw = sqlite3.connect(path, isolation_level=None, check_same_thread=False,
+                                   detect_types=sqlite3.PARSE_DECLTYPES, timeout=30)
+        self.latency = latency
+        self._in_transaction = False
+
+    def cursor(self):
+        return SQLiteCursor(self)
+
+    async def begin(self):
+        await asyncio.to_thread(self.raw.execute, "BEGIN IMMEDIATE")
+        self._in_transaction = True
+
+    async def commit(self):
+        if self._in_transaction:
+            self._in_transaction = False
+            await asyncio.to_thread(self.raw.execute, "COMMIT")
+
+    async def rollback(self):
+        if self._in_transaction:
+            self._in_transaction = False
+            await asyncio.to_thread(self.raw.execute, "ROLLBACK")
+
+class SQLitePool:
+    """Thay MySQLPool trong benchmark: cùng giao diện acquire()/stats()/close(), dữ liệu nằm trong SQLite."""
+
+    def __init__(self, path: str, maxsize: int = 10, latency: float = 0.0):
+        self.path = path
+        self.maxsize = maxsize
+        self.latency = latency
+        with sqlite3.connect(path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SQLITE_SCHEMA)
+        self._idle = [SQLiteConnection(path, latency) for _ in range(maxsize)]
+        self._semaphore = asyncio.Semaphore(maxsize)
+        self.waiting = 0
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    @asynccontextmanager
+    async def acquire(self):
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        wait = time.perf_counter() - started
+        self.checkouts += 1
+        self.wait_seconds_total += wait
+        self.wait_seconds_max = max(self.wait_seconds_max, wait)
+        conn = self._idle.pop()
+        try:
+            yield conn
+        finally:
+            await conn.rollback()
+            self._idle.append(conn)
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            "size": self.maxsize,
+            "max_size": self.maxsize,
+            "in_use": self.maxsize - len(self._idle),
+            "idle": len(self._idle),
+            "waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "wait_seconds_total": round(self.wait_seconds_total, 4),
+            "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 4) if self.checkouts else 0.0,
+            "wait_seconds_max": round(self.wait_seconds_max, 4),
+        }
+
+    async def close(self):
+        for conn in self._idle:
+            conn.raw.close()
+
+# --- Index vector cục bộ ---
+
+def build_local_index(path: str, docs: int, dimension: int):
+    """Dựng LocalVectorStore từ corpus tổng hợp với embedding giả xác định (không cần tải model)."""
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from src.vector_store import LocalVectorStore
+
+    embeddings = DeterministicFakeEmbedding(size=dimension)
+    store = LocalVectorStore(path, embeddings)
+    rng = random.Random(0)
+    foods = ["gạo lứt", "cá hồi", "rau cải", "đậu phụ", "trứng", "ức gà", "khoai lang", "sữa chua", "cam", "hạt óc chó"]
+    nutrients = ["chất xơ", "protein", "vitamin C", "omega-3", "canxi", "sắt", "kali", "magie"]
+    texts = [
+        f"Đoạn {i}: {rng.choice(foods)} cung cấp nhiều {rng.choice(nutrients)}, "
+        f"phù hợp cho {rng.choice(['người lớn tuổi', 'trẻ em', 'phụ nữ mang thai', 'người tập thể thao'])}."
+        for i in range(docs)
+    ]
+    for start in range(0, len(texts), 1000):
+        batch = texts[start:start + 1000]
+        store.add_texts(batch, metadatas=[{"source": "synthetic"} for _ in batch],
+                        ids=[f"doc-{start + i}" for i in range(len(batch))])
+    return store, embeddings
+
+# --- Thu thập kết quả ---
+
+class Recorder:
+    """Độ trễ và lỗi theo từng endpoint / tác vụ nền."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.windows = {}
+
+    def record(self, name: str, started: float, ok: bool):
+        finished = time.perf_counter()
+        first, last = self.windows.get(name, (started, finished))
+        self.windows[name] = (min(first, started), max(last, finished))
+        if ok:
+            self.latencies.setdefault(name, []).append(finished - started)
+        else:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            self.latencies.setdefault(name, [])
+
+    def summary(self):
+        result = {}
+        for name, values in self.latencies.items():
+            first, last = self.windows[name]
+            count = len(values) + self.errors.get(name, 0)
+            result[name] = {
+                "requests": count,
+                "errors": self.errors.get(name, 0),
+                "throughput": count / (last - first) if last > first else 0.0,
+                "mean": statistics.mean(values) if values else 0.0,
+                "p50": percentile(values, 50) if values else 0.0,
+                "p95": percentile(values, 95) if values else 0.0,
+                "p99": percentile(values, 99) if values else 0.0,
+            }
+        return result
+
+async def timed_request(client, recorder, name, method, url, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        ok = response.status_code < 400
+        recorder.record(name, started, ok)
+        return response if ok else None
+    except Exception as e:
+        print(f"{name} lỗi: {str(e)}")
+        recorder.record(name, started, False)
+        return None
+
+async def run_workers(count: int, concurrency: int, job):
+    """Chạy job(i) cho i in range(count) với tối đa `concurrency` job cùng lúc."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(i):
+        async with semaphore:
+            await job(i)
+
+    await asyncio.gather(*(run(i) for i in range(count)))
+
+# --- Sync workers ---
+
+async def sync_loop(sync_engine, recorder, interval: float, stop: asyncio.Event):
+    """Giống sync_to_mysql trong app nhưng với chu kỳ ngắn để đo dưới tải."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            result = await sync_engine.sync_once()
+            if result["sessions"]:
+                recorder.record("sync_once", started, True)
+        except Exception as e:
+            print(f"sync_once lỗi: {str(e)}")
+            recorder.record("sync_once", started, False)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+async def persister_loop(persister, recorder, stop: asyncio.Event):
+    """Giống MessagePersister.run nhưng không chặn trên XREADGROUP, đo thời gian mỗi lô ghi."""
+    await persister.ensure_group()
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            written = await persister.process_new(block_ms=None)
+            if written:
+                recorder.record("persist_batch", started, True)
+                continue
+        except Exception as e:
+            print(f"persist_batch lỗi: {str(e)}")
+            recorder.record("persist_batch", started, False)
+        await asyncio.sleep(0.05)
+
+# --- Chạy benchmark ---
+
+def configure_environment(args):
+    """Biến môi trường phải có trước khi import app.main (client Redis, chế độ pipeline)."""
+    os.environ.setdefault("REDIS_HOST", "localhost")
+    os.environ.setdefault("REDIS_PORT", "6379")
+    os.environ.setdefault("REDIS_DB", "0")
+    os.environ["QUERY_PIPELINE_MODE"] = args.mode
+    os.environ["LLM_MAX_CONCURRENCY"] = str(args.llm_concurrency)
+
+async def run_benchmark(args, workdir):
+    import fakeredis
+    import httpx
+
+    configure_environment(args)
+    import app.main as main
+    from app.chat_history import ChatHistoryReader
+    from app.message_log import MessagePersister
+    from app.session_store import SessionStore
+    from app.sync_engine import SyncEngine
+    from src import pipeline, prompt
+    from src.semantic_cache import SemanticCache
+
+    # Redis giả dùng chung cho mọi thành phần, giống một Redis thật
+    redis_client = fakeredis.FakeAsyncRedis()
+    if args.mysql:
+        from app.mysql_pool import MySQLPool
+        mysql_pool = await MySQLPool.from_env().open()
+    else:
+        mysql_pool = SQLitePool(os.path.join(workdir, "bench.db"), maxsize=args.mysql_pool_size,
+                                latency=args.mysql_latency)
+
+    print(f"Dựng index cục bộ {args.index_docs} đoạn, {args.index_dim} chiều...")
+    store, embeddings = build_local_index(os.path.join(workdir, "index"), args.index_docs, args.index_dim)
+    retriever = store.as_retriever(search_type="similarity", search_kwargs={"k": 3})
+
+    fake_model = FakeGeminiModel(args.llm_latency, args.llm_jitter)
+    pipeline.get_translation_model = lambda: fake_model
+    prompt._shared_retriever = retriever
+    prompt._shared_rag_chain = prompt.create_rag_chain(retriever, llm=create_fake_llm(fake_model))
+
+    main.redis_client = redis_client
+    main.translation_cache.attach_redis(redis_client)
+    main.session_store = SessionStore(redis_client)
+    main.chat_history_reader = ChatHistoryReader(main.session_store, main.require_mysql_pool)
+    main.mysql_pool = mysql_pool
+    main.sync_engine = SyncEngine(redis_client, mysql_pool)
+    main.message_persister = MessagePersister(redis_client, mysql_pool, consumer="benchmark")
+    main.SEMANTIC_CACHE_ENABLED = args.semantic_cache
+    if args.semantic_cache:
+        main.semantic_cache = SemanticCache(embeddings)
+        main.semantic_cache.attach_redis(redis_client)
+
+    recorder = Recorder()
+    stop = asyncio.Event()
+    background = [
+        asyncio.create_task(sync_loop(main.sync_engine, recorder, args.sync_interval, stop)),
+        asyncio.create_task(persister_loop(main.message_persister, recorder, stop)),
+    ]
+
+    rng = random.Random(args.seed)
+    questions = [f"{rng.choice(DEFAULT_QUESTIONS)} (#{i})" for i in range(args.unique_questions)]
+    # Mỗi phiên tối đa 30 câu hỏi nên số phiên tăng theo số request
+    session_count = max(args.sessions, math.ceil(args.requests / QUESTION_LIMIT))
+    transport = httpx.ASGITransport(app=main.app)
+    started = time.perf_counter()
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        sessions = []
+
+        async def new_session(i):
+            response = await timed_request(client, recorder, "POST /new_session", "POST", "/new_session", json={})
+            if response is not None:
+                sessions.append(response.json()["session_id"])
+
+        await run_workers(session_count, args.concurrency, new_session)
+        if not sessions:
+            raise RuntimeError("Không tạo được session nào, dừng benchmark")
+
+        async def query(i):
+            payload = {
+                "question": questions[rng.randrange(len(questions))],
+                "session_id": sessions[i % len(sessions)],
+                "user_id": None,
+            }
+            await timed_request(client, recorder, "POST /query", "POST", "/query", json=payload)
+
+        print(f"Gửi {args.requests} /query tới {len(sessions)} phiên, {args.concurrency} đồng thời...")
+        await run_workers(args.requests, args.concurrency, query)
+
+        async def chat_history(i):
+            session_id = sessions[i % len(sessions)]
+            await timed_request(client, recorder, "GET /chat_history", "GET", f"/chat_history/{session_id}")
+
+        print(f"Gửi {args.history_requests} /chat_history...")
+        await run_workers(args.history_requests, args.concurrency, chat_history)
+
+    # Dừng vòng lặp nền rồi xả nốt như lúc tắt app, đo thời gian tới khi MySQL nhận đủ tin nhắn
+    stop.set()
+    await asyncio.gather(*background)
+    drain_started = time.perf_counter()
+    await main.sync_engine.sync_once()
+    await main.message_persister.drain()
+    recorder.record("final_drain", drain_started, True)
+    elapsed = time.perf_counter() - started
+
+    async with mysql_pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("SELECT COUNT(*) AS n FROM chat_messages WHERE session_id IN "
+                                 f"({', '.join(['%s'] * len(sessions))})", sessions)
+            persisted = (await cursor.fetchone())["n"]
+    answered = len(recorder.latencies.get("POST /query", []))
+    await mysql_pool.close()
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "elapsed_seconds": elapsed,
+        "endpoints": recorder.summary(),
+        "messages": {"answered": answered, "persisted": persisted},
+        "llm": main.llm_scheduler.stats(),
+        "translation_cache": main.translation_cache.stats(),
+        "mysql_pool": mysql_pool.stats(),
+    }
+
+def print_report(result):
+    print("\n=== Kết quả ===")
+    print(f"{'endpoint':<22} {'req':>6} {'err':>5} {'req/s':>8} {'mean(s)':>8} {'p50(s)':>8} {'p95(s)':>8} {'p99(s)':>8}")
+    for name, r in result["endpoints"].items():
+        print(f"{name:<22} {r['requests']:>6} {r['errors']:>5} {r['throughput']:>8.2f} {r['mean']:>8.3f} "
+              f"{r['p50']:>8.3f} {r['p95']:>8.3f} {r['p99']:>8.3f}")
+    messages = result["messages"]
+    print(f"\nTin nhắn đã trả lời: {messages['answered']}, đã ghi xuống MySQL: {messages['persisted']}")
+    llm = result["llm"]
+    print(f"LLM: {llm['calls']} lời gọi, chờ trung bình {llm['wait_seconds_avg']:.3f}s, "
+          f"tối đa {llm['wait_seconds_max']:.3f}s; cache dịch hit-rate {result['translation_cache']['hit_rate']:.2f}")
+    print(f"Tổng thời gian: {result['elapsed_seconds']:.1f}s")
+
+def check_result(result, baseline, max_regression: float, min_delta: float):
+    """Danh sách vấn đề: lỗi request, tin nhắn chưa được ghi, p95 tệ hơn baseline quá ngưỡng."""
+    problems = []
+    for name, r in result["endpoints"].items():
+        if r["errors"]:
+            problems.append(f"{name}: {r['errors']} request lỗi")
+    messages = result["messages"]
+    if messages["persisted"] < messages["answered"]:
+        problems.append(f"chỉ {messages['persisted']}/{messages['answered']} tin nhắn được ghi xuống MySQL")
+    if baseline:
+        for name, r in result["endpoints"].items():
+            base = baseline["endpoints"].get(name)
+            # Bỏ qua chênh lệch vài ms của các tác vụ rất nhanh (nhiễu đo)
+            if (base and base["p95"] and r["p95"] > base["p95"] * (1 + max_regression)
+                    and r["p95"] - base["p95"] > min_delta):
+                problems.append(f"{name}: p95 {r['p95']:.3f}s so với baseline {base['p95']:.3f}s "
+                                f"(+{(r['p95'] / base['p95'] - 1) * 100:.0f}%)")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tải offline cho chatbot service")
+    parser.add_argument("--requests", type=int, default=200, help="Số request /query")
+    parser.add_argument("--history-requests", type=int, default=100, help="Số request /chat_history")
+    parser.add_argument("--concurrency", type=int, default=16, help="Số request đồng thời")
+    parser.add_argument("--sessions", type=int, default=20, help="Số phiên chat tối thiểu")
+    parser.add_argument("--unique-questions", type=int, default=50, help="Số câu hỏi khác nhau (ảnh hưởng hit-rate cache)")
+    parser.add_argument("--mode", choices=("translate", "direct"), default="translate", help="QUERY_PIPELINE_MODE")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Độ trễ cơ bản của Gemini giả (giây)")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="Độ trễ thêm tối đa, xác định theo prompt (giây)")
+    parser.add_argument("--llm-concurrency", type=int, default=8, help="LLM_MAX_CONCURRENCY của scheduler")
+    parser.add_argument("--semantic-cache", action="store_true", help="Bật cache ngữ nghĩa (embedding giả)")
+    parser.add_argument("--index-docs", type=int, default=2000, help="Số đoạn trong index cục bộ")
+    parser.add_argument("--index-dim", type=int, default=384, help="Số chiều embedding của index cục bộ")
+    parser.add_argument("--mysql", action="store_true", help="Dùng MySQL thật theo MYSQL_* (ví dụ container local) thay cho SQLite")
+    parser.add_argument("--mysql-pool-size", type=int, default=10, help="Số kết nối của pool SQLite")
+    parser.add_argument("--mysql-latency", type=float, default=0.002, help="Độ trễ mạng giả lập mỗi câu lệnh SQLite (giây)")
+    parser.add_argument("--sync-interval", type=float, default=1.0, help="Chu kỳ SyncEngine trong lúc đo (giây)")
+    parser.add_argument("--seed", type=int, default=42, help="Seed chọn câu hỏi")
+    parser.add_argument("--output", type=str, help="Ghi kết quả ra file JSON (dùng làm baseline)")
+    parser.add_argument("--baseline", type=str, help="File JSON của một lần chạy trước để so sánh")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Mức tăng p95 tối đa so với baseline (0.2 = 20%%)")
+    parser.add_argument("--min-delta", type=float, default=0.01, help="Chênh lệch p95 tối thiểu (giây) mới tính là regression")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="chatbot-bench-")
+    try:
+        result = asyncio.run(run_benchmark(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Đã ghi kết quả vào {args.output}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    problems = check_result(result, baseline, args.max_regression, args.min_delta)
+    if problems:
+        print("\n=== Không đạt ===")
+        for problem in problems:
+            print(f"- {problem}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
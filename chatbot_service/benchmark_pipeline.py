@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Script so sánh độ trễ và lượng token giữa hai chế độ pipeline của /query:
+"translate" (dịch vi→en, RAG, dịch en→vi) và "direct" (trả lời trực tiếp bằng tiếng Việt).
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# Add the parent directory to sys.path to allow imports from src
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from src.prompt import create_rag_chain, token_usage
+from src.pipeline import answer_question, PIPELINE_MODES
+
+DEFAULT_QUESTIONS = [
+    "Chế độ ăn uống lành mạnh là gì?",
+    "Tôi muốn giảm cân, nên ăn gì?",
+    "Thực phẩm nào giàu vitamin C?",
+    "Phụ nữ mang thai nên bổ sung chất gì?",
+    "Trẻ em bị dị ứng sữa bò nên ăn gì thay thế?",
+]
+
+def percentile(values, pct):
+    """Tính percentile theo phương pháp nearest-rank."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+async def run_mode(rag_chain, mode, questions, repeat):
+    """Chạy toàn bộ câu hỏi với một chế độ và trả về thống kê."""
+    token_usage.reset()
+    latencies = []
+    for _ in range(repeat):
+        for question in questions:
+            start = time.perf_counter()
+            await answer_question(rag_chain, question, mode=mode)
+            latencies.append(time.perf_counter() - start)
+
+    usage = token_usage.snapshot()
+    count = len(latencies)
+    return {
+        "mode": mode,
+        "requests": count,
+        "mean": statistics.mean(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "calls_per_request": usage["calls"] / count,
+        "tokens_per_request": usage["total_tokens"] / count,
+        "prompt_tokens": usage["prompt_tokens"],
+        "output_tokens": usage["output_tokens"],
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="So sánh chế độ pipeline translate và direct")
+    parser.add_argument("--questions", type=str, help="File chứa câu hỏi, mỗi dòng một câu")
+    parser.add_argument("--repeat", type=int, default=1, help="Số lần lặp lại bộ câu hỏi")
+    parser.add_argument("--modes", nargs="+", default=list(PIPELINE_MODES), choices=PIPELINE_MODES,
+                        help="Các chế độ cần đo")
+    args = parser.parse_args()
+
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = DEFAULT_QUESTIONS
+
+    # Dùng chung một RAG chain để chỉ đo chi phí của pipeline
+    rag_chain = create_rag_chain()
+
+    results = []
+    for mode in args.modes:
+        print(f"Đang đo chế độ '{mode}' với {len(questions) * args.repeat} câu hỏi...")
+        results.append(await run_mode(rag_chain, mode, questions, args.repeat))
+
+    print("\n=== Kết quả ===")
+    print(f"{'mode':<10} {'req':>5} {'mean(s)':>8} {'p50(s)':>8} {'p95(s)':>8} {'calls/req':>10} {'tokens/req':>11}")
+    for r in results:
+        print(f"{r['mode']:<10} {r['requests']:>5} {r['mean']:>8.2f} {r['p50']:>8.2f} {r['p95']:>8.2f} "
+              f"{r['calls_per_request']:>10.2f} {r['tokens_per_request']:>11.1f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
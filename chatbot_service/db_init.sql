@@ -8,11 +8,14 @@ CREATE TABLE chat_sessions (
 
 CREATE TABLE chat_messages (
     id INT AUTO_INCREMENT PRIMARY KEY,
+    message_uid CHAR(32) NULL,
     session_id VARCHAR(255) NOT NULL,
     user_id INT NOT NULL,
     question TEXT NOT NULL,
     answer TEXT NOT NULL,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_chat_messages_message_uid (message_uid),
+    KEY idx_chat_messages_session_ts (session_id, timestamp, id),
     FOREIGN KEY (session_id) REFERENCES chat_sessions(session_id),
     FOREIGN KEY (user_id) REFERENCES users(user_id)
 );
\ No newline at end of file
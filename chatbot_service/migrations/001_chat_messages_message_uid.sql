@@ -0,0 +1,5 @@
+-- Khóa chống trùng cho tin nhắn ghi từ Redis Stream `chat:messages`.
+-- Consumer group giao tin nhắn ít nhất một lần; UNIQUE(message_uid) giúp ghi lại an toàn.
+ALTER TABLE chat_messages
+    ADD COLUMN message_uid CHAR(32) NULL AFTER id,
+    ADD UNIQUE KEY uq_chat_messages_message_uid (message_uid);
@@ -0,0 +1,6 @@
+-- Index cho phân trang keyset của /chat_history:
+-- WHERE session_id = ? AND (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT ?
+-- Chạy online (ALGORITHM=INPLACE, LOCK=NONE) nên không chặn ghi từ MessagePersister.
+ALTER TABLE chat_messages
+    ADD KEY idx_chat_messages_session_ts (session_id, timestamp, id),
+    ALGORITHM=INPLACE, LOCK=NONE;
@@ -1,14 +1,18 @@
+import asyncio
 import logging
 import os
 import sys
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
 import argparse
 
 # Add the parent directory to sys.path to allow imports from src
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from src.prompt import create_rag_chain
-from store_index import create_or_update_index, update_index_with_new_data
+from src.prompt import get_rag_chain, start_rag_chain
+from src.metrics import CONTENT_TYPE_LATEST, render_metrics, stats_collector, track_request
+from src.startup import StartupManager
+from src.llm_scheduler import llm_scheduler
 
 # Thiết lập logging
 logging.basicConfig(level=logging.INFO)
@@ -16,18 +20,47 @@ logger = logging.getLogger(__name__)
 
 # Khởi tạo ứng dụng FastAPI
 app = FastAPI(title="Family Menu Suggestion System")
+app.middleware("http")(track_request)
+stats_collector.register("llm_scheduler", llm_scheduler.stats)
+
+# Cùng vòng đời chain với app/main.py: tạo một lần mỗi tiến trình rồi warm-up trước khi báo sẵn sàng
+startup = StartupManager()
+startup.declare("rag_chain")
+startup.declare("warmup")
+startup_task = None
+
+@app.on_event("startup")
+async def startup_event():
+    global startup_task
+    startup_task = asyncio.create_task(start_rag_chain(
+        startup,
+        float(os.getenv("STARTUP_MODEL_TIMEOUT", "180")),
+        float(os.getenv("STARTUP_RETRY_INTERVAL", "5"))
+    ))
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to Family Menu Suggestion System API"}
 
+@app.get("/ready")
+async def ready():
+    if startup.ready:
+        return {"status": "ready"}
+    return JSONResponse(status_code=503, content={"status": "starting", "waiting_for": startup.not_ready()})
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=await render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/query")
-async def query(question: str):
+def query(question: str):
+    # Hàm đồng bộ: FastAPI chạy trong threadpool nên lời gọi chain không chặn event loop
     try:
         logger.info(f"Received query: {question}")
-        rag_chain = create_rag_chain()
+        rag_chain = get_rag_chain()
         response = rag_chain.invoke({"input": question})
-        return {"answer": response['answer']}
+        # Chain LCEL trả về chuỗi câu trả lời
+        return {"answer": response["answer"] if isinstance(response, dict) else response}
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
         return {"error": str(e)}
@@ -35,13 +68,14 @@ async def query(question: str):
 def main():
     try:
         logger.info("Initializing RAG chain...")
-        rag_chain = create_rag_chain()
+        rag_chain = get_rag_chain()
         logger.info("RAG chain initialized successfully.")
 
         # Ví dụ truy vấn
         query = "Chế độ ăn uống lành mạnh là gì?"
         response = rag_chain.invoke({"input": query})
-        logger.info(f"Response to '{query}': {response['answer']}")
+        answer = response["answer"] if isinstance(response, dict) else response
+        logger.info(f"Response to '{query}': {answer}")
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
 
@@ -55,6 +89,9 @@ if __name__ == "__main__":
     
     # Nếu cần tạo index
     if args.create_index:
+        # Chỉ lệnh tạo index mới cần store_index (kéo theo langchain_community, numpy, pipeline ingest)
+        from store_index import create_or_update_index, update_index_with_new_data
+
         current_dir = os.path.dirname(os.path.abspath(__file__))
         data_directory = os.path.join(current_dir, 'Data')
         logger.info("Creating/updating Pinecone index...")
@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Thiết lập logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hóa văn bản làm khóa cache: NFC, gộp khoảng trắng, không phân biệt hoa thường."""
+    text = unicodedata.normalize("NFC", text)
+    return _WHITESPACE_RE.sub(" ", text).strip().casefold()
+
+
+class TTLCache:
+    """
+    Cache LRU trong tiến trình, giới hạn theo số phần tử và thời gian sống (TTL).
+
+    An toàn khi dùng từ nhiều thread; mọi thao tác đều O(1).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class TranslationCache:
+    """
+    Cache hai tầng cho kết quả dịch: LRU trong tiến trình, phía sau là Redis dùng chung
+    cho mọi worker. Khóa gồm cặp ngôn ngữ và văn bản đã chuẩn hóa.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, redis_ttl: int = 86400,
+                 prefix: str = "translation:"):
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.redis_client = None
+        self.redis_ttl = redis_ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def attach_redis(self, redis_client):
+        """Gắn Redis client bất đồng bộ làm tầng cache thứ hai."""
+        self.redis_client = redis_client
+
+    def make_key(self, text: str, source_lang: str, target_lang: str) -> str:
+        digest = hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{self.prefix}{source_lang}:{target_lang}:{digest}"
+
+    def _record_hit(self, tier: str, latency: float):
+        with self._lock:
+            if tier == "local":
+                self.local_hits += 1
+            else:
+                self.redis_hits += 1
+            # Mỗi lần trúng cache tiết kiệm được đúng thời gian lần dịch gốc đã tốn
+            self.saved_seconds += latency
+
+    async def get_or_translate(self, text: str, source_lang: str, target_lang: str,
+                               translate: Callable[[str, str, str], Awaitable[str]]) -> str:
+        """
+        Trả về bản dịch từ cache, hoặc gọi `translate` và lưu kết quả vào cả hai tầng.
+        Lỗi từ `translate` được ném ra và không được lưu vào cache.
+        """
+        key = self.make_key(text, source_lang, target_lang)
+
+        cached = self.local.get(key)
+        if cached is not None:
+            translation, latency = cached
+            self._record_hit("local", latency)
+            return translation
+
+        if self.redis_client is not None:
+            try:
+                raw = await self.redis_client.get(key)
+                if raw is not None:
+                    entry = json.loads(raw)
+                    self.local.set(key, (entry["t"], entry["l"]))
+                    self._record_hit("redis", entry["l"])
+                    return entry["t"]
+            except Exception as e:
+                logger.warning(f"Translation cache Redis lookup failed: {str(e)}")
+
+        with self._lock:
+            self.misses += 1
+        start = time.perf_counter()
+        translation = await translate(text, source_lang, target_lang)
+        latency = time.perf_counter() - start
+
+        self.local.set(key, (translation, latency))
+        if self.redis_client is not None:
+            try:
+                payload = json.dumps({"t": translation, "l": latency}, ensure_ascii=False)
+                await self.redis_client.set(key, payload, ex=self.redis_ttl)
+            except Exception as e:
+                logger.warning(f"Translation cache Redis write failed: {str(e)}")
+        return translation
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.local_hits + self.redis_hits
+            lookups = hits + self.misses
+            return {
+                "size": len(self.local),
+                "max_size": self.local.maxsize,
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+
+class SingleFlight:
+    """
+    Gộp các lời gọi đồng thời có cùng khóa thành một lần tính toán.
+
+    Request đầu tiên (leader) chạy hàm; các request cùng khóa đến trong lúc đó chờ
+    chung kết quả (hoặc lỗi) thay vì tự gọi lại LLM. Phép tính chạy trong một task
+    riêng nên không bị hủy khi client của leader ngắt kết nối. Khóa bị xóa ngay khi
+    có kết quả, nên đây không phải là cache.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,267 @@
+import argparse
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+# Thiết lập logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+
+# Backend embedding: "torch" (HuggingFaceEmbeddings, mặc định) hoặc "onnx" (onnxruntime, int8)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+ONNX_MODEL_DIR = os.getenv(
+    "ONNX_MODEL_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "mpnet-onnx")
+)
+ONNX_MODEL_FILE = os.getenv("ONNX_MODEL_FILE", "model_quantized.onnx")
+ONNX_NUM_THREADS = int(os.getenv("ONNX_NUM_THREADS", "0"))  # 0 = để onnxruntime tự chọn
+
+# Độ dài tối đa của model sentence-transformers (max_seq_length)
+MAX_SEQ_LENGTH = 128
+
+# Cache embedding của câu truy vấn
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_REDIS = os.getenv("EMBEDDING_CACHE_REDIS", "true").lower() == "true"
+EMBEDDING_CACHE_REDIS_TTL = int(os.getenv("EMBEDDING_CACHE_REDIS_TTL", "604800"))  # 7 ngày
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Embedding chạy bằng onnxruntime trên CPU, thay thế trực tiếp cho HuggingFaceEmbeddings.
+
+    Dùng model đã export sang ONNX (mặc định bản lượng tử hóa int8 động) cùng
+    tokenizer nhanh (`tokenizers`); mean pooling theo attention mask giống
+    sentence-transformers nên vector tương thích với index đã tạo bằng model torch.
+    Không cần torch khi chạy.
+    """
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, model_file: str = ONNX_MODEL_FILE,
+                 batch_size: int = 32, num_threads: int = ONNX_NUM_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path = os.path.join(model_dir, model_file)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"ONNX model not found at '{model_path}'. Export it with: python -m src.embeddings export"
+            )
+        self.batch_size = batch_size
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        pad_id = self.tokenizer.token_to_id("<pad>")
+        self.tokenizer.enable_padding(pad_id=1 if pad_id is None else pad_id, pad_token="<pad>")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        logger.info(f"Loaded ONNX embedding model from {model_path}")
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        token_embeddings = self.session.run(None, feeds)[0]
+        # Mean pooling theo attention mask
+        mask = attention_mask[:, :, None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        return summed / counts
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = [text.replace("\n", " ") for text in texts]
+        vectors = [self._embed_batch(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)]
+        return np.vstack(vectors).tolist() if vectors else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Cache embedding của câu truy vấn đặt trước một model embedding bất kỳ.
+
+    Khóa là hash SHA-1 của văn bản đã chuẩn hóa (NFC, gộp khoảng trắng, không phân
+    biệt hoa thường) kèm tên backend, nên câu hỏi lặp lại hoặc request gửi lại khi
+    timeout không phải embed lại. Tầng 1 là LRU trong tiến trình; tầng 2 (tùy chọn)
+    là Redis lưu vector float32 đã đóng gói để các worker dùng chung.
+
+    `embed_documents` (lúc tạo index) đi thẳng xuống model, không qua cache.
+    """
+
+    def __init__(self, embeddings: Embeddings, namespace: str, maxsize: int = EMBEDDING_CACHE_SIZE,
+                 redis_client=None, redis_ttl: int = EMBEDDING_CACHE_REDIS_TTL):
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.redis_client = redis_client
+        self.redis_ttl = redis_ttl
+        self._local: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis_retry_at = 0.0
+
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def make_key(self, text: str) -> str:
+        normalized = _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip().casefold()
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        return f"emb:{self.namespace}:{digest}"
+
+    def _get_local(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._local.get(key)
+            if vector is not None:
+                self._local.move_to_end(key)
+            return vector
+
+    def _set_local(self, key: str, vector: List[float]):
+        with self._lock:
+            self._local[key] = vector
+            self._local.move_to_end(key)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def _redis_available(self) -> bool:
+        return self.redis_client is not None and time.monotonic() >= self._redis_retry_at
+
+    def _redis_failed(self, action: str, error: Exception):
+        # Tạm bỏ qua Redis 30 giây để không cộng thêm timeout vào mỗi lần embed
+        self._redis_retry_at = time.monotonic() + 30
+        logger.warning(f"Embedding cache Redis {action} failed: {str(error)}")
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.make_key(text)
+        vector = self._get_local(key)
+        if vector is not None:
+            with self._lock:
+                self.local_hits += 1
+            return vector
+
+        if self._redis_available():
+            try:
+                packed = self.redis_client.get(key)
+                if packed:
+                    vector = np.frombuffer(packed, dtype=np.float32).tolist()
+                    self._set_local(key, vector)
+                    with self._lock:
+                        self.redis_hits += 1
+                    return vector
+            except Exception as e:
+                self._redis_failed("read", e)
+
+        with self._lock:
+            self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self._set_local(key, vector)
+        if self._redis_available():
+            try:
+                self.redis_client.set(key, np.asarray(vector, dtype=np.float32).tobytes(), ex=self.redis_ttl)
+            except Exception as e:
+                self._redis_failed("write", e)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.local_hits + self.redis_hits
+            lookups = hits + self.misses
+            return {
+                "size": len(self._local),
+                "max_size": self.maxsize,
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+
+def create_embeddings(backend: str = None) -> Embeddings:
+    """Tạo model embedding theo EMBEDDING_BACKEND ("torch" hoặc "onnx")."""
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    if backend == "onnx":
+        return OnnxEmbeddings()
+    if backend != "torch":
+        logger.warning(f"Unknown EMBEDDING_BACKEND '{backend}', falling back to 'torch'")
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+
+def create_cached_embeddings(backend: str = None, redis_client=None) -> CachedEmbeddings:
+    """Tạo model embedding kèm cache truy vấn; dùng Redis đồng bộ từ env nếu EMBEDDING_CACHE_REDIS=true."""
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    if redis_client is None and EMBEDDING_CACHE_REDIS:
+        import redis
+
+        redis_client = redis.Redis(
+            host=os.getenv("REDIS_HOST", "localhost"),
+            port=int(os.getenv("REDIS_PORT", "6379")),
+            db=int(os.getenv("REDIS_DB", "0")),
+            socket_timeout=0.5
+        )
+    namespace = f"{backend}:{EMBEDDING_MODEL_NAME.rsplit('/', 1)[-1]}"
+    return CachedEmbeddings(create_embeddings(backend), namespace, redis_client=redis_client)
+
+
+def export_onnx_model(output_dir: str = ONNX_MODEL_DIR, model_name: str = EMBEDDING_MODEL_NAME, quantize: bool = True):
+    """
+    Export model sang ONNX (optimum) và lượng tử hóa int8 động các trọng số.
+
+    Tạo `model.onnx`, `model_quantized.onnx` và `tokenizer.json` trong `output_dir`.
+    Chỉ cần chạy một lần lúc build; cần cài `optimum[onnxruntime]`.
+    """
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    model.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+    logger.info(f"Exported {model_name} to {output_dir}")
+
+    if quantize:
+        quantize_dynamic(
+            os.path.join(output_dir, "model.onnx"),
+            os.path.join(output_dir, "model_quantized.onnx"),
+            weight_type=QuantType.QInt8
+        )
+        logger.info("Wrote int8 dynamically quantised model_quantized.onnx")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quản lý model embedding ONNX")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export và lượng tử hóa model sang ONNX")
+    export_parser.add_argument("--output", default=ONNX_MODEL_DIR, help="Thư mục lưu model")
+    export_parser.add_argument("--no-quantize", action="store_true", help="Chỉ export, không lượng tử hóa int8")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx_model(args.output, quantize=not args.no_quantize)
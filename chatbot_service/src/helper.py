@@ -1,11 +1,14 @@
 import os
-from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Pinecone as LangchainPinecone
-from pinecone import Pinecone, ServerlessSpec
+from functools import lru_cache
 from dotenv import load_dotenv
 import logging
+from src.semantic_cache import bump_corpus_version
+from src.vector_store import LocalVectorStore
+from src.snapshot import SnapshotVectorStore
+from src.embeddings import create_cached_embeddings
+from src.ingest import ingest_directory, LocalIndexSink, PineconeSink
+from src.ingest_cache import open_ingest_cache
+from src.manifest import chunk_id
 
 # Thiết lập logging
 logging.basicConfig(level=logging.INFO)
@@ -14,19 +17,39 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-if not PINECONE_API_KEY:
-    logger.error("PINECONE_API_KEY not found in .env file.")
-    raise ValueError("PINECONE_API_KEY not found in .env file.")
 
 # Get index name from environment variables
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "chatbot")
-logger.info(f"Using Pinecone index: {PINECONE_INDEX_NAME}")
 
-# Initialize Pinecone client globally
-pc = Pinecone(api_key=PINECONE_API_KEY)
+# Backend lưu vector: "pinecone" (mặc định) hoặc "local" (index NumPy memory-map trong tiến trình)
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone").lower()
+LOCAL_INDEX_PATH = os.getenv(
+    "LOCAL_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "index")
+)
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")  # float32 hoặc int8
+LOCAL_INDEX_SEARCH = os.getenv("LOCAL_INDEX_SEARCH", "exact")  # exact hoặc hnsw
+# Snapshot index chỉ đọc (store_index.py --export-snapshot); nếu đặt, API phục vụ truy xuất từ snapshot
+INDEX_SNAPSHOT_PATH = os.getenv("INDEX_SNAPSHOT_PATH", "")
+# true: kiểm tra SHA-256 toàn bộ snapshot khi mở (mặc định chỉ kiểm tra header để khởi động nhanh)
+INDEX_SNAPSHOT_VERIFY = os.getenv("INDEX_SNAPSHOT_VERIFY", "false").lower() == "true"
+logger.info(f"Vector store backend: {VECTOR_STORE_BACKEND}")
+
+@lru_cache(maxsize=1)
+def get_pinecone_client():
+    """Create the Pinecone client on first use so the local backend needs no API key."""
+    if not PINECONE_API_KEY:
+        logger.error("PINECONE_API_KEY not found in .env file.")
+        raise ValueError("PINECONE_API_KEY not found in .env file.")
+    from pinecone import Pinecone
+
+    logger.info(f"Using Pinecone index: {PINECONE_INDEX_NAME}")
+    return Pinecone(api_key=PINECONE_API_KEY)
 
 def load_pdf_file(data_path):
     """Load PDF files from a directory."""
+    from langchain_community.document_loaders import PyPDFLoader, DirectoryLoader
+
     if not os.path.exists(data_path):
         raise FileNotFoundError(f"Directory not found: '{data_path}'")
     if not os.path.isdir(data_path):
@@ -40,23 +63,29 @@ def load_pdf_file(data_path):
 
 def text_split(extracted_data):
     """Split documents into chunks."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=20)
     text_chunks = text_splitter.split_documents(extracted_data)
     return text_chunks
 
+@lru_cache(maxsize=1)
 def download_hugging_face_embeddings():
-    """Download and return HuggingFace embeddings."""
-    embeddings = HuggingFaceEmbeddings(model_name='sentence-transformers/paraphrase-multilingual-mpnet-base-v2')
-    return embeddings
+    """Return the embedding model for EMBEDDING_BACKEND (torch or onnx) behind the query-embedding cache,
+    one shared instance per process."""
+    return create_cached_embeddings()
 
 def initialize_pinecone(index_name=None):
     """Initialize and create Pinecone index if it doesn't exist."""
+    from pinecone import ServerlessSpec
+
     try:
         logger.info("Initializing Pinecone client...")
         # Use environment variable if index_name is not provided
         if index_name is None:
             index_name = PINECONE_INDEX_NAME
         
+        pc = get_pinecone_client()
         if index_name not in pc.list_indexes().names():
             pc.create_index(
                 name=index_name,
@@ -70,8 +99,80 @@ def initialize_pinecone(index_name=None):
         logger.error(f"Failed to initialize Pinecone: {str(e)}")
         raise
 
+def open_local_index(path=None, embeddings=None):
+    """Open (or create empty) the local vector index."""
+    return LocalVectorStore(
+        path or LOCAL_INDEX_PATH,
+        embeddings or download_hugging_face_embeddings(),
+        dtype=LOCAL_INDEX_DTYPE,
+        search=LOCAL_INDEX_SEARCH
+    )
+
+def _content_id_filter():
+    """Gán ID theo nội dung đoạn (giống store_index.py) và bỏ các đoạn trùng lặp."""
+    seen = set()
+
+    def keep(chunk) -> bool:
+        text, metadata = chunk
+        metadata["doc_id"] = chunk_id(text)
+        if metadata["doc_id"] in seen:
+            return False
+        seen.add(metadata["doc_id"])
+        return True
+
+    return keep
+
+def open_index_snapshot(path=None, embeddings=None):
+    """Memory-map a read-only index snapshot (header checksum and embedding model are checked)."""
+    path = path or INDEX_SNAPSHOT_PATH
+    if not os.path.exists(path):
+        # Không tự tạo lại index: replica dùng snapshot phải được cấp snapshot
+        raise FileNotFoundError(f"Index snapshot not found: '{path}'")
+    return SnapshotVectorStore(
+        path,
+        embeddings or download_hugging_face_embeddings(),
+        search=LOCAL_INDEX_SEARCH,
+        verify=INDEX_SNAPSHOT_VERIFY
+    )
+
+def load_documents_to_vector_store():
+    """Load documents into the configured vector store backend (VECTOR_STORE_BACKEND),
+    or serve from INDEX_SNAPSHOT_PATH when set."""
+    if INDEX_SNAPSHOT_PATH:
+        return open_index_snapshot()
+    if VECTOR_STORE_BACKEND == "local":
+        return load_documents_to_local_index()
+    return load_documents_to_pinecone()
+
+def load_documents_to_local_index():
+    """Load documents into the local index, reusing it if it already has data."""
+    try:
+        docsearch = open_local_index()
+        if len(docsearch) > 0:
+            logger.info("Local index already contains data. Skipping document loading...")
+            return docsearch
+
+        current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        data_directory = os.path.join(current_dir, 'Data')
+        logger.info(f"Loading documents from {data_directory}")
+
+        # Văn bản trang và embedding được lấy lại từ cache ingest nếu corpus không đổi
+        stats = ingest_directory(data_directory, docsearch.embeddings, LocalIndexSink(docsearch),
+                                 chunk_filter=_content_id_filter(),
+                                 cache=open_ingest_cache(docsearch.embeddings))
+        logger.info(f"Length of Text Chunks: {stats.chunks}")
+        logger.info(f"Data successfully written to local index at {docsearch.path}.")
+        # Corpus thay đổi: báo cho các cache câu trả lời xóa dữ liệu cũ
+        bump_corpus_version()
+        return docsearch
+    except Exception as e:
+        logger.error(f"Error loading documents to local index: {str(e)}")
+        raise
+
 def load_documents_to_pinecone():
     """Load documents and upsert to Pinecone."""
+    from langchain_community.vectorstores import Pinecone as LangchainPinecone
+
     try:       
         current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         data_directory = os.path.join(current_dir, 'Data')
@@ -79,14 +180,14 @@ def load_documents_to_pinecone():
         # Kiểm tra xem index đã tồn tại chưa
         _, index_name = initialize_pinecone()
         
-        # Kiểm tra xem index đã chứa dữ liệu chưa
-        # Sử dụng một simple query để kiểm tra
+        # Kiểm tra xem index đã chứa dữ liệu chưa bằng thống kê của index
+        # (không cần truy vấn vector giả)
         try:
-            index = pc.Index(index_name)
-            response = index.query(vector=[0] * 768, top_k=1, include_metadata=False)
+            index = get_pinecone_client().Index(index_name)
+            stats = index.describe_index_stats()
             
-            # Nếu có ít nhất một kết quả, tức là index đã có dữ liệu
-            if response.matches and len(response.matches) > 0:
+            # Nếu có ít nhất một vector, tức là index đã có dữ liệu
+            if stats.total_vector_count:
                 logger.info("Index already contains data. Skipping document loading...")
                 embeddings = download_hugging_face_embeddings()
                 return LangchainPinecone.from_existing_index(index_name, embeddings)
@@ -97,18 +198,17 @@ def load_documents_to_pinecone():
         logger.info(f"Loading documents from {data_directory}")
         logger.info(f"Files in Data directory: {os.listdir(data_directory)}")
         
-        extracted_data = load_pdf_file(data_directory)
-        text_chunks = text_split(extracted_data)
-        logger.info(f"Length of Text Chunks: {len(text_chunks)}")
-
         embeddings = download_hugging_face_embeddings()
 
-        docsearch = LangchainPinecone.from_documents(
-            documents=text_chunks,
-            embedding=embeddings,
-            index_name=index_name
-        )
+        # Văn bản trang và embedding được lấy lại từ cache ingest nếu corpus không đổi
+        stats = ingest_directory(data_directory, embeddings, PineconeSink(get_pinecone_client().Index(index_name)),
+                                 chunk_filter=_content_id_filter(), cache=open_ingest_cache(embeddings))
+        logger.info(f"Length of Text Chunks: {stats.chunks}")
+
+        docsearch = LangchainPinecone.from_existing_index(index_name, embeddings)
         logger.info("Data successfully upserted to Pinecone index.")
+        # Corpus thay đổi: báo cho các cache câu trả lời xóa dữ liệu cũ
+        bump_corpus_version()
         return docsearch
     except Exception as e:
         logger.error(f"Error loading documents to Pinecone: {str(e)}")
@@ -0,0 +1,334 @@
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+
+from src.ingest_cache import IngestCache
+from src.manifest import chunk_id, file_sha256
+
+# Thiết lập logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Cấu hình pipeline ingest
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 2)))
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "25"))
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "64"))
+INGEST_UPSERT_CONCURRENCY = int(os.getenv("INGEST_UPSERT_CONCURRENCY", "4"))
+
+# Mặc định cùng tham số với text_split() để chunk giống hệt cách cũ
+CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "500"))
+CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "20"))
+
+Chunk = Tuple[str, Dict[str, Any]]
+
+
+def list_pdf_files(data_path: str) -> List[str]:
+    """Danh sách file PDF trong thư mục (cùng kiểm tra như load_pdf_file)."""
+    if not os.path.exists(data_path):
+        raise FileNotFoundError(f"Directory not found: '{data_path}'")
+    if not os.path.isdir(data_path):
+        raise ValueError(f"Expected directory, got file: '{data_path}'")
+    return sorted(
+        os.path.join(data_path, name) for name in os.listdir(data_path) if name.lower().endswith(".pdf")
+    )
+
+
+def _page_ranges(path: str, pages_per_task: int, part_path_fn=None) -> List[Tuple[str, int, int, Optional[str]]]:
+    from pypdf import PdfReader
+
+    page_count = len(PdfReader(path).pages)
+    return [
+        (path, start, min(start + pages_per_task, page_count), part_path_fn(start) if part_path_fn else None)
+        for start in range(0, page_count, pages_per_task)
+    ]
+
+
+def _split_pages(path: str, pages: List[Tuple[int, str]]) -> List[Chunk]:
+    """Chia các trang thành đoạn; metadata giống PyPDFLoader (`source`, `page`) để tương thích với index cũ."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    documents = [Document(page_content=text, metadata={"source": path, "page": page}) for page, text in pages]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return [(chunk.page_content, chunk.metadata) for chunk in splitter.split_documents(documents)]
+
+
+def _parse_and_split(task: Tuple[str, int, int, Optional[str]]) -> Tuple[str, int, List[Chunk]]:
+    """
+    Chạy trong tiến trình con: đọc một dải trang của một PDF và chia thành các đoạn.
+
+    Nếu có `part_path`, văn bản trang được ghi vào cache để lần sau không phải parse lại.
+    """
+    from pypdf import PdfReader
+
+    path, start, end, part_path = task
+    reader = PdfReader(path)
+    pages = [(i, reader.pages[i].extract_text() or "") for i in range(start, end)]
+    if part_path:
+        IngestCache.write_page_part(part_path, pages)
+    return path, len(pages), _split_pages(path, pages)
+
+
+class IngestStats:
+    """Số lượng và thời gian theo từng giai đoạn: parse (trang), chunk, embed và upsert (vector)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = 0
+        self.pages = 0
+        self.chunks = 0
+        self.skipped_chunks = 0
+        self.vectors = 0
+        self.cached_pages = 0
+        self.cached_vectors = 0
+        self.upserted = 0
+        self.parse_seconds = 0.0  # Thời gian thực tới khi trang cuối được parse xong
+        self.embed_seconds = 0.0  # Tổng thời gian tính embedding
+        self.upsert_seconds = 0.0  # Tổng thời gian các lô upsert (chạy song song)
+        self.total_seconds = 0.0
+
+    def report(self) -> Dict[str, Any]:
+        def rate(count, seconds):
+            return round(count / seconds, 2) if seconds else 0.0
+
+        return {
+            "files": self.files,
+            "pages": self.pages,
+            "chunks": self.chunks,
+            "skipped_chunks": self.skipped_chunks,
+            "vectors": self.vectors,
+            "cached_pages": self.cached_pages,
+            "cached_vectors": self.cached_vectors,
+            "upserted": self.upserted,
+            "pages_per_second": rate(self.pages, self.parse_seconds),
+            "chunks_per_second": rate(self.chunks, self.parse_seconds),
+            "vectors_per_second": rate(self.vectors, self.embed_seconds),
+            "upserted_per_second": rate(self.upserted, self.upsert_seconds),
+            "total_seconds": round(self.total_seconds, 2),
+        }
+
+
+class PineconeSink:
+    """Upsert các lô vector vào Pinecone song song, tối đa `concurrency` lô cùng lúc."""
+
+    def __init__(self, index, concurrency: int = INGEST_UPSERT_CONCURRENCY, text_key: str = "text"):
+        self.index = index
+        self.text_key = text_key
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._in_flight = set()
+        self._max_in_flight = concurrency * 2
+
+    def _upsert(self, texts, vectors, metadatas, ids) -> Tuple[int, float]:
+        start = time.perf_counter()
+        self.index.upsert(vectors=[
+            {"id": doc_id, "values": vector, "metadata": {**metadata, self.text_key: text}}
+            for text, vector, metadata, doc_id in zip(texts, vectors, metadatas, ids)
+        ])
+        return len(ids), time.perf_counter() - start
+
+    def write(self, texts, vectors, metadatas, ids, stats: IngestStats):
+        # Giữ số lô đang chờ có giới hạn để bộ nhớ không tăng theo kích thước tài liệu
+        while len(self._in_flight) >= self._max_in_flight:
+            self._collect(stats, FIRST_COMPLETED)
+        self._in_flight.add(self._executor.submit(self._upsert, texts, vectors, metadatas, ids))
+
+    def _collect(self, stats: IngestStats, return_when):
+        done, self._in_flight = wait(self._in_flight, return_when=return_when)
+        for future in done:
+            count, seconds = future.result()
+            stats.upserted += count
+            stats.upsert_seconds += seconds
+
+    def close(self, stats: IngestStats, commit: bool = True):
+        try:
+            if self._in_flight:
+                self._collect(stats, ALL_COMPLETED)
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def delete(self, ids: List[str], batch_size: int = 1000):
+        """Xóa vector theo ID (Pinecone giới hạn 1000 ID mỗi lệnh)"""
+        ids = list(ids)
+        for i in range(0, len(ids), batch_size):
+            self.index.delete(ids=ids[i:i + batch_size])
+
+
+class LocalIndexSink:
+    """
+    Ghi vào LocalVectorStore theo từng lô. Index cục bộ chỉ nối thêm nên mỗi lô được
+    ghi ngay (upsert theo ID nội dung), bộ nhớ không tăng theo kích thước corpus;
+    đoạn cũ không còn dùng được dọn bằng delete() sau khi ingest xong.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def write(self, texts, vectors, metadatas, ids, stats: IngestStats):
+        start = time.perf_counter()
+        self.store.add_embeddings(texts, vectors, metadatas=metadatas, ids=ids)
+        stats.upserted += len(ids)
+        stats.upsert_seconds += time.perf_counter() - start
+
+    def close(self, stats: IngestStats, commit: bool = True):
+        # Các lô đã được ghi trong write(); ingest lỗi giữa chừng chỉ để lại các đoạn đã upsert,
+        # index cũ vẫn nguyên vì chưa có gì bị xóa
+        pass
+
+    def delete(self, ids: List[str]):
+        self.store.delete(list(ids))
+
+
+def iter_chunks(files: List[str], stats: IngestStats, workers: int = INGEST_WORKERS,
+                pages_per_task: int = INGEST_PAGES_PER_TASK, cache: Optional[IngestCache] = None,
+                file_hashes: Optional[Dict[str, str]] = None) -> Iterator[Chunk]:
+    """
+    Parse các PDF trong process pool theo từng dải trang và trả về các đoạn ngay khi có.
+
+    Chỉ giữ tối đa `2 * workers` dải trang đang xử lý để bộ nhớ có giới hạn. File đã có
+    văn bản trang trong cache được chia đoạn trực tiếp, không cần parse lại.
+    """
+    stats.files = len(files)
+    to_parse = []
+    for path in files:
+        if cache is not None and cache.has_pages(file_hashes[path]):
+            pages = list(cache.read_pages(file_hashes[path]))
+            chunks = _split_pages(path, pages)
+            stats.pages += len(pages)
+            stats.cached_pages += len(pages)
+            stats.chunks += len(chunks)
+            yield from chunks
+        else:
+            to_parse.append(path)
+
+    # Số dải trang còn lại của mỗi file, để ghép cache trang khi file parse xong
+    remaining: Dict[str, int] = {}
+
+    def tasks():
+        for path in to_parse:
+            part_path_fn = None
+            if cache is not None:
+                file_hash = file_hashes[path]
+                cache.clear_page_parts(file_hash)
+                part_path_fn = lambda start, file_hash=file_hash: cache.page_part_path(file_hash, start)
+            ranges = _page_ranges(path, pages_per_task, part_path_fn)
+            remaining[path] = len(ranges)
+            yield from ranges
+
+    def drain(future) -> Iterator[Chunk]:
+        path, page_count, chunks = future.result()
+        stats.pages += page_count
+        stats.chunks += len(chunks)
+        remaining[path] -= 1
+        if cache is not None and remaining[path] == 0:
+            cache.finalize_pages(file_hashes[path])
+        yield from chunks
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for task in tasks():
+            in_flight.add(executor.submit(_parse_and_split, task))
+            if len(in_flight) < workers * 2:
+                continue
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from drain(future)
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from drain(future)
+    stats.parse_seconds = time.perf_counter() - stats.started
+
+
+def ingest_directory(data_path: str, embeddings, sink,
+                     chunk_filter: Optional[Callable[[Chunk], bool]] = None,
+                     id_fn: Optional[Callable[[Chunk], str]] = None,
+                     batch_size: int = INGEST_EMBED_BATCH, workers: int = INGEST_WORKERS,
+                     files: Optional[List[str]] = None, cache: Optional[IngestCache] = None,
+                     file_hashes: Optional[Dict[str, str]] = None) -> IngestStats:
+    """
+    Pipeline ingest dạng stream: parse PDF song song -> chia đoạn -> embed theo lô cố định -> upsert.
+
+    Args:
+        data_path: Thư mục chứa các file PDF
+        embeddings: Model embedding (embed_documents)
+        sink: PineconeSink hoặc LocalIndexSink
+        chunk_filter: Trả về False để bỏ qua một đoạn (ví dụ đoạn đã có trong index)
+        id_fn: Tạo ID vector cho một đoạn; mặc định dùng metadata["doc_id"] hoặc UUID ngẫu nhiên
+        batch_size: Số đoạn mỗi lô embedding / upsert
+        files: Chỉ ingest các file này (mặc định mọi PDF trong data_path)
+        cache: IngestCache để dùng lại văn bản trang và embedding đã tính
+        file_hashes: Đường dẫn -> SHA-256 nội dung (tự tính nếu có cache mà không truyền vào)
+
+    Returns:
+        IngestStats với thông lượng từng giai đoạn
+    """
+    stats = IngestStats()
+    id_fn = id_fn or (lambda chunk: chunk[1].get("doc_id") or uuid.uuid4().hex)
+
+    def flush(batch: List[Chunk]):
+        texts = [text for text, _ in batch]
+        metadatas = [metadata for _, metadata in batch]
+        vectors = [None] * len(batch)
+        if cache is not None:
+            keys = [cache.embedding_key(file_hashes[metadata["source"]], CHUNK_SIZE, CHUNK_OVERLAP)
+                    for metadata in metadatas]
+            cids = [chunk_id(text) for text in texts]
+            for i in range(len(batch)):
+                vectors[i] = cache.get_embedding(keys[i], cids[i])
+            stats.cached_vectors += sum(vector is not None for vector in vectors)
+
+        # Chỉ embed các đoạn chưa có trong cache
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            start = time.perf_counter()
+            computed = embeddings.embed_documents([texts[i] for i in missing])
+            stats.embed_seconds += time.perf_counter() - start
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+            if cache is not None:
+                by_key: Dict[str, List[int]] = {}
+                for i in missing:
+                    by_key.setdefault(keys[i], []).append(i)
+                for key, rows in by_key.items():
+                    cache.append_embeddings(key, [cids[i] for i in rows], [vectors[i] for i in rows])
+        stats.vectors += len(vectors)
+        sink.write(texts, vectors, metadatas, [id_fn(chunk) for chunk in batch], stats)
+
+    batch: List[Chunk] = []
+    try:
+        if files is None:
+            files = list_pdf_files(data_path)
+        if cache is not None:
+            file_hashes = dict(file_hashes or {})
+            for path in files:
+                if path not in file_hashes:
+                    file_hashes[path] = file_sha256(path)
+        for chunk in iter_chunks(files, stats, workers=workers, cache=cache, file_hashes=file_hashes):
+            if chunk_filter is not None and not chunk_filter(chunk):
+                stats.skipped_chunks += 1
+                continue
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    except BaseException:
+        sink.close(stats, commit=False)
+        if cache is not None:
+            # Embedding đã tính vẫn đúng, giữ lại để lần chạy sau không phải tính lại
+            cache.finalize_embeddings()
+        raise
+    sink.close(stats)
+    if cache is not None:
+        cache.finalize_embeddings()
+    stats.total_seconds = time.perf_counter() - stats.started
+    logger.info(f"Ingestion finished: {stats.report()}")
+    return stats
@@ -0,0 +1,177 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Thiết lập logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+INGEST_CACHE_DIR = os.getenv(
+    "INGEST_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "ingest")
+)
+
+INGEST_CACHE_ENABLED = os.getenv("INGEST_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+class IngestCache:
+    """
+    Cache trên đĩa cho pipeline ingest, để rebuild index không phải làm lại việc cũ.
+
+    - `pages/{sha256 file}.jsonl`: văn bản từng trang đã trích xuất bằng pypdf, chỉ phụ
+      thuộc nội dung file nên dùng lại được khi đổi tham số chia đoạn.
+    - `embeddings/{key}.npy` + `{key}.ids.json`: embedding float32 của các đoạn, khóa theo
+      hash file + tham số chia đoạn + model embedding; được memory-map khi đọc.
+
+    Mọi file đều được ghi ra file tạm rồi os.replace nên cache không bao giờ ở trạng thái dở.
+    """
+
+    def __init__(self, root: str = INGEST_CACHE_DIR, namespace: str = "default"):
+        self.root = root
+        self.namespace = namespace
+        self.pages_dir = os.path.join(root, "pages")
+        self.embeddings_dir = os.path.join(root, "embeddings")
+        os.makedirs(self.pages_dir, exist_ok=True)
+        os.makedirs(self.embeddings_dir, exist_ok=True)
+        self._loaded: Dict[str, Tuple[Dict[str, int], Optional[np.ndarray]]] = {}
+        self._pending: Dict[str, List[str]] = {}
+
+    # --- Văn bản trang ---
+
+    def pages_path(self, file_hash: str) -> str:
+        return os.path.join(self.pages_dir, f"{file_hash}.jsonl")
+
+    def page_part_path(self, file_hash: str, start: int) -> str:
+        return os.path.join(self.pages_dir, f"{file_hash}.{start:08d}.part")
+
+    def has_pages(self, file_hash: str) -> bool:
+        return os.path.exists(self.pages_path(file_hash))
+
+    def read_pages(self, file_hash: str) -> Iterator[Tuple[int, str]]:
+        with open(self.pages_path(file_hash), encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                yield record["page"], record["text"]
+
+    @staticmethod
+    def write_page_part(part_path: str, pages: List[Tuple[int, str]]):
+        """Gọi trong tiến trình con: ghi văn bản của một dải trang."""
+        tmp_path = f"{part_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for page, text in pages:
+                f.write(json.dumps({"page": page, "text": text}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, part_path)
+
+    def clear_page_parts(self, file_hash: str):
+        """Xóa các phần còn sót từ lần chạy lỗi trước (có thể khác cách chia dải trang)"""
+        for part in glob.glob(os.path.join(self.pages_dir, f"{file_hash}.*.part")):
+            os.remove(part)
+
+    def finalize_pages(self, file_hash: str):
+        """Ghép các phần theo thứ tự trang thành một file JSONL"""
+        parts = sorted(glob.glob(os.path.join(self.pages_dir, f"{file_hash}.*.part")))
+        tmp_path = f"{self.pages_path(file_hash)}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            for part in parts:
+                with open(part, encoding="utf-8") as f:
+                    out.write(f.read())
+        os.replace(tmp_path, self.pages_path(file_hash))
+        for part in parts:
+            os.remove(part)
+
+    # --- Embedding của các đoạn ---
+
+    def embedding_key(self, file_hash: str, chunk_size: int, chunk_overlap: int) -> str:
+        raw = f"{file_hash}:{chunk_size}:{chunk_overlap}:{self.namespace}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    def _embedding_paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.embeddings_dir, key)
+        return f"{base}.npy", f"{base}.ids.json"
+
+    def _load_embeddings(self, key: str) -> Tuple[Dict[str, int], Optional[np.ndarray]]:
+        if key not in self._loaded:
+            vectors_path, ids_path = self._embedding_paths(key)
+            if os.path.exists(vectors_path) and os.path.exists(ids_path):
+                with open(ids_path, encoding="utf-8") as f:
+                    ids = json.load(f)
+                self._loaded[key] = ({cid: row for row, cid in enumerate(ids)}, np.load(vectors_path, mmap_mode="r"))
+            else:
+                self._loaded[key] = ({}, None)
+        return self._loaded[key]
+
+    def get_embedding(self, key: str, chunk_id: str) -> Optional[List[float]]:
+        rows, vectors = self._load_embeddings(key)
+        row = rows.get(chunk_id)
+        return None if row is None else vectors[row].tolist()
+
+    def _part_path(self, key: str) -> str:
+        return os.path.join(self.embeddings_dir, f"{key}.f32.part")
+
+    def append_embeddings(self, key: str, chunk_ids: List[str], vectors: List[List[float]]):
+        """Ghi thêm embedding mới ra file tạm; chỉ giữ ID trong bộ nhớ"""
+        vectors_part = self._part_path(key)
+        if key not in self._pending:
+            self._pending[key] = []
+            mode = "wb"  # Bỏ phần dở của lần chạy lỗi trước
+        else:
+            mode = "ab"
+        with open(vectors_part, mode) as f:
+            f.write(np.asarray(vectors, dtype=np.float32).tobytes())
+        self._pending[key].extend(chunk_ids)
+
+    def finalize_embeddings(self):
+        """Gộp embedding mới với bản đã có của từng khóa thành file .npy"""
+        for key, new_ids in self._pending.items():
+            vectors_part = self._part_path(key)
+            old_rows, old_vectors = self._load_embeddings(key)
+            raw = np.fromfile(vectors_part, dtype=np.float32)
+            new_vectors = raw.reshape(len(new_ids), -1) if new_ids else raw.reshape(0, 0)
+
+            ids = list(old_rows)
+            seen = set(old_rows)
+            keep_new = []
+            for i, cid in enumerate(new_ids):
+                if cid not in seen:
+                    seen.add(cid)
+                    keep_new.append(i)
+            ids.extend(new_ids[i] for i in keep_new)
+            dim = new_vectors.shape[1] if len(new_ids) else old_vectors.shape[1]
+
+            vectors_path, ids_path = self._embedding_paths(key)
+            tmp_path = f"{vectors_path}.tmp"
+            merged = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(len(ids), dim))
+            if old_vectors is not None and len(old_rows):
+                merged[:len(old_rows)] = old_vectors
+            if keep_new:
+                merged[len(old_rows):] = new_vectors[keep_new]
+            merged.flush()
+            del merged
+            os.replace(tmp_path, vectors_path)
+            with open(f"{ids_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(ids, f)
+            os.replace(f"{ids_path}.tmp", ids_path)
+            os.remove(vectors_part)
+            self._loaded.pop(key, None)
+        self._pending.clear()
+
+
+def open_ingest_cache(embeddings, root: Optional[str] = None) -> Optional[IngestCache]:
+    """
+    Cache ingest cho model embedding đang dùng, hoặc None nếu bị tắt (INGEST_CACHE_ENABLED).
+
+    Namespace lấy từ CachedEmbeddings (backend + tên model) để vector của model khác
+    không bao giờ bị dùng lẫn.
+    """
+    if not INGEST_CACHE_ENABLED:
+        return None
+    namespace = getattr(embeddings, "namespace", None) or type(embeddings).__name__
+    return IngestCache(root or INGEST_CACHE_DIR, namespace=namespace)
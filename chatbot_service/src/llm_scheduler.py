@@ -0,0 +1,327 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from dotenv import load_dotenv
+
+from src.metrics import observe_stage_seconds
+
+# Thiết lập logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+T = TypeVar("T")
+
+# Tên lớp lỗi hết quota / quá tải của google-api-core (không import trực tiếp để module nhẹ)
+QUOTA_ERROR_NAMES = ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable")
+
+
+class LLMOverloadedError(TimeoutError):
+    """Không gọi được LLM trước hạn chót (hàng đợi quá lâu hoặc hết quota sau khi thử lại)."""
+
+
+def is_quota_error(error: BaseException) -> bool:
+    """Lỗi 429/503 từ Gemini: nên chờ rồi thử lại thay vì trả lỗi ngay."""
+    if type(error).__name__ in QUOTA_ERROR_NAMES:
+        return True
+    return getattr(error, "code", None) in (429, 503) or "429" in str(error)
+
+
+def estimate_tokens(text: str, max_output_tokens: int = 0) -> int:
+    """Ước lượng số token của một lời gọi (khoảng 3 ký tự/token cho tiếng Việt) cộng phần output tối đa."""
+    return len(text) // 3 + 1 + max_output_tokens
+
+
+class TokenBucket:
+    """Token bucket theo phút: dung lượng `per_minute`, nạp lại đều theo thời gian. 0 = không giới hạn."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Số giây phải chờ để có `amount` token (gọi khi đang giữ lock của scheduler)."""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """Hoàn lại (delta > 0) hoặc trừ thêm token khi biết số token thực tế; có thể âm (nợ)."""
+        if self.capacity:
+            self.level = min(self.capacity, self.level + delta)
+
+
+class _Waiter:
+    __slots__ = ("granted", "wake")
+
+    def __init__(self, wake: Callable[[], None]):
+        self.granted = False
+        self.wake = wake
+
+
+class LLMScheduler:
+    """
+    Bộ điều phối dùng chung cho mọi lời gọi Gemini đi ra ngoài.
+
+    - Giới hạn số lời gọi đang chạy (`max_concurrency`); lời gọi vượt quá xếp hàng FIFO.
+    - Ngân sách request/phút và token/phút (token bucket); token được ước lượng trước
+      khi gọi và điều chỉnh theo usage_metadata sau khi có phản hồi.
+    - Mỗi lời gọi có hạn chót (`queue_timeout` giây): quá hạn khi còn xếp hàng hoặc khi
+      đang chờ thử lại thì ném LLMOverloadedError thay vì chờ mãi.
+    - Lỗi hết quota (429/503) được thử lại với backoff lũy thừa có jitter.
+
+    Dùng được từ cả coroutine và thread (LangChain gọi `_call` đồng bộ trong thread),
+    nên trạng thái được bảo vệ bằng threading.Lock.
+    """
+
+    def __init__(self, max_concurrency: int = 8, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 queue_timeout: float = 30.0, max_retries: int = 3, retry_base_delay: float = 1.0,
+                 retry_max_delay: float = 20.0):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+        self._waiters: "deque[_Waiter]" = deque()
+        self._in_flight = 0
+
+        self.calls = 0
+        self.queue_depth_max = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.queue_timeouts = 0
+        self.quota_errors = 0
+        self.retries = 0
+        self.tokens_estimated = 0
+        self.tokens_used = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMScheduler":
+        return cls(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0")),
+            tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "0")),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "30")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+            retry_base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "1")),
+            retry_max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "20")),
+        )
+
+    # --- Suất chạy đồng thời ---
+
+    def _try_acquire(self, waiter: _Waiter) -> bool:
+        with self._lock:
+            if self._in_flight < self.max_concurrency and not self._waiters:
+                self._in_flight += 1
+                return True
+            self._waiters.append(waiter)
+            self.queue_depth_max = max(self.queue_depth_max, len(self._waiters))
+            return False
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Rời hàng đợi khi quá hạn; trả về True nếu suất đã được chuyển cho waiter này."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def _release(self):
+        with self._lock:
+            # Chuyển thẳng suất cho người đầu hàng đợi để giữ thứ tự FIFO
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+            else:
+                self._in_flight -= 1
+
+    def _budget_wait(self, tokens: int) -> float:
+        """0 nếu đã trừ ngân sách, ngược lại là số giây cần chờ."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(tokens, now))
+            if wait == 0:
+                self._requests.take(1)
+                self._tokens.take(tokens)
+            return wait
+
+    def _record_wait(self, started: float):
+        wait = time.monotonic() - started
+        observe_stage_seconds("llm_queue", wait)
+        with self._lock:
+            self.calls += 1
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+
+    def _timeout(self, deadline: float) -> LLMOverloadedError:
+        with self._lock:
+            self.queue_timeouts += 1
+        return LLMOverloadedError(f"LLM call could not start within {self.queue_timeout:g}s "
+                                  f"(queue depth {len(self._waiters)}, in flight {self._in_flight})")
+
+    @contextmanager
+    def slot(self, tokens: int, deadline: Optional[float] = None):
+        """Giữ một suất gọi LLM (đồng bộ) sau khi đã trừ ngân sách request/token."""
+        started = time.monotonic()
+        deadline = deadline or started + self.queue_timeout
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        if not self._try_acquire(waiter):
+            if not event.wait(max(deadline - time.monotonic(), 0)) and not self._abandon(waiter):
+                raise self._timeout(deadline)
+        try:
+            while True:
+                wait = self._budget_wait(tokens)
+                if not wait:
+                    break
+                if time.monotonic() + wait > deadline:
+                    raise self._timeout(deadline)
+                time.sleep(wait)
+            self._record_wait(started)
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self, tokens: int, deadline: Optional[float] = None):
+        """Giữ một suất gọi LLM (bất đồng bộ) sau khi đã trừ ngân sách request/token."""
+        started = time.monotonic()
+        deadline = deadline or started + self.queue_timeout
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = _Waiter(wake)
+        if not self._try_acquire(waiter):
+            try:
+                await asyncio.wait_for(asyncio.shield(future), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                if not self._abandon(waiter):
+                    raise self._timeout(deadline)
+            except asyncio.CancelledError:
+                # Client ngắt kết nối khi đang xếp hàng: trả lại suất nếu vừa được chuyển tới
+                if self._abandon(waiter):
+                    self._release()
+                raise
+        try:
+            while True:
+                wait = self._budget_wait(tokens)
+                if not wait:
+                    break
+                if time.monotonic() + wait > deadline:
+                    raise self._timeout(deadline)
+                await asyncio.sleep(wait)
+            self._record_wait(started)
+            yield
+        finally:
+            self._release()
+
+    # --- Gọi kèm thử lại ---
+
+    def record_usage(self, response: Any, estimated: int):
+        """Điều chỉnh ngân sách token theo usage_metadata thực tế của phản hồi (nếu có)."""
+        usage = getattr(response, "usage_metadata", None)
+        actual = getattr(usage, "total_token_count", 0) if usage is not None else 0
+        with self._lock:
+            self.tokens_estimated += estimated
+            if actual:
+                self.tokens_used += actual
+                self._tokens.adjust(estimated - actual)
+
+    def _retry_delay(self, attempt: int, error: BaseException, deadline: float) -> float:
+        with self._lock:
+            self.quota_errors += 1
+        if attempt >= self.max_retries:
+            raise LLMOverloadedError(f"LLM quota exhausted after {attempt + 1} attempts: {error}") from error
+        # Backoff lũy thừa "full jitter" để các worker không thử lại cùng lúc
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+        if time.monotonic() + delay > deadline:
+            raise LLMOverloadedError(f"LLM quota exhausted before the deadline: {error}") from error
+        with self._lock:
+            self.retries += 1
+        logger.warning(f"Gemini quota error, retrying in {delay:.2f}s (attempt {attempt + 1}): {error}")
+        return delay
+
+    def run(self, fn: Callable[[], T], tokens: int) -> T:
+        """Gọi `fn` (đồng bộ) qua scheduler, thử lại khi hết quota."""
+        deadline = time.monotonic() + self.queue_timeout
+        attempt = 0
+        while True:
+            try:
+                with self.slot(tokens, deadline):
+                    response = fn()
+                self.record_usage(response, tokens)
+                return response
+            except Exception as e:
+                if not is_quota_error(e):
+                    raise
+                time.sleep(self._retry_delay(attempt, e, deadline))
+                attempt += 1
+
+    async def run_async(self, fn: Callable[[], Awaitable[T]], tokens: int) -> T:
+        """Gọi `fn` (coroutine) qua scheduler, thử lại khi hết quota."""
+        deadline = time.monotonic() + self.queue_timeout
+        attempt = 0
+        while True:
+            try:
+                async with self.aslot(tokens, deadline):
+                    response = await fn()
+                self.record_usage(response, tokens)
+                return response
+            except Exception as e:
+                if not is_quota_error(e):
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt, e, deadline))
+                attempt += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._requests._refill(now)
+            self._tokens._refill(now)
+            return {
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": len(self._waiters),
+                "queue_depth_max": self.queue_depth_max,
+                "calls": self.calls,
+                "wait_seconds_avg": self.wait_seconds_total / self.calls if self.calls else 0.0,
+                "wait_seconds_max": self.wait_seconds_max,
+                "queue_timeouts": self.queue_timeouts,
+                "quota_errors": self.quota_errors,
+                "retries": self.retries,
+                "tokens_estimated": self.tokens_estimated,
+                "tokens_used": self.tokens_used,
+                "requests_budget_remaining": self._requests.level if self._requests.capacity else None,
+                "tokens_budget_remaining": self._tokens.level if self._tokens.capacity else None,
+            }
+
+
+# Scheduler dùng chung cho cả tiến trình (GeminiLLM và dịch câu hỏi/câu trả lời)
+llm_scheduler = LLMScheduler.from_env()
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Set, Tuple
+
+# Thiết lập logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def chunk_id(text: str) -> str:
+    """ID vector ổn định theo nội dung đoạn (SHA-256), giống nhau giữa các lần chạy và các máy."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """Hash nội dung file, đọc theo khối để không nạp cả file vào bộ nhớ."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IndexManifest:
+    """
+    Manifest cục bộ của một index: tên file -> hash nội dung và danh sách chunk ID.
+
+    Dùng để index tăng dần: chỉ parse các PDF mới hoặc đã đổi, chỉ embed các đoạn chưa
+    có, và xóa vector của các đoạn không còn file nào tham chiếu. Một chunk ID có thể
+    thuộc nhiều file (nội dung trùng), nên chỉ bị xóa khi không còn file nào giữ nó.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict] = {}
+        self.exists = os.path.exists(path)
+        if self.exists:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != MANIFEST_VERSION:
+                raise ValueError(f"Unsupported manifest version in {path}: {data.get('version')}")
+            self.files = data["files"]
+
+    def chunk_ids(self) -> Set[str]:
+        return {cid for entry in self.files.values() for cid in entry["chunk_ids"]}
+
+    def diff(self, current: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """
+        So sánh với các file hiện có (tên -> hash).
+
+        Returns:
+            (các file mới hoặc đã thay đổi, các file đã bị xóa)
+        """
+        changed = sorted(name for name, digest in current.items()
+                         if self.files.get(name, {}).get("sha256") != digest)
+        removed = sorted(name for name in self.files if name not in current)
+        return changed, removed
+
+    def set_file(self, name: str, digest: str, chunk_ids: Iterable[str]):
+        self.files[name] = {
+            "sha256": digest,
+            "chunk_ids": sorted(set(chunk_ids)),
+            "indexed_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+
+    def remove_file(self, name: str):
+        self.files.pop(name, None)
+
+    def save(self):
+        """Ghi manifest nguyên tử (file tạm rồi os.replace)."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+        self.exists = True
@@ -0,0 +1,139 @@
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from prometheus_client.core import REGISTRY, GaugeMetricFamily
+from starlette.routing import Match
+
+# Thiết lập logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Từ 1 ms (lệnh Redis) tới 60 s (LLM chờ quota), đủ mịn quanh 1 s cho độ trễ "suy nghĩ"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75,
+                   1.0, 1.5, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Thời gian xử lý request theo endpoint (tới khi bắt đầu gửi response)",
+    ["method", "endpoint", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "request_stage_duration_seconds",
+    "Thời gian từng bước xử lý trong một request (dịch, truy xuất, sinh câu trả lời, Redis, MySQL...)",
+    ["endpoint", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "request_stage_errors_total",
+    "Số lần một bước xử lý ném lỗi",
+    ["endpoint", "stage"],
+)
+
+# Endpoint của request hiện tại; được đặt bởi middleware và tự truyền sang task/thread con
+# (asyncio task, asyncio.to_thread), nên các bước nằm sâu trong chain vẫn gắn đúng endpoint
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("current_endpoint", default="background")
+
+
+def observe_stage_seconds(stage: str, seconds: float):
+    """Ghi thời gian của một bước đã đo sẵn ở nơi khác."""
+    STAGE_SECONDS.labels(current_endpoint.get(), stage).observe(seconds)
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """Đo thời gian khối lệnh bên trong (dùng được cả trong hàm async quanh các lệnh await)."""
+    endpoint = current_endpoint.get()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(endpoint, stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(endpoint, stage).observe(time.perf_counter() - started)
+
+
+def route_template(request) -> str:
+    """Đường dẫn mẫu của route (ví dụ /chat_history/{session_id}) để nhãn không phụ thuộc ID."""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", request.url.path)
+    return "unmatched"
+
+
+async def track_request(request, call_next):
+    """Middleware HTTP: đặt endpoint hiện tại và đo tổng thời gian request."""
+    endpoint = route_template(request)
+    token = current_endpoint.set(endpoint)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        current_endpoint.reset(token)
+        if endpoint != "/metrics":
+            REQUEST_SECONDS.labels(request.method, endpoint, str(status)).observe(time.perf_counter() - started)
+
+
+class StatsCollector:
+    """
+    Xuất các dict `stats()` sẵn có (pool, cache, hàng đợi) thành gauge Prometheus.
+
+    Mỗi nguồn là một hàm trả về dict (hoặc None nếu chưa khởi tạo); mọi giá trị số được
+    xuất thành gauge `<tên nguồn>_<khóa>`, đọc tại thời điểm scrape nên không tốn gì giữa
+    các lần scrape. Nguồn bất đồng bộ (cần gọi Redis) được làm mới trong `render_metrics`.
+    """
+
+    def __init__(self):
+        self._sources: Dict[str, Callable[[], Optional[Dict[str, Any]]]] = {}
+        self._async_sources: Dict[str, Callable[[], Awaitable[Optional[Dict[str, Any]]]]] = {}
+        self._async_values: Dict[str, Dict[str, Any]] = {}
+
+    def register(self, name: str, fn: Callable[[], Optional[Dict[str, Any]]]):
+        self._sources[name] = fn
+
+    def register_async(self, name: str, fn: Callable[[], Awaitable[Optional[Dict[str, Any]]]]):
+        self._async_sources[name] = fn
+
+    async def refresh(self):
+        for name, fn in self._async_sources.items():
+            try:
+                self._async_values[name] = await fn()
+            except Exception as e:
+                logger.warning(f"Could not collect '{name}' metrics: {str(e)}")
+                self._async_values.pop(name, None)
+
+    def collect(self):
+        sources = dict(self._sources)
+        sources.update({name: (lambda value=value: value) for name, value in self._async_values.items()})
+        for name, fn in sources.items():
+            try:
+                stats = fn()
+            except Exception as e:
+                logger.warning(f"Could not collect '{name}' metrics: {str(e)}")
+                continue
+            for key, value in (stats or {}).items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                gauge = GaugeMetricFamily(f"{name}_{key}", f"{name} {key}")
+                gauge.add_metric([], value)
+                yield gauge
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+async def render_metrics() -> bytes:
+    """Nội dung cho GET /metrics (định dạng text của Prometheus)."""
+    await stats_collector.refresh()
+    return generate_latest(REGISTRY)
+
@@ -0,0 +1,125 @@
+from dotenv import load_dotenv
+import os
+import logging
+from functools import lru_cache
+from typing import AsyncIterator
+from src.prompt import USER_PREFIX, configure_gemini, token_usage
+from src.cache import TranslationCache
+from src.llm_scheduler import estimate_tokens, llm_scheduler
+from src.metrics import observe_stage
+
+# Thiết lập logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Các chế độ xử lý câu hỏi:
+# - "translate": dịch câu hỏi vi→en, chạy RAG, rồi dịch câu trả lời en→vi (3 lời gọi Gemini)
+# - "direct": truy xuất và trả lời trực tiếp bằng tiếng Việt trong 1 lời gọi Gemini
+#   (model embedding đa ngôn ngữ và system prompt đã yêu cầu trả lời bằng tiếng Việt)
+PIPELINE_MODE_TRANSLATE = "translate"
+PIPELINE_MODE_DIRECT = "direct"
+PIPELINE_MODES = (PIPELINE_MODE_TRANSLATE, PIPELINE_MODE_DIRECT)
+
+PIPELINE_MODE = os.getenv("QUERY_PIPELINE_MODE", PIPELINE_MODE_TRANSLATE)
+if PIPELINE_MODE not in PIPELINE_MODES:
+    logger.warning(f"Unknown QUERY_PIPELINE_MODE '{PIPELINE_MODE}', falling back to '{PIPELINE_MODE_TRANSLATE}'")
+    PIPELINE_MODE = PIPELINE_MODE_TRANSLATE
+logger.info(f"Query pipeline mode: {PIPELINE_MODE}")
+
+@lru_cache(maxsize=1)
+def get_translation_model():
+    """Model dịch, tạo ở lần dịch đầu tiên (không tạo lúc import)."""
+    return configure_gemini().GenerativeModel("gemini-2.0-flash-lite")
+
+# Cache kết quả dịch: LRU trong tiến trình + Redis dùng chung (gắn vào từ app khi khởi động)
+translation_cache = TranslationCache(
+    maxsize=int(os.getenv("TRANSLATION_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("TRANSLATION_CACHE_TTL", "3600")),
+    redis_ttl=int(os.getenv("TRANSLATION_CACHE_REDIS_TTL", "86400")),
+)
+
+async def _translate_uncached(text, source_lang, target_lang):
+    """Gọi Gemini để dịch; ném lỗi nếu thất bại để kết quả lỗi không bị cache."""
+    prompt = (
+        f"Translate this text from {source_lang} to {target_lang} accurately, "
+        f"ensuring proper Vietnamese characters if translating to Vietnamese, "
+        f"and return only the translated text without additional explanation: '{text}'"
+    )
+    # Đi qua scheduler dùng chung với GeminiLLM (giới hạn đồng thời, RPM/TPM, thử lại khi 429)
+    response = await llm_scheduler.run_async(
+        lambda: get_translation_model().generate_content_async(prompt),
+        estimate_tokens(prompt, 2 * len(text) // 3)
+    )
+    token_usage.record(response)
+    return response.text.strip()
+
+# Function to translate text using Gemini API
+async def translate_with_gemini(text, source_lang="vi", target_lang="en"):
+    """Translate text using Gemini API and return only the translated text."""
+    try:
+        return await translation_cache.get_or_translate(text, source_lang, target_lang, _translate_uncached)
+    except Exception as e:
+        logger.error(f"Translation error: {str(e)}")
+        return text  # Fallback to original text if translation fails
+
+async def answer_question(rag_chain, question: str, chat_history_str: str = "", mode: str = None) -> str:
+    """
+    Trả lời câu hỏi tiếng Việt bằng RAG chain theo chế độ pipeline đã chọn.
+
+    Args:
+        rag_chain: RAG chain đã khởi tạo (hỗ trợ ainvoke)
+        question: Câu hỏi gốc của người dùng (tiếng Việt)
+        chat_history_str: Lịch sử trò chuyện đã được nối thành chuỗi
+        mode: "translate" hoặc "direct"; mặc định lấy từ QUERY_PIPELINE_MODE
+
+    Returns:
+        Câu trả lời bằng tiếng Việt
+    """
+    mode = mode or PIPELINE_MODE
+
+    if mode == PIPELINE_MODE_TRANSLATE:
+        # Dịch câu hỏi từ tiếng Việt sang tiếng Anh
+        with observe_stage("translate_question"):
+            question_for_rag = await translate_with_gemini(question, "vi", "en")
+        logger.info(f"Translated query to English: {question_for_rag}")
+    else:
+        question_for_rag = question
+
+    # Thêm bối cảnh từ chat history vào prompt
+    full_input = USER_PREFIX + question_for_rag
+
+    # Process the query with history if available
+    if chat_history_str:
+        response = await rag_chain.ainvoke({"input": full_input, "history": chat_history_str})
+    else:
+        response = await rag_chain.ainvoke({"input": full_input})
+
+    if isinstance(response, dict) and "answer" in response:
+        answer = response["answer"]
+    else:
+        answer = str(response)
+
+    if mode == PIPELINE_MODE_TRANSLATE:
+        # Dịch câu trả lời từ tiếng Anh về tiếng Việt
+        with observe_stage("translate_answer"):
+            answer = await translate_with_gemini(answer, "en", "vi")
+        logger.info(f"Translated answer to Vietnamese: {answer}")
+
+    return answer
+
+async def stream_answer(rag_chain, question: str, chat_history_str: str = "") -> AsyncIterator[str]:
+    """
+    Stream câu trả lời tiếng Việt theo từng đoạn ngay khi Gemini sinh ra.
+
+    Luôn chạy theo chế độ "direct": chế độ "translate" phải chờ toàn bộ câu trả lời
+    tiếng Anh trước khi dịch ngược nên không thể stream.
+    """
+    inputs = {"input": USER_PREFIX + question}
+    if chat_history_str:
+        inputs["history"] = chat_history_str
+    async for chunk in rag_chain.astream(inputs):
+        if chunk:
+            yield chunk
@@ -1,11 +1,17 @@
-import google.generativeai as genai
+from langchain_core.language_models import LLM
+from langchain_core.outputs import GenerationChunk
 from langchain_core.prompts import ChatPromptTemplate
-from langchain.chains import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from dotenv import load_dotenv
 import os
 import logging
-from src.helper import load_documents_to_pinecone
+import threading
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, AsyncIterator, Dict, Iterator
+from src.helper import load_documents_to_vector_store
+from src.llm_scheduler import LLMOverloadedError, estimate_tokens, llm_scheduler
+from src.metrics import observe_stage
 
 # Thiết lập logging
 logging.basicConfig(level=logging.INFO)
@@ -13,24 +19,73 @@ logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
-GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GEMINI_API_KEY:
-    logger.error("GOOGLE_API_KEY not found in .env file.")
-    raise ValueError("GOOGLE_API_KEY not found in .env file.")
+# Warm-up trước khi báo sẵn sàng: full (truy xuất + sinh câu trả lời), retrieval hoặc off
+RAG_WARMUP = os.getenv("RAG_WARMUP", "full").lower()
+WARMUP_QUESTION = "Chế độ ăn uống lành mạnh là gì?"
 
-# Cấu hình Google Gemini API
-genai.configure(api_key=GEMINI_API_KEY)
+# Ưu tiên GEMINI_API_KEY (khóa app/main.py vẫn dùng), sau đó GOOGLE_API_KEY
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
 
-from langchain_core.language_models import LLM
+@lru_cache(maxsize=1)
+def configure_gemini():
+    """
+    Import SDK Gemini và cấu hình API key ở lần dùng đầu tiên, không phải lúc import module,
+    để khởi động nhanh và thiếu key chỉ làm lỗi các lời gọi LLM.
+    """
+    if not GEMINI_API_KEY:
+        logger.error("GEMINI_API_KEY / GOOGLE_API_KEY not found in .env file.")
+        raise ValueError("GEMINI_API_KEY / GOOGLE_API_KEY not found in .env file.")
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai
+
+# Cấu hình sinh văn bản dùng chung cho cả lời gọi đồng bộ và bất đồng bộ
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "max_output_tokens": 200,
+}
+
+class TokenUsage:
+    """Cộng dồn số lời gọi Gemini và số token đã dùng trong tiến trình."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.prompt_tokens = 0
+            self.output_tokens = 0
+    
+    def record(self, response):
+        """Ghi nhận usage_metadata từ một phản hồi Gemini (nếu có)."""
+        usage = getattr(response, "usage_metadata", None)
+        with self._lock:
+            self.calls += 1
+            if usage is not None:
+                self.prompt_tokens += getattr(usage, "prompt_token_count", 0) or 0
+                self.output_tokens += getattr(usage, "candidates_token_count", 0) or 0
+    
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "output_tokens": self.output_tokens,
+                "total_tokens": self.prompt_tokens + self.output_tokens,
+            }
+
+token_usage = TokenUsage()
 
 class GeminiLLM(LLM):
     model_name: str = "gemini-2.0-flash-lite"
-    model: genai.GenerativeModel = None
+    model: Any = None  # genai.GenerativeModel
     
     def __init__(self, model_name="gemini-2.0-flash-lite"): 
         super().__init__()
         self.model_name = model_name
-        self.model = genai.GenerativeModel(model_name)
+        self.model = configure_gemini().GenerativeModel(model_name)
     
     @property
     def _llm_type(self) -> str:
@@ -39,20 +94,79 @@ class GeminiLLM(LLM):
     
     def _call(self, prompt: str, stop=None, **kwargs):
         """Call the Gemini API and return the output."""
+        # Mọi lời gọi đi qua scheduler dùng chung (giới hạn đồng thời, ngân sách RPM/TPM, thử lại khi 429);
+        # quá tải thì ném lỗi để API trả 503. Lỗi khác cũng được ném lại thay vì trả câu xin lỗi,
+        # để câu xin lỗi không bị lưu vào semantic cache như một câu trả lời thật
+        tokens = estimate_tokens(prompt, GENERATION_CONFIG["max_output_tokens"])
         try:
-            response = self.model.generate_content(prompt, generation_config={
-                "temperature": 0.7,
-                "max_output_tokens": 200,
-            })
+            with observe_stage("generation"):
+                response = llm_scheduler.run(
+                    lambda: self.model.generate_content(prompt, generation_config=GENERATION_CONFIG), tokens
+                )
+            token_usage.record(response)
             return response.text.strip()
+        except LLMOverloadedError:
+            raise
         except Exception as e:
             logger.error(f"Error invoking Gemini: {str(e)}")
-            return "Tôi xin lỗi, đã có lỗi xảy ra."
+            raise
             
     async def _acall(self, prompt: str, stop=None, **kwargs):
         """Async call the Gemini API and return the output."""
-        # For simplicity, we're using the synchronous version in an async wrapper
-        return self._call(prompt, stop, **kwargs)
+        # Dùng API bất đồng bộ của Gemini để không chặn event loop
+        tokens = estimate_tokens(prompt, GENERATION_CONFIG["max_output_tokens"])
+        try:
+            with observe_stage("generation"):
+                response = await llm_scheduler.run_async(
+                    lambda: self.model.generate_content_async(prompt, generation_config=GENERATION_CONFIG), tokens
+                )
+            token_usage.record(response)
+            return response.text.strip()
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            logger.error(f"Error invoking Gemini: {str(e)}")
+            raise
+
+    def _stream(self, prompt: str, stop=None, run_manager=None, **kwargs) -> Iterator[GenerationChunk]:
+        """Stream the Gemini output chunk by chunk."""
+        # Giữ suất của scheduler trong suốt thời gian stream (không thử lại giữa chừng)
+        tokens = estimate_tokens(prompt, GENERATION_CONFIG["max_output_tokens"])
+        try:
+            with observe_stage("generation"), llm_scheduler.slot(tokens):
+                response = self.model.generate_content(prompt, generation_config=GENERATION_CONFIG, stream=True)
+                for chunk in response:
+                    if chunk.text:
+                        if run_manager:
+                            run_manager.on_llm_new_token(chunk.text)
+                        yield GenerationChunk(text=chunk.text)
+            llm_scheduler.record_usage(response, tokens)
+            token_usage.record(response)
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming from Gemini: {str(e)}")
+            raise
+
+    async def _astream(self, prompt: str, stop=None, run_manager=None, **kwargs) -> AsyncIterator[GenerationChunk]:
+        """Async stream the Gemini output chunk by chunk."""
+        tokens = estimate_tokens(prompt, GENERATION_CONFIG["max_output_tokens"])
+        try:
+            with observe_stage("generation"):
+                async with llm_scheduler.aslot(tokens):
+                    response = await self.model.generate_content_async(prompt, generation_config=GENERATION_CONFIG, stream=True)
+                    async for chunk in response:
+                        if chunk.text:
+                            if run_manager:
+                                await run_manager.on_llm_new_token(chunk.text)
+                            yield GenerationChunk(text=chunk.text)
+            llm_scheduler.record_usage(response, tokens)
+            token_usage.record(response)
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming from Gemini: {str(e)}")
+            raise
 
 # Prompt tối ưu cho dinh dưỡng
 system_prompt = (
@@ -74,9 +188,9 @@ prompt = ChatPromptTemplate.from_messages(
 )
 
 def get_retriever():
-    """Get or create a Pinecone retriever."""
+    """Get or create a retriever over the configured vector store."""
     try:
-        docsearch = load_documents_to_pinecone()
+        docsearch = load_documents_to_vector_store()
         retriever = docsearch.as_retriever(search_type="similarity", search_kwargs={"k": 3})
         logger.info("Retriever created successfully.")
         return retriever
@@ -84,27 +198,92 @@ def get_retriever():
         logger.error(f"Error getting retriever: {str(e)}")
         raise
 
-def create_rag_chain(retriever=None):
+USER_PREFIX = "User: "
+
+
+def retrieval_query(chain_input: str) -> str:
+    """
+    Câu hỏi gốc dùng để truy xuất: bỏ tiền tố "User: " của prompt, để embedding của
+    retriever trùng khóa cache với embedding của semantic cache (cùng câu hỏi thô).
+    """
+    return chain_input[len(USER_PREFIX):] if chain_input.startswith(USER_PREFIX) else chain_input
+
+def timed_retriever(retriever):
+    """Bọc retriever để đo bước truy xuất (embedding câu hỏi + tìm kiếm vector) trên /metrics."""
+    def retrieve(query):
+        with observe_stage("retrieval"):
+            return retriever.invoke(query)
+
+    async def aretrieve(query):
+        with observe_stage("retrieval"):
+            return await retriever.ainvoke(query)
+
+    return RunnableLambda(retrieve, afunc=aretrieve)
+
+def create_rag_chain(retriever=None, llm=None):
     """Create a Retrieval-Augmented Generation (RAG) chain."""
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+
     if retriever is None:
         retriever = get_retriever()
     
-    llm = GeminiLLM()
+    # `llm` cho phép thay Gemini bằng model giả (benchmark_load.py)
+    llm = llm or GeminiLLM()
     question_answer_chain = create_stuff_documents_chain(
         llm=llm,
         prompt=prompt
     )
     
-    # Create a custom retrieval chain that handles the missing history variable
-    def _invoke_with_history_handling(inputs):
-        # If history is not provided, add an empty string as default
-        if "history" not in inputs:
-            inputs["history"] = ""
-        # Call the original chain
-        return question_answer_chain.invoke({"context": retriever.invoke(inputs["input"]), **inputs})
-    
-    # Create a custom chain object with our handler
-    from langchain_core.runnables import RunnablePassthrough
-    rag_chain = RunnablePassthrough() | _invoke_with_history_handling
+    # Build the chain with LCEL so it supports both invoke() and ainvoke();
+    # history defaults to an empty string when the caller does not provide it
+    rag_chain = RunnablePassthrough.assign(
+        history=lambda inputs: inputs.get("history", ""),
+        context=itemgetter("input") | RunnableLambda(retrieval_query) | timed_retriever(retriever),
+    ) | question_answer_chain
     
-    return rag_chain
\ No newline at end of file
+    return rag_chain
+
+# RAG chain dùng chung cho cả tiến trình (app/main.py, run.py)
+_shared_retriever = None
+_shared_rag_chain = None
+_shared_lock = threading.Lock()
+
+def get_rag_chain():
+    """
+    Return the process-wide RAG chain, building it on first use.
+
+    Thread-safe: concurrent first callers wait for a single build instead of each
+    loading the embedding model and opening the vector store again.
+    """
+    global _shared_retriever, _shared_rag_chain
+    if _shared_rag_chain is None:
+        with _shared_lock:
+            if _shared_rag_chain is None:
+                logger.info("Initializing shared RAG chain...")
+                _shared_retriever = get_retriever()
+                _shared_rag_chain = create_rag_chain(_shared_retriever)
+                logger.info("Shared RAG chain initialized successfully")
+    return _shared_rag_chain
+
+def rag_chain_loaded() -> bool:
+    return _shared_rag_chain is not None
+
+def warm_up_rag_chain(mode: str = None):
+    """
+    Chạy một lần truy xuất (và sinh câu trả lời nếu mode là "full") với câu hỏi giả,
+    để model embedding, vector store và client Gemini sẵn sàng trước request đầu tiên.
+    """
+    mode = (mode or RAG_WARMUP).lower()
+    chain = get_rag_chain()
+    if mode == "off":
+        return
+    if mode == "full":
+        chain.invoke({"input": USER_PREFIX + WARMUP_QUESTION})
+    else:
+        _shared_retriever.invoke(WARMUP_QUESTION)
+    logger.info(f"RAG chain warm-up ({mode}) finished")
+
+async def start_rag_chain(startup, timeout: float, retry_interval: float):
+    """Các bước khởi động chain dùng chung: tạo chain rồi warm-up, mỗi bước có timeout và được thử lại."""
+    await startup.run_until_ok("rag_chain", get_rag_chain, timeout, retry_interval)
+    await startup.run_until_ok("warmup", warm_up_rag_chain, timeout, retry_interval)
@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Thiết lập logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Khóa Redis lưu phiên bản corpus; tăng mỗi khi index được xây dựng lại
+# để mọi worker xóa các câu trả lời đã cache dựa trên dữ liệu cũ
+CORPUS_VERSION_KEY = "rag:corpus_version"
+
+
+def bump_corpus_version() -> Optional[int]:
+    """Tăng phiên bản corpus trong Redis (gọi sau khi index được cập nhật)."""
+    try:
+        import redis
+
+        client = redis.Redis(
+            host=os.getenv("REDIS_HOST", "localhost"),
+            port=int(os.getenv("REDIS_PORT", "6379")),
+            db=int(os.getenv("REDIS_DB", "0"))
+        )
+        version = client.incr(CORPUS_VERSION_KEY)
+        logger.info(f"Corpus version bumped to {version}")
+        return version
+    except Exception as e:
+        logger.warning(f"Could not bump corpus version, semantic caches will not be invalidated: {str(e)}")
+        return None
+
+
+class SemanticCache:
+    """
+    Cache câu trả lời theo ngữ nghĩa của câu hỏi.
+
+    Câu hỏi được embed bằng model embedding của RAG và lưu trong một ma trận NumPy
+    (đã chuẩn hóa L2) ngay trong tiến trình. Khi câu hỏi mới có cosine similarity với
+    câu hỏi đã trả lời vượt ngưỡng, câu trả lời cũ được dùng lại. Mỗi mục có TTL riêng;
+    khi đầy, mục hết hạn bị loại trước rồi đến mục ít được dùng gần đây nhất.
+    """
+
+    def __init__(self, embeddings, threshold: float = 0.92, capacity: int = 2048,
+                 ttl: float = 86400, version_check_interval: float = 30):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self.redis_client = None
+
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None  # (capacity, dim) float32
+        self._entries = [None] * capacity  # (question, answer) theo từng slot
+        self._expires = np.zeros(capacity, dtype=np.float64)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._active = np.zeros(capacity, dtype=bool)
+
+        self._corpus_version = None
+        self._version_checked_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def attach_redis(self, redis_client):
+        """Gắn Redis client bất đồng bộ để theo dõi phiên bản corpus."""
+        self.redis_client = redis_client
+
+    async def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(await self.embeddings.aembed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    async def _check_corpus_version(self):
+        """Xóa cache nếu index đã được xây dựng lại kể từ lần kiểm tra trước."""
+        if self.redis_client is None:
+            return
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check_interval:
+            return
+        self._version_checked_at = now
+        try:
+            raw = await self.redis_client.get(CORPUS_VERSION_KEY)
+        except Exception as e:
+            logger.warning(f"Could not read corpus version: {str(e)}")
+            return
+        version = int(raw) if raw is not None else 0
+        if self._corpus_version is not None and version != self._corpus_version:
+            logger.info(f"Corpus version changed ({self._corpus_version} -> {version}), clearing semantic cache")
+            self.clear()
+            self.invalidations += 1
+        self._corpus_version = version
+
+    async def lookup(self, question: str) -> Tuple[Optional[str], np.ndarray]:
+        """
+        Tìm câu trả lời đã cache cho câu hỏi gần nghĩa nhất.
+
+        Returns:
+            (answer hoặc None, vector của câu hỏi) — vector được trả về để `add`
+            không phải embed lại khi cache miss.
+        """
+        await self._check_corpus_version()
+        vector = await self._embed(question)
+        now = time.monotonic()
+        with self._lock:
+            if self._vectors is None or not self._active.any():
+                self.misses += 1
+                return None, vector
+            # Loại các mục đã hết hạn trước khi so khớp
+            expired = self._active & (self._expires <= now)
+            if expired.any():
+                self._active[expired] = False
+            scores = self._vectors @ vector
+            scores[~self._active] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                self._last_used[best] = now
+                self.hits += 1
+                return self._entries[best][1], vector
+            self.misses += 1
+            return None, vector
+
+    def add(self, question: str, answer: str, vector: np.ndarray, ttl: Optional[float] = None):
+        """Lưu câu trả lời cho câu hỏi (vector đã chuẩn hóa từ `lookup`)."""
+        now = time.monotonic()
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            slot = self._free_slot(now)
+            self._vectors[slot] = vector
+            self._entries[slot] = (question, answer)
+            self._expires[slot] = now + (self.ttl if ttl is None else ttl)
+            self._last_used[slot] = now
+            self._active[slot] = True
+
+    def _free_slot(self, now: float) -> int:
+        inactive = np.flatnonzero(~self._active)
+        if inactive.size:
+            return int(inactive[0])
+        expired = np.flatnonzero(self._expires <= now)
+        if expired.size:
+            return int(expired[0])
+        self.evictions += 1
+        return int(np.argmin(self._last_used))
+
+    def clear(self):
+        with self._lock:
+            self._active[:] = False
+            self._entries = [None] * self.capacity
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": int(self._active.sum()),
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "corpus_version": self._corpus_version,
+        }
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from src.vector_store import LocalVectorStore, _RecordView, _decode_doc, quantize_int8
+
+# Thiết lập logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"NUTRISNP"
+SNAPSHOT_VERSION = 1
+
+# magic, version, dtype, dimension, số vector, độ dài meta JSON, CRC32 của header + meta
+HEADER = struct.Struct("<8sHHIQQI")
+DTYPE_CODES = {"float32": 0, "int8": 1}
+DTYPE_NAMES = {code: name for name, code in DTYPE_CODES.items()}
+ALIGNMENT = 64  # Mỗi phần bắt đầu ở offset chia hết cho 64 để memory-map ma trận
+
+
+class SnapshotError(ValueError):
+    """Snapshot hỏng, sai phiên bản hoặc không khớp model embedding."""
+
+
+class ReadOnlyIndexError(RuntimeError):
+    """Ghi vào index mở từ snapshot (chỉ đọc)."""
+
+
+def embedding_fingerprint(embeddings: Embeddings) -> str:
+    """Định danh model embedding (backend + tên model) để không dùng nhầm vector của model khác."""
+    return getattr(embeddings, "namespace", None) or type(embeddings).__name__
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _encode_records(records: Iterator[bytes]):
+    """Nối các bản ghi thành một blob kèm mảng offset (count + 1 phần tử)."""
+    offsets = [0]
+    blobs = []
+    for record in records:
+        blobs.append(record)
+        offsets.append(offsets[-1] + len(record))
+    return np.asarray(offsets, dtype=np.uint64), b"".join(blobs)
+
+
+def write_snapshot(path: str, vectors: np.ndarray, ids: List[str], docs: List[Document],
+                   fingerprint: str, dtype: str = "float32", extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Ghi snapshot nhị phân của index: vector, ID, nội dung và metadata của từng đoạn.
+
+    Bố cục: header cố định + meta JSON (fingerprint model, vị trí và SHA-256 từng phần),
+    sau đó các phần được căn 64 byte: `vectors` (float32 hoặc int8), `scales` (int8),
+    `id_offsets`/`ids` và `doc_offsets`/`docs` (JSON từng đoạn, đọc khi cần).
+    File được ghi ra file tạm rồi os.replace.
+
+    Returns:
+        Meta JSON đã ghi
+    """
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported snapshot dtype '{dtype}', expected one of {tuple(DTYPE_CODES)}")
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors):
+        # Tìm kiếm dùng tích vô hướng nên vector phải được chuẩn hóa L2 (vector từ Pinecone thì chưa chắc)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = vectors / norms
+    count = len(ids)
+    dimension = int(vectors.shape[1]) if count else 0
+
+    sections = []
+    if dtype == "int8":
+        quantized, scales = quantize_int8(vectors) if count else (vectors.astype(np.int8), np.zeros(0, np.float32))
+        sections += [("vectors", quantized.tobytes()), ("scales", scales.astype(np.float32).tobytes())]
+    else:
+        sections.append(("vectors", vectors.tobytes()))
+    id_offsets, id_blob = _encode_records(doc_id.encode("utf-8") for doc_id in ids)
+    doc_offsets, doc_blob = _encode_records(
+        json.dumps({"text": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False).encode("utf-8")
+        for doc in docs
+    )
+    sections += [("id_offsets", id_offsets.tobytes()), ("ids", id_blob),
+                 ("doc_offsets", doc_offsets.tobytes()), ("docs", doc_blob)]
+
+    meta = {
+        "fingerprint": fingerprint,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "sections": {},
+        **(extra or {}),
+    }
+    # Vị trí các phần phụ thuộc độ dài meta, nên tính với chỗ trống đủ rộng cho số offset
+    placeholder = {name: [0, len(data), hashlib.sha256(data).hexdigest()] for name, data in sections}
+    meta["sections"] = placeholder
+    meta_len = len(json.dumps(meta).encode("utf-8")) + 32 * len(sections)
+    offset = _align(HEADER.size + meta_len)
+    for name, data in sections:
+        meta["sections"][name][0] = offset
+        offset = _align(offset + len(data))
+    meta_bytes = json.dumps(meta).encode("utf-8").ljust(meta_len)
+
+    header_fields = (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, DTYPE_CODES[dtype], dimension, count, meta_len)
+    crc = zlib.crc32(HEADER.pack(*header_fields, 0) + meta_bytes)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(*header_fields, crc))
+        f.write(meta_bytes)
+        for name, data in sections:
+            f.seek(meta["sections"][name][0])
+            f.write(data)
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote index snapshot with {count} vectors ({dtype}, {offset / 1e6:.1f} MB) to {path}")
+    return meta
+
+
+def read_snapshot_header(path: str) -> Dict[str, Any]:
+    """Đọc và kiểm tra header + meta (CRC32); chỉ đọc vài KB nên không phụ thuộc kích thước corpus."""
+    with open(path, "rb") as f:
+        raw = f.read(HEADER.size)
+        if len(raw) < HEADER.size:
+            raise SnapshotError(f"Snapshot {path} is truncated")
+        magic, version, dtype_code, dimension, count, meta_len, crc = HEADER.unpack(raw)
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotError(f"{path} is not an index snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot version in {path}: {version}")
+        meta_bytes = f.read(meta_len)
+    if zlib.crc32(HEADER.pack(magic, version, dtype_code, dimension, count, meta_len, 0) + meta_bytes) != crc:
+        raise SnapshotError(f"Snapshot header checksum mismatch in {path}")
+    meta = json.loads(meta_bytes.decode("utf-8"))
+    meta.update({"version": version, "dtype": DTYPE_NAMES[dtype_code], "dimension": dimension, "count": count})
+    end = max(offset + length for offset, length, _ in meta["sections"].values())
+    if os.path.getsize(path) < end:
+        raise SnapshotError(f"Snapshot {path} is truncated")
+    return meta
+
+
+def verify_snapshot(path: str) -> Dict[str, Any]:
+    """Kiểm tra SHA-256 của mọi phần (đọc toàn bộ file; dùng khi tạo/sao chép snapshot)."""
+    meta = read_snapshot_header(path)
+    with open(path, "rb") as f:
+        for name, (offset, length, digest) in meta["sections"].items():
+            f.seek(offset)
+            hasher = hashlib.sha256()
+            remaining = length
+            while remaining:
+                block = f.read(min(remaining, 1 << 20))
+                if not block:
+                    raise SnapshotError(f"Snapshot {path} is truncated")
+                hasher.update(block)
+                remaining -= len(block)
+            if hasher.hexdigest() != digest:
+                raise SnapshotError(f"Snapshot section '{name}' checksum mismatch in {path}")
+    return meta
+
+
+class SnapshotVectorStore(LocalVectorStore):
+    """
+    LocalVectorStore chỉ đọc, mở từ một file snapshot.
+
+    Cả file được memory-map; khi mở chỉ đọc header (kiểm tra CRC32 và fingerprint model),
+    còn vector, ID và nội dung đoạn được đọc từ page cache khi cần, nên thời gian khởi
+    động không phụ thuộc kích thước corpus và các worker dùng chung bộ nhớ.
+    """
+
+    def __init__(self, path: str, embedding: Embeddings, search: str = "exact", verify: bool = False):
+        self.verify = verify
+        self.meta: Dict[str, Any] = {}
+        super().__init__(path, embedding, search=search)
+
+    def _load(self):
+        meta = verify_snapshot(self.path) if self.verify else read_snapshot_header(self.path)
+        expected = embedding_fingerprint(self._embedding)
+        if meta["fingerprint"] != expected:
+            raise SnapshotError(f"Snapshot {self.path} was built with embedding model '{meta['fingerprint']}', "
+                                f"but the service uses '{expected}'")
+        self.meta = meta
+        self.dtype = meta["dtype"]
+        count, dimension = meta["count"], meta["dimension"]
+        data = np.memmap(self.path, dtype=np.uint8, mode="r")
+
+        def section(name, dtype, shape=None):
+            offset, length, _ = meta["sections"][name]
+            array = data[offset:offset + length].view(dtype)
+            return array.reshape(shape) if shape is not None else array
+
+        self._vectors = section("vectors", np.int8 if self.dtype == "int8" else np.float32, (count, dimension))
+        if self.dtype == "int8":
+            self._scales = section("scales", np.float32)
+        self._ids = _RecordView(section("id_offsets", np.uint64), section("ids", np.uint8),
+                                lambda raw: raw.decode("utf-8"))
+        self._docs = _RecordView(section("doc_offsets", np.uint64), section("docs", np.uint8), _decode_doc)
+        self._hnsw = None
+        logger.info(f"Memory-mapped index snapshot with {count} vectors ({self.dtype}) "
+                    f"from {self.path}, created {meta['created_at']}")
+
+    def _read_only(self):
+        return ReadOnlyIndexError(f"Index snapshot {self.path} is read-only; "
+                                  f"rebuild it with store_index.py --export-snapshot")
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        raise self._read_only()
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        raise self._read_only()
+
+    def delete(self, ids=None, **kwargs):
+        raise self._read_only()
+
+    def compact(self):
+        raise self._read_only()
+
+
+def export_snapshot(store, path: str, fingerprint: str, dtype: str = "float32",
+                    extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Ghi snapshot từ một LocalVectorStore."""
+    return write_snapshot(path, store.get_vectors(), store.get_ids(), store.get_documents(),
+                          fingerprint, dtype=dtype, extra=extra)
@@ -0,0 +1,129 @@
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+# Thiết lập logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PHASE_PENDING = "pending"
+PHASE_RUNNING = "running"
+PHASE_OK = "ok"
+PHASE_FAILED = "failed"
+PHASE_TIMEOUT = "timeout"
+
+
+class StartupPhase:
+    """Một bước khởi động: trạng thái, thời gian chạy, số lần thử và lỗi gần nhất."""
+
+    def __init__(self, name: str, required: bool):
+        self.name = name
+        self.required = required
+        self.status = PHASE_PENDING
+        self.attempts = 0
+        self.first_started: Optional[float] = None
+        self.seconds = 0.0  # Từ lần thử đầu tiên tới khi xong (gồm cả các lần thử lại)
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "required": self.required,
+            "status": self.status,
+            "attempts": self.attempts,
+            "seconds": round(self.seconds, 3),
+            "error": self.error,
+        }
+
+
+class StartupManager:
+    """
+    Khởi tạo các phụ thuộc (Redis, MySQL, model, index...) theo từng bước có timeout.
+
+    Mỗi bước là một hàm đồng bộ (chạy trong thread) hoặc coroutine. Bước bị lỗi hoặc quá
+    thời gian chỉ được ghi lại, không làm tiến trình dừng; `ready` chỉ đúng khi mọi bước
+    bắt buộc đã xong. Thời gian từng bước được giữ lại để báo cáo qua API.
+    """
+
+    def __init__(self, started: Optional[float] = None):
+        # `started` cho phép tính cả thời gian import trước khi tạo đối tượng
+        self.started = started or time.perf_counter()
+        self.finished: Optional[float] = None
+        self.phases: Dict[str, StartupPhase] = {}
+
+    def record(self, name: str, seconds: float, required: bool = False):
+        """Ghi một bước đã đo sẵn ở nơi khác (ví dụ thời gian import module)."""
+        phase = self.phases.setdefault(name, StartupPhase(name, required))
+        phase.status = PHASE_OK
+        phase.attempts += 1
+        phase.seconds = seconds
+
+    def declare(self, name: str, required: bool = True):
+        """Khai báo trước một bước để /ready biết phải chờ nó."""
+        self.phases.setdefault(name, StartupPhase(name, required))
+
+    async def run(self, name: str, fn: Callable[[], Union[Any, Awaitable[Any]]], timeout: float,
+                  required: bool = True) -> Any:
+        """
+        Chạy một bước với timeout.
+
+        Returns:
+            Kết quả của `fn`, hoặc None nếu lỗi / quá thời gian
+        """
+        phase = self.phases.setdefault(name, StartupPhase(name, required))
+        phase.status = PHASE_RUNNING
+        phase.attempts += 1
+        if phase.first_started is None:
+            phase.first_started = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(fn):
+                result = await asyncio.wait_for(fn(), timeout)
+            else:
+                # Hàm đồng bộ (tải model, gọi SDK) chạy trong thread để không chặn event loop
+                result = await asyncio.wait_for(asyncio.to_thread(fn), timeout)
+            phase.status = PHASE_OK
+            phase.error = None
+            return result
+        except asyncio.TimeoutError:
+            phase.status = PHASE_TIMEOUT
+            phase.error = f"timed out after {timeout:g}s"
+        except Exception as e:
+            phase.status = PHASE_FAILED
+            phase.error = str(e)
+        finally:
+            phase.seconds = time.perf_counter() - phase.first_started
+        log = logger.error if required else logger.warning
+        log(f"Startup phase '{name}' {phase.status}: {phase.error}")
+        return None
+
+    async def run_until_ok(self, name: str, fn: Callable[[], Union[Any, Awaitable[Any]]], timeout: float,
+                           retry_interval: float, required: bool = True) -> Any:
+        """Chạy lại một bước sau mỗi `retry_interval` giây cho tới khi thành công."""
+        while True:
+            result = await self.run(name, fn, timeout, required)
+            if self.phases[name].status == PHASE_OK:
+                return result
+            await asyncio.sleep(retry_interval)
+
+    def done(self):
+        self.finished = time.perf_counter()
+        logger.info(f"Startup finished in {self.finished - self.started:.2f}s: "
+                    + ", ".join(f"{p.name}={p.status} ({p.seconds:.2f}s)" for p in self.phases.values()))
+
+    @property
+    def ready(self) -> bool:
+        return all(phase.status == PHASE_OK for phase in self.phases.values() if phase.required)
+
+    def not_ready(self) -> List[str]:
+        return [phase.name for phase in self.phases.values() if phase.required and phase.status != PHASE_OK]
+
+    def report(self) -> Dict[str, Any]:
+        end = self.finished or time.perf_counter()
+        return {
+            "ready": self.ready,
+            "finished": self.finished is not None,
+            "total_seconds": round(end - self.started, 3),
+            "phases": [phase.to_dict() for phase in self.phases.values()],
+        }
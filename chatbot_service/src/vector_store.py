@@ -0,0 +1,447 @@
+import json
+import logging
+import os
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+# Thiết lập logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+META_FILE = "meta.json"
+FORMAT_VERSION = 2
+
+# Mỗi thế hệ (generation) là một bộ file chỉ nối thêm; nén (compact) ghi thế hệ mới rồi đổi meta.json
+SEGMENTS = ("vectors", "scales", "doc_offsets", "docs", "ids", "deleted")
+SEGMENT_EXTENSIONS = {"docs": "jsonl", "ids": "txt"}
+COPY_BLOCK_ROWS = 8192
+
+DTYPES = ("float32", "int8")
+SEARCH_MODES = ("exact", "hnsw")
+
+
+def _atomic_write_text(path: str, text: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _append_bytes(path: str, data: bytes):
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _memmap(path: str, dtype, shape: Tuple[int, ...]) -> np.ndarray:
+    # np.memmap không mở được vùng rỗng
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Lượng tử hóa đối xứng theo từng dòng: v ≈ q * scale với q trong [-127, 127]."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+class _RecordView(Sequence):
+    """Dãy bản ghi đọc từ blob memory-map theo offset, chỉ giải mã phần tử được truy cập."""
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray, decode):
+        self._offsets = offsets
+        self._blob = blob
+        self._decode = decode
+
+    def __len__(self) -> int:
+        return max(len(self._offsets) - 1, 0)
+
+    def raw(self, index: int) -> bytes:
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        return self._blob[start:end].tobytes()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._decode(self.raw(index))
+
+
+def _decode_doc(raw: bytes) -> Document:
+    record = json.loads(raw.decode("utf-8"))
+    return Document(page_content=record["text"], metadata=record["metadata"])
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Vector store chạy trong tiến trình, thay thế Pinecone cho corpus nhỏ.
+
+    Embedding (đã chuẩn hóa L2) được lưu thành ma trận float32 hoặc int8 (kèm hệ số
+    scale từng dòng) và được memory-map khi mở, nên nhiều worker dùng chung page cache
+    của hệ điều hành. Nội dung và metadata từng đoạn nằm trong `docs-{gen}.jsonl`,
+    đọc theo offset khi cần.
+
+    Các file chỉ được nối thêm: upsert ghi dòng mới và đánh dấu xóa (tombstone) dòng cũ,
+    delete chỉ ghi số dòng vào `deleted-{gen}.bin`, nên chi phí mỗi lần ghi tỉ lệ với lô
+    chứ không với cả index. Khi số dòng đã xóa vượt `compact_ratio` thì index được nén
+    sang thế hệ mới. `meta.json` (ghi nguyên tử, sau cùng) quyết định phần nào hợp lệ;
+    phần đuôi dư do ghi dở sẽ bị cắt ở lần ghi kế tiếp.
+
+    Tìm kiếm mặc định là tích vô hướng chính xác trên toàn ma trận (cosine);
+    `search="hnsw"` dùng hnswlib nếu đã cài, nếu không sẽ quay về tìm chính xác.
+    """
+
+    def __init__(self, path: str, embedding: Embeddings, dtype: str = "float32", search: str = "exact",
+                 compact_ratio: float = 0.25, compact_min_deleted: int = 1024):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported local index dtype '{dtype}', expected one of {DTYPES}")
+        if search not in SEARCH_MODES:
+            raise ValueError(f"Unsupported local index search '{search}', expected one of {SEARCH_MODES}")
+        self.path = path
+        self._embedding = embedding
+        self.dtype = dtype
+        self.search = search
+        self.compact_ratio = compact_ratio
+        self.compact_min_deleted = compact_min_deleted
+        self._meta: Optional[Dict[str, Any]] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._ids: Sequence[str] = []
+        self._docs: Sequence[Document] = []
+        self._row_of: Dict[str, int] = {}
+        self._deleted: Set[int] = set()
+        self._deleted_rows: Optional[np.ndarray] = None
+        self._hnsw = None
+        self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def __len__(self) -> int:
+        return len(self._ids) - len(self._deleted)
+
+    def get_ids(self) -> List[str]:
+        return [self._ids[i] for i in self._alive_rows()]
+
+    def get_documents(self) -> List[Document]:
+        return [self._docs[i] for i in self._alive_rows()]
+
+    def get_vectors(self) -> np.ndarray:
+        """Ma trận embedding float32 (đã chuẩn hóa L2) theo thứ tự của get_ids()"""
+        return self._dense_rows(self._alive_rows())
+
+    # ---- Đọc ----
+
+    def _file(self, segment: str, generation: Optional[int] = None) -> str:
+        generation = self._meta["generation"] if generation is None else generation
+        return os.path.join(self.path, f"{segment}-{generation}.{SEGMENT_EXTENSIONS.get(segment, 'bin')}")
+
+    def _load(self):
+        meta_path = os.path.join(self.path, META_FILE)
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["dtype"] != self.dtype:
+            logger.warning(f"Local index at {self.path} is stored as {meta['dtype']}, ignoring dtype={self.dtype}")
+            self.dtype = meta["dtype"]
+        self._meta = meta
+
+        with open(self._file("ids"), "rb") as f:
+            self._ids = f.read(meta["ids_bytes"]).decode("utf-8").split("\n")[:-1]
+        deleted = np.fromfile(self._file("deleted"), dtype=np.uint64, count=meta["deleted"]) if meta["deleted"] else []
+        self._deleted = {int(row) for row in deleted}
+        self._row_of = {doc_id: row for row, doc_id in enumerate(self._ids) if row not in self._deleted}
+        self._deleted_rows = None
+        self._remap()
+        logger.info(f"Loaded local vector index with {len(self)} vectors ({self.dtype}, "
+                    f"{len(self._deleted)} deleted) from {self.path}")
+
+    def _remap(self):
+        """Memory-map lại các file theo số dòng trong meta (sau mỗi lần nối thêm)"""
+        count, dimension = self._meta["count"], self._meta["dimension"]
+        self._vectors = _memmap(self._file("vectors"), np.int8 if self.dtype == "int8" else np.float32,
+                                (count, dimension))
+        if self.dtype == "int8":
+            self._scales = _memmap(self._file("scales"), np.float32, (count,))
+        offsets = _memmap(self._file("doc_offsets"), np.uint64, (count + 1,))
+        self._docs = _RecordView(offsets, _memmap(self._file("docs"), np.uint8, (self._meta["docs_bytes"],)),
+                                 _decode_doc)
+        self._hnsw = None
+
+    def _deleted_index(self) -> np.ndarray:
+        if self._deleted_rows is None:
+            self._deleted_rows = np.fromiter(sorted(self._deleted), dtype=np.int64, count=len(self._deleted))
+        return self._deleted_rows
+
+    def _alive_rows(self) -> np.ndarray:
+        rows = np.arange(len(self._ids))
+        return np.setdiff1d(rows, self._deleted_index(), assume_unique=True) if self._deleted else rows
+
+    def _dense_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Các dòng float32 (giải lượng tử nếu là int8)"""
+        if self._vectors is None or not len(rows):
+            return np.zeros((0, self._meta["dimension"] if self._meta else 0), dtype=np.float32)
+        vectors = np.asarray(self._vectors[rows], dtype=np.float32)
+        if self.dtype == "int8":
+            vectors = vectors * self._scales[rows][:, None]
+        return vectors
+
+    # ---- Ghi ----
+
+    def _new_meta(self, dimension: int, generation: int = 1) -> Dict[str, Any]:
+        return {"format": FORMAT_VERSION, "generation": generation, "dtype": self.dtype, "dimension": dimension,
+                "count": 0, "deleted": 0, "docs_bytes": 0, "ids_bytes": 0}
+
+    def _segment_sizes(self, meta: Dict[str, Any]) -> Dict[str, int]:
+        itemsize = 1 if meta["dtype"] == "int8" else 4
+        return {
+            "vectors": meta["count"] * meta["dimension"] * itemsize,
+            "scales": meta["count"] * 4 if meta["dtype"] == "int8" else 0,
+            "doc_offsets": (meta["count"] + 1) * 8,
+            "docs": meta["docs_bytes"],
+            "ids": meta["ids_bytes"],
+            "deleted": meta["deleted"] * 8,
+        }
+
+    def _create_segments(self, meta: Dict[str, Any]):
+        for segment in SEGMENTS:
+            with open(self._file(segment, meta["generation"]), "wb") as f:
+                if segment == "doc_offsets":
+                    f.write(np.zeros(1, dtype=np.uint64).tobytes())
+
+    def _truncate_tail(self):
+        """Cắt phần đuôi của lần ghi bị ngắt giữa chừng (chưa được meta.json ghi nhận)"""
+        for segment, size in self._segment_sizes(self._meta).items():
+            path = self._file(segment)
+            if os.path.getsize(path) > size:
+                logger.warning(f"Truncating uncommitted tail of {path}")
+                os.truncate(path, size)
+
+    def _write_meta(self, meta: Dict[str, Any]):
+        _atomic_write_text(os.path.join(self.path, META_FILE), json.dumps(meta))
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_embeddings(texts, self._embedding.embed_documents(texts), metadatas=metadatas, ids=ids)
+
+    def add_embeddings(self, texts: List[str], embeddings: List[List[float]], metadatas: Optional[List[dict]] = None,
+                       ids: Optional[List[str]] = None) -> List[str]:
+        """Thêm các vector đã tính sẵn (dùng cho pipeline ingest tính embedding theo lô)"""
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [uuid.uuid4().hex for _ in texts]
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32))
+
+        if self._meta is None:
+            os.makedirs(self.path, exist_ok=True)
+            meta = self._new_meta(int(vectors.shape[1]))
+            self._create_segments(meta)
+            self._write_meta(meta)
+            self._meta = meta
+        elif self._meta["count"] and vectors.shape[1] != self._meta["dimension"]:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match local index "
+                             f"dimension {self._meta['dimension']}")
+        meta = dict(self._meta, dimension=int(vectors.shape[1]))
+        self._truncate_tail()
+
+        if self.dtype == "int8":
+            quantized, scales = quantize_int8(vectors)
+            _append_bytes(self._file("vectors"), quantized.tobytes())
+            _append_bytes(self._file("scales"), scales.tobytes())
+        else:
+            _append_bytes(self._file("vectors"), vectors.astype(np.float32).tobytes())
+        records = [
+            (json.dumps({"id": doc_id, "text": text, "metadata": dict(metadata)}, ensure_ascii=False) + "\n")
+            .encode("utf-8")
+            for doc_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        ends = meta["docs_bytes"] + np.cumsum([len(record) for record in records], dtype=np.uint64)
+        _append_bytes(self._file("docs"), b"".join(records))
+        _append_bytes(self._file("doc_offsets"), ends.astype(np.uint64).tobytes())
+        id_blob = "".join(f"{doc_id}\n" for doc_id in ids).encode("utf-8")
+        _append_bytes(self._file("ids"), id_blob)
+
+        # Upsert như Pinecone: dòng cũ của id bị ghi đè (kể cả id lặp trong cùng lô) bị đánh dấu xóa
+        start = meta["count"]
+        row_of = {}
+        replaced = []
+        for offset, doc_id in enumerate(ids):
+            previous = row_of.get(doc_id, self._row_of.get(doc_id))
+            if previous is not None:
+                replaced.append(previous)
+            row_of[doc_id] = start + offset
+        if replaced:
+            _append_bytes(self._file("deleted"), np.asarray(replaced, dtype=np.uint64).tobytes())
+
+        meta.update(count=start + len(ids), deleted=meta["deleted"] + len(replaced),
+                    docs_bytes=int(ends[-1]), ids_bytes=meta["ids_bytes"] + len(id_blob))
+        self._write_meta(meta)
+        self._meta = meta
+
+        self._ids.extend(ids)
+        self._row_of.update(row_of)
+        self._deleted.update(replaced)
+        self._deleted_rows = None
+        self._remap()
+        self._maybe_compact()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        rows = sorted({self._row_of[doc_id] for doc_id in ids if doc_id in self._row_of})
+        if not rows:
+            return False
+        self._truncate_tail()
+        _append_bytes(self._file("deleted"), np.asarray(rows, dtype=np.uint64).tobytes())
+        meta = dict(self._meta, deleted=self._meta["deleted"] + len(rows))
+        self._write_meta(meta)
+        self._meta = meta
+
+        for doc_id in ids:
+            self._row_of.pop(doc_id, None)
+        self._deleted.update(rows)
+        self._deleted_rows = None
+        self._hnsw = None
+        self._maybe_compact()
+        return True
+
+    def _maybe_compact(self):
+        deleted = len(self._deleted)
+        if deleted and (deleted == len(self._ids)
+                        or deleted >= max(self.compact_min_deleted, self.compact_ratio * len(self._ids))):
+            self.compact()
+
+    def compact(self):
+        """Ghi các dòng còn sống sang thế hệ file mới, đổi meta.json rồi xóa thế hệ cũ"""
+        if self._meta is None or not self._deleted:
+            return
+        old_generation = self._meta["generation"]
+        meta = self._new_meta(self._meta["dimension"], generation=old_generation + 1)
+        self._create_segments(meta)
+        files = {segment: open(self._file(segment, meta["generation"]), "ab") for segment in SEGMENTS}
+        try:
+            alive = self._alive_rows()
+            for block_start in range(0, len(alive), COPY_BLOCK_ROWS):
+                rows = alive[block_start:block_start + COPY_BLOCK_ROWS]
+                # Sao chép nguyên byte đã lưu, không lượng tử hóa lại
+                files["vectors"].write(np.ascontiguousarray(self._vectors[rows]).tobytes())
+                if self.dtype == "int8":
+                    files["scales"].write(np.ascontiguousarray(self._scales[rows]).tobytes())
+                records = [self._docs.raw(int(row)) for row in rows]
+                ends = meta["docs_bytes"] + np.cumsum([len(record) for record in records], dtype=np.uint64)
+                files["docs"].write(b"".join(records))
+                files["doc_offsets"].write(ends.astype(np.uint64).tobytes())
+                id_blob = "".join(f"{self._ids[row]}\n" for row in rows).encode("utf-8")
+                files["ids"].write(id_blob)
+                meta.update(count=meta["count"] + len(rows), docs_bytes=int(ends[-1]),
+                            ids_bytes=meta["ids_bytes"] + len(id_blob))
+            for f in files.values():
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            for f in files.values():
+                f.close()
+
+        self._write_meta(meta)
+        for segment in SEGMENTS:
+            old_path = self._file(segment, old_generation)
+            if os.path.exists(old_path):
+                os.remove(old_path)
+        logger.info(f"Compacted local vector index at {self.path}: removed {len(self._deleted)} deleted rows")
+        self._load()
+
+    # ---- Tìm kiếm ----
+
+    def _build_hnsw(self):
+        try:
+            import hnswlib
+        except ImportError:
+            logger.warning("hnswlib is not installed, falling back to exact search")
+            self.search = "exact"
+            return None
+        alive = self._alive_rows()
+        index = hnswlib.Index(space="ip", dim=self._vectors.shape[1])
+        index.init_index(max_elements=len(alive), ef_construction=200, M=16)
+        for block_start in range(0, len(alive), COPY_BLOCK_ROWS):
+            rows = alive[block_start:block_start + COPY_BLOCK_ROWS]
+            index.add_items(self._dense_rows(rows), rows)
+        index.set_ef(64)
+        return index
+
+    def _search(self, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        if not len(self):
+            return []
+        k = min(k, len(self))
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        if self.search == "hnsw":
+            if self._hnsw is None:
+                self._hnsw = self._build_hnsw()
+            if self._hnsw is not None:
+                labels, distances = self._hnsw.knn_query(query, k=k)
+                # Khoảng cách "ip" của hnswlib là 1 - tích vô hướng
+                return [(int(i), float(1.0 - d)) for i, d in zip(labels[0], distances[0])]
+
+        scores = self._vectors @ query
+        if self.dtype == "int8":
+            scores = scores * self._scales
+        if self._deleted:
+            scores[self._deleted_index()] = -np.inf
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        vector = np.asarray(self._embedding.embed_query(query), dtype=np.float32)
+        return self.similarity_search_by_vector_with_score(vector, k=k)
+
+    def similarity_search_by_vector_with_score(self, embedding, k: int = 4) -> List[Tuple[Document, float]]:
+        query = np.asarray(embedding, dtype=np.float32)
+        return [(self._docs[i], score) for i, score in self._search(query, k)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
+
+    def _select_relevance_score_fn(self):
+        # Điểm đã là cosine similarity của vector chuẩn hóa
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, path: str = None, dtype: str = "float32",
+                   search: str = "exact", **kwargs: Any) -> "LocalVectorStore":
+        if path is None:
+            raise ValueError("LocalVectorStore.from_texts requires a path")
+        store = cls(path, embedding, dtype=dtype, search=search)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -1,17 +1,26 @@
 import os
+import argparse
 import logging
-from typing import List, Optional, Set
+from typing import Dict, List, Optional, Set
+import numpy as np
 from langchain_core.documents import Document
-from langchain_community.vectorstores import Pinecone as LangchainPinecone
-from pinecone import Pinecone, ServerlessSpec
+from langchain_core.vectorstores import VectorStore
 from dotenv import load_dotenv
 # Import helper functions
 from src.helper import (
-    load_pdf_file,  # Hàm để đọc file PDF
-    text_split,  # Hàm để chia nhỏ văn bản thành các đoạn
     download_hugging_face_embeddings,  # Hàm để tải model embedding từ Hugging Face
-    initialize_pinecone  # Hàm để khởi tạo Pinecone
+    initialize_pinecone,  # Hàm để khởi tạo Pinecone
+    get_pinecone_client,  # Client Pinecone khởi tạo khi cần
+    open_local_index,  # Mở index vector cục bộ
+    VECTOR_STORE_BACKEND,
+    LOCAL_INDEX_PATH,
+    LOCAL_INDEX_DTYPE
 )
+from src.semantic_cache import bump_corpus_version
+from src.ingest import ingest_directory, list_pdf_files, LocalIndexSink, PineconeSink
+from src.ingest_cache import open_ingest_cache
+from src.manifest import IndexManifest, chunk_id, file_sha256
+from src.snapshot import embedding_fingerprint, export_snapshot, verify_snapshot, write_snapshot
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -19,19 +28,28 @@ logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")  # Lấy API key từ file .env
-if not PINECONE_API_KEY:
-    logger.error("PINECONE_API_KEY not found in .env file.")
-    raise ValueError("PINECONE_API_KEY not found in .env file.")
 
-# Initialize Pinecone client
-pc = Pinecone(api_key=PINECONE_API_KEY)  # Khởi tạo client Pinecone
+# Thư mục chứa manifest (file -> chunk ID) của các Pinecone index
+INDEX_MANIFEST_DIR = os.getenv(
+    "INDEX_MANIFEST_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "manifests")
+)
+
+
+def get_manifest(backend: str, index_name: str) -> IndexManifest:
+    """Manifest của index: nằm cạnh index cục bộ, hoặc trong INDEX_MANIFEST_DIR cho Pinecone."""
+    if backend == "local":
+        return IndexManifest(os.path.join(LOCAL_INDEX_PATH, "manifest.json"))
+    return IndexManifest(os.path.join(INDEX_MANIFEST_DIR, f"pinecone-{index_name}.json"))
 
 
 def get_existing_document_ids(index_name: str) -> Set[str]:
     """
     Lấy ID của các tài liệu đã có trong Pinecone index.
     
+    Chỉ cần khi chưa có manifest (lần chạy đầu sau khi nâng cấp); liệt kê toàn bộ ID
+    theo trang bằng `index.list()` nên không bị giới hạn như truy vấn vector giả.
+    
     Args:
         index_name: Tên của Pinecone index
         
@@ -40,14 +58,11 @@ def get_existing_document_ids(index_name: str) -> Set[str]:
     """
     try:
         # Lấy index từ Pinecone
-        index = pc.Index(index_name)
-        
-        # Truy vấn tất cả vector ID (giới hạn 10000 cho mục đích thực tế)
-        # Thay đổi kích thước vector từ 384 thành 768
-        response = index.query(vector=[0] * 768, top_k=10000, include_metadata=False)
+        index = get_pinecone_client().Index(index_name)
         
-        # Trích xuất ID
-        existing_ids = {match.id for match in response.matches}
+        existing_ids = set()
+        for ids in index.list():
+            existing_ids.update(ids)
         logger.info(f"Found {len(existing_ids)} existing documents in the index")
         return existing_ids
     except Exception as e:
@@ -55,65 +70,108 @@ def get_existing_document_ids(index_name: str) -> Set[str]:
         return set()
 
 
-def create_or_update_index(data_path: str, index_name: str = "chatbot", update_only: bool = False) -> LangchainPinecone:
+def create_or_update_index(data_path: str, index_name: str = "chatbot", update_only: bool = False,
+                           backend: Optional[str] = None, use_cache: bool = True) -> VectorStore:
     """
-    Tạo một Pinecone index mới hoặc cập nhật index đã tồn tại với các tài liệu mới.
+    Tạo một index mới hoặc cập nhật index đã tồn tại với các tài liệu mới.
+    
+    Tài liệu đi qua pipeline ingest dạng stream (src/ingest.py): PDF được parse song song
+    trong process pool, chia đoạn ngay khi có, embed theo lô cố định và upsert song song,
+    nên bộ nhớ không tăng theo kích thước tài liệu.
+    
+    ID vector là SHA-256 của nội dung đoạn và manifest lưu file -> hash -> chunk ID, nên
+    khi cập nhật chỉ các PDF mới/đã đổi được parse, chỉ các đoạn chưa có được embed,
+    và vector của các đoạn không còn file nào chứa sẽ bị xóa.
+    
+    Văn bản trang và embedding được cache trên đĩa (src/ingest_cache.py) theo hash file,
+    tham số chia đoạn và model, nên tạo lại toàn bộ một corpus không đổi chỉ còn đọc cache và upsert.
     
     Args:
         data_path: Đường dẫn đến thư mục chứa các file PDF
         index_name: Tên của Pinecone index
         update_only: Nếu True, chỉ cập nhật index với tài liệu mới, không tạo lại
+        backend: "pinecone" hoặc "local"; mặc định lấy từ VECTOR_STORE_BACKEND
+        use_cache: Dùng cache ingest trên đĩa (False để parse và embed lại từ đầu)
         
     Returns:
-        LangchainPinecone vector store
+        Vector store (LangchainPinecone hoặc LocalVectorStore)
     """
+    backend = backend or VECTOR_STORE_BACKEND
     try:
-        # Khởi tạo Pinecone
-        _, index_name = initialize_pinecone(index_name)
-        
-        # Đọc và xử lý tài liệu
-        logger.info(f"Loading documents from {data_path}")
-        extracted_data = load_pdf_file(data_path)
-        text_chunks = text_split(extracted_data)
-        logger.info(f"Processed {len(text_chunks)} text chunks from documents")
-        
         # Lấy model embedding
         embeddings = download_hugging_face_embeddings()
         
-        # Nếu đang cập nhật, lấy ID tài liệu hiện có để tránh trùng lặp
-        if update_only and index_name in pc.list_indexes().names():
-            existing_ids = get_existing_document_ids(index_name)
+        if backend == "local":
+            docsearch = open_local_index(embeddings=embeddings)
+            indexed_ids = set(docsearch.get_ids())
+            # Chế độ tạo mới upsert toàn bộ đoạn hiện có; đoạn cũ được xóa ở bước dọn stale_ids
+            sink = LocalIndexSink(docsearch)
+            manifest = get_manifest(backend, index_name)
+        else:
+            # Khởi tạo Pinecone
+            pc, index_name = initialize_pinecone(index_name)
+            sink = PineconeSink(pc.Index(index_name))
+            docsearch = None
+            manifest = get_manifest(backend, index_name)
+            # Chưa có manifest: liệt kê ID trong index để dọn các vector cũ không còn dùng
+            indexed_ids = manifest.chunk_ids() if manifest.exists else get_existing_document_ids(index_name)
+        
+        pdf_paths = {os.path.basename(path): path for path in list_pdf_files(data_path)}
+        current = {name: file_sha256(path) for name, path in pdf_paths.items()}
+        if update_only and manifest.exists:
+            changed, removed = manifest.diff(current)
+        else:
+            changed = sorted(current)
+            removed = [name for name in manifest.files if name not in current]
+        logger.info(f"{len(changed)} new or changed files, {len(removed)} removed files, "
+                    f"{len(current) - len(changed)} unchanged")
+        
+        if not changed and not removed:
+            logger.info("Index is up to date")
+            sink.close(None, commit=False)
+        else:
+            # Khi cập nhật, đoạn đã có trong index (cùng nội dung) không cần embed lại
+            skip_ids = set(indexed_ids) if update_only else set()
+            file_chunk_ids = {name: set() for name in changed}
             
-            # Lọc ra các tài liệu chưa có trong index
-            new_chunks = []
-            for chunk in text_chunks:
-                # Tạo ID đơn giản dựa trên hash nội dung
-                doc_id = str(hash(chunk.page_content))
-                if doc_id not in existing_ids:
-                    if chunk.metadata is None:
-                        chunk.metadata = {}
-                    chunk.metadata["doc_id"] = doc_id
-                    new_chunks.append(chunk)
+            def track(chunk) -> bool:
+                text, metadata = chunk
+                cid = chunk_id(text)
+                metadata["doc_id"] = cid
+                file_chunk_ids[os.path.basename(metadata["source"])].add(cid)
+                if cid in skip_ids:
+                    return False
+                skip_ids.add(cid)
+                return True
             
-            logger.info(f"Found {len(new_chunks)} new chunks to add to the index")
+            logger.info(f"Loading documents from {data_path}")
+            stats = ingest_directory(data_path, embeddings, sink, chunk_filter=track,
+                                     files=[pdf_paths[name] for name in changed],
+                                     cache=open_ingest_cache(embeddings) if use_cache else None,
+                                     file_hashes={pdf_paths[name]: current[name] for name in changed})
+            logger.info(f"Ingestion throughput: {stats.report()}")
             
-            if not new_chunks:
-                logger.info("No new documents to add to the index")
-                return LangchainPinecone.from_existing_index(index_name, embeddings)
+            for name in changed:
+                manifest.set_file(name, current[name], file_chunk_ids[name])
+            for name in removed:
+                manifest.remove_file(name)
             
-            # Thêm tài liệu mới vào index hiện có
-            docsearch = LangchainPinecone.from_existing_index(index_name, embeddings)
-            docsearch.add_documents(new_chunks)
-            logger.info(f"Successfully added {len(new_chunks)} new chunks to the index")
-        else:
-            # Tạo index mới hoặc thay thế index cũ
-            docsearch = LangchainPinecone.from_documents(
-                documents=text_chunks,
-                embedding=embeddings,
-                index_name=index_name
-            )
-            logger.info(f"Created new index with {len(text_chunks)} chunks")
+            # Xóa vector không còn file nào tham chiếu
+            stale_ids = indexed_ids - manifest.chunk_ids()
+            if stale_ids:
+                sink.delete(stale_ids)
+                logger.info(f"Deleted {len(stale_ids)} stale vectors")
+            manifest.save()
+            
+            if stats.upserted or stale_ids:
+                logger.info(f"Successfully added {stats.upserted} chunks to the {backend} index")
+                bump_corpus_version()
+            else:
+                logger.info("No new documents to add to the index")
         
+        if docsearch is None:
+            from langchain_community.vectorstores import Pinecone as LangchainPinecone
+            docsearch = LangchainPinecone.from_existing_index(index_name, embeddings)
         return docsearch
     
     except Exception as e:
@@ -121,21 +179,73 @@ def create_or_update_index(data_path: str, index_name: str = "chatbot", update_o
         raise
 
 
-def update_index_with_new_data(data_path: str, index_name: str = "chatbot") -> LangchainPinecone:
+def update_index_with_new_data(data_path: str, index_name: str = "chatbot") -> VectorStore:
     """
-    Update an existing Pinecone index with new documents.
+    Update an existing index with new documents.
     
     Args:
         data_path: Path to directory containing new PDF files
         index_name: Name of the Pinecone index
         
     Returns:
-        Updated LangchainPinecone vector store
+        Updated vector store
     """
     # Cập nhật index với dữ liệu mới
     return create_or_update_index(data_path, index_name, update_only=True)
 
 
+def fetch_pinecone_index(index_name: str, text_key: str = "text", batch_size: int = 100):
+    """
+    Tải toàn bộ vector, nội dung và metadata của một Pinecone index (liệt kê ID theo trang rồi fetch theo lô).
+    
+    Returns:
+        (ma trận vector, danh sách ID, danh sách Document)
+    """
+    index = get_pinecone_client().Index(index_name)
+    ids = sorted(doc_id for page in index.list() for doc_id in page)
+    vectors, docs = [], []
+    for i in range(0, len(ids), batch_size):
+        fetched = index.fetch(ids=ids[i:i + batch_size]).vectors
+        for doc_id in ids[i:i + batch_size]:
+            record = fetched[doc_id]
+            metadata = dict(record.metadata or {})
+            text = metadata.pop(text_key, "")
+            vectors.append(record.values)
+            docs.append(Document(page_content=text, metadata=metadata))
+    return np.asarray(vectors, dtype=np.float32), ids, docs
+
+
+def create_snapshot(path: str, index_name: str = "chatbot", backend: Optional[str] = None,
+                    dtype: str = LOCAL_INDEX_DTYPE) -> Dict:
+    """
+    Ghi snapshot nhị phân của index hiện tại (vector, nội dung, metadata, fingerprint model)
+    để replica mở bằng memory-map qua INDEX_SNAPSHOT_PATH thay vì tạo lại index.
+    
+    Args:
+        path: File snapshot cần ghi
+        index_name: Tên Pinecone index (khi backend là pinecone)
+        backend: "pinecone" hoặc "local"; mặc định lấy từ VECTOR_STORE_BACKEND
+        dtype: "float32" hoặc "int8"
+        
+    Returns:
+        Meta của snapshot
+    """
+    backend = backend or VECTOR_STORE_BACKEND
+    embeddings = download_hugging_face_embeddings()
+    manifest = get_manifest(backend, index_name)
+    # Ghi lại file nguồn để biết snapshot được tạo từ phiên bản corpus nào
+    extra = {"backend": backend, "files": {name: entry["sha256"] for name, entry in manifest.files.items()}}
+    if backend == "local":
+        meta = export_snapshot(open_local_index(embeddings=embeddings), path, embedding_fingerprint(embeddings),
+                               dtype=dtype, extra=extra)
+    else:
+        vectors, ids, docs = fetch_pinecone_index(index_name)
+        meta = write_snapshot(path, vectors, ids, docs, embedding_fingerprint(embeddings), dtype=dtype, extra=extra)
+    # Đọc lại và kiểm tra checksum trước khi phân phối snapshot
+    verify_snapshot(path)
+    return meta
+
+
 def list_indexed_files(index_name: str = "chatbot") -> List[str]:
     """
     List files that have been indexed in Pinecone.
@@ -147,8 +257,16 @@ def list_indexed_files(index_name: str = "chatbot") -> List[str]:
         List of filenames that have been indexed
     """
     try:
+        manifest = get_manifest(VECTOR_STORE_BACKEND, index_name)
+        if manifest.exists:
+            return sorted(manifest.files)
+        
+        if VECTOR_STORE_BACKEND == "local":
+            docsearch = open_local_index()
+            return list({doc.metadata['source'] for doc in docsearch.get_documents() if 'source' in doc.metadata})
+        
         # Lấy index từ Pinecone
-        index = pc.Index(index_name)
+        index = get_pinecone_client().Index(index_name)
         
         # Truy vấn với metadata
         response = index.query(
@@ -172,13 +290,37 @@ def list_indexed_files(index_name: str = "chatbot") -> List[str]:
 
 
 if __name__ == "__main__":
-    # Sửa đường dẫn đến thư mục Data
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    data_directory = os.path.join(current_dir, 'Data')
+    parser = argparse.ArgumentParser(description="Tạo hoặc cập nhật index vector từ các file PDF")
+    parser.add_argument("--data-path", type=str, default=os.path.join(current_dir, 'Data'),
+                        help="Thư mục chứa các file PDF")
+    parser.add_argument("--index-name", type=str, default="chatbot", help="Tên Pinecone index")
+    parser.add_argument("--backend", type=str, choices=["pinecone", "local"], default=None,
+                        help="Backend vector store (mặc định VECTOR_STORE_BACKEND)")
+    parser.add_argument("--force-create", action="store_true",
+                        help="Tạo lại toàn bộ index thay vì chỉ cập nhật file mới/đã đổi")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Không dùng cache văn bản trang / embedding trên đĩa")
+    parser.add_argument("--export-snapshot", type=str, metavar="PATH",
+                        help="Sau khi cập nhật, ghi snapshot nhị phân của index ra PATH")
+    parser.add_argument("--snapshot-dtype", type=str, choices=["float32", "int8"], default=LOCAL_INDEX_DTYPE,
+                        help="Kiểu lưu vector trong snapshot")
+    parser.add_argument("--verify-snapshot", type=str, metavar="PATH",
+                        help="Chỉ kiểm tra checksum của một snapshot rồi thoát")
+    args = parser.parse_args()
     
-    # Cập nhật index với dữ liệu mới
-    docsearch = update_index_with_new_data(data_directory)
+    if args.verify_snapshot:
+        meta = verify_snapshot(args.verify_snapshot)
+        logger.info(f"Snapshot OK: {meta['count']} vectors ({meta['dtype']}, dim {meta['dimension']}), "
+                    f"model {meta['fingerprint']}, created {meta['created_at']}")
+        raise SystemExit(0)
+    
+    docsearch = create_or_update_index(args.data_path, args.index_name, update_only=not args.force_create,
+                                       backend=args.backend, use_cache=not args.no_cache)
     
     # Liệt kê các file đã được index
-    indexed_files = list_indexed_files()
-    logger.info(f"Indexed files: {indexed_files}")
\ No newline at end of file
+    indexed_files = list_indexed_files(args.index_name)
+    logger.info(f"Indexed files: {indexed_files}")
+    
+    if args.export_snapshot:
+        create_snapshot(args.export_snapshot, args.index_name, backend=args.backend, dtype=args.snapshot_dtype)
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# Cho phép import app/ và benchmark_load khi chạy pytest từ chatbot_service/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis cần lupa để chạy script Lua của SessionStore
+
+from benchmark_load import SQLitePool  # noqa: E402
+
+
+@pytest.fixture
+def make_redis():
+    """
+    Tạo Redis giả dùng chung một server trong test. Client phải được tạo bên trong
+    coroutine của test (asyncio.run) để gắn với đúng event loop.
+    """
+    server = fakeredis.FakeServer()
+    return lambda: fakeredis.FakeAsyncRedis(server=server)
+
+
+@pytest.fixture
+def make_pool(tmp_path):
+    """Pool SQLite thay MySQL (cùng schema và giao diện acquire() như benchmark_load.py)"""
+    return lambda maxsize=3: SQLitePool(str(tmp_path / "chat.db"), maxsize=maxsize)
@@ -0,0 +1,155 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.chat_history import ChatHistoryReader, InvalidCursor, decode_cursor
+from app.message_log import MessagePersister
+from app.session_store import SessionStore
+
+
+def mysql_unavailable():
+    raise AssertionError("MySQL should not be queried")
+
+
+async def add_messages(store, session_id, questions):
+    for question in questions:
+        await store.check_and_increment(session_id)
+        await store.save_exchange(session_id, None, question, f"answer to {question}")
+
+
+async def read_all(reader, store, session_id, limit):
+    """Đi hết các trang theo cursor; trả về câu hỏi, mới nhất trước"""
+    questions, before = [], None
+    while True:
+        messages, before = await reader.page(session_id, limit, before,
+                                             question_count=await store.get_count(session_id))
+        questions += [message["question"] for message in messages]
+        if before is None:
+            return questions
+
+
+@pytest.mark.parametrize("limit", [1, 3, 7, 10, 20, 100])
+def test_long_history_returns_every_message_once(make_redis, make_pool, limit):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        store = SessionStore(redis_client, history_length=10)
+        persister = MessagePersister(redis_client, pool, block_ms=None)
+        await store.create("s1")
+        # 23 tin nhắn: 10 mới nhất trong Redis, 5 mới nhất chưa được ghi xuống MySQL
+        await add_messages(store, "s1", [f"q{i}" for i in range(18)])
+        await persister.drain()
+        await add_messages(store, "s1", [f"q{i}" for i in range(18, 23)])
+
+        questions = await read_all(ChatHistoryReader(store, lambda: pool), store, "s1", limit)
+        assert questions == [f"q{i}" for i in range(22, -1, -1)]
+
+    asyncio.run(scenario())
+
+
+def test_synced_redis_messages_are_deduplicated_by_uid(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        store = SessionStore(redis_client, history_length=10)
+        await store.create("s1")
+        await add_messages(store, "s1", [f"q{i}" for i in range(12)])
+        await MessagePersister(redis_client, pool, block_ms=None).drain()
+
+        # Trang đầu gồm cả 10 tin nhắn Redis (đều đã có trong MySQL) và 2 tin nhắn chỉ còn trong MySQL
+        messages, before = await ChatHistoryReader(store, lambda: pool).page("s1", 20)
+        assert [message["question"] for message in messages] == [f"q{i}" for i in range(11, -1, -1)]
+        assert before is None
+
+    asyncio.run(scenario())
+
+
+def test_page_ending_at_last_redis_message_returns_redis_cursor(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        store = SessionStore(redis_client, history_length=10)
+        await store.create("s1")
+        await add_messages(store, "s1", [f"q{i}" for i in range(13)])
+        await MessagePersister(redis_client, pool, block_ms=None).drain()
+        reader = ChatHistoryReader(store, lambda: pool)
+
+        messages, before = await reader.page("s1", 10, question_count=13)
+        assert [message["question"] for message in messages] == [f"q{i}" for i in range(12, 2, -1)]
+        cursor = decode_cursor(before)
+        assert (cursor["src"], cursor["offset"]) == ("redis", 10)
+
+        messages, before = await reader.page("s1", 10, before, question_count=13)
+        assert [message["question"] for message in messages] == ["q2", "q1", "q0"]
+        assert before is None
+
+    asyncio.run(scenario())
+
+
+def test_cursor_follows_message_after_list_shifts(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        store = SessionStore(redis_client, history_length=10)
+        persister = MessagePersister(redis_client, pool, block_ms=None)
+        await store.create("s1")
+        await add_messages(store, "s1", [f"q{i}" for i in range(8)])
+        await persister.drain()
+        reader = ChatHistoryReader(store, lambda: pool)
+
+        messages, before = await reader.page("s1", 3)
+        assert [message["question"] for message in messages] == ["q7", "q6", "q5"]
+
+        # Tin nhắn mới đẩy danh sách Redis đi 4 vị trí (và q0, q1 ra khỏi danh sách)
+        await add_messages(store, "s1", [f"q{i}" for i in range(8, 12)])
+        await persister.drain()
+        rest = []
+        while before is not None:
+            messages, before = await reader.page("s1", 3, before, question_count=await store.get_count("s1"))
+            rest += [message["question"] for message in messages]
+        assert rest == ["q4", "q3", "q2", "q1", "q0"]
+
+    asyncio.run(scenario())
+
+
+def test_legacy_entries_are_read_from_mysql_only(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        store = SessionStore(redis_client, history_length=10)
+        await store.create("s1", question_count=6)
+        # 6 tin nhắn kiểu cũ đã có trong MySQL (không có message_uid), 3 tin nhắn cuối còn trong Redis
+        started = datetime.now() - timedelta(hours=1)
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(
+                    "INSERT INTO chat_messages (session_id, question, answer, timestamp) VALUES (%s, %s, %s, %s)",
+                    [("s1", f"old{i}", "a", started + timedelta(seconds=i)) for i in range(6)]
+                )
+        for i in range(3, 6):
+            await redis_client.lpush("session:s1:history", f"User: old{i}\nAI: a")
+        await add_messages(store, "s1", ["new0"])
+        await MessagePersister(redis_client, pool, block_ms=None).drain()
+        await add_messages(store, "s1", ["new1", "new2"])
+
+        expected = ["new2", "new1", "new0"] + [f"old{i}" for i in range(5, -1, -1)]
+        for limit in (1, 2, 4, 20):
+            questions = await read_all(ChatHistoryReader(store, lambda: pool), store, "s1", limit)
+            assert questions == expected
+
+    asyncio.run(scenario())
+
+
+def test_short_session_is_served_from_redis_only(make_redis):
+    async def scenario():
+        store = SessionStore(make_redis())
+        await store.create("s1")
+        await add_messages(store, "s1", ["q0", "q1"])
+
+        messages, before = await ChatHistoryReader(store, mysql_unavailable).page("s1", 20, question_count=2)
+        assert [message["question"] for message in messages] == ["q1", "q0"]
+        assert before is None
+
+    asyncio.run(scenario())
+
+
+def test_invalid_cursor_is_rejected():
+    for cursor in ("not-base64!", "e30", "eyJzcmMiOiJteXNxbCJ9"):  # "{}", {"src":"mysql"} thiếu ts/id
+        with pytest.raises(InvalidCursor):
+            decode_cursor(cursor)
@@ -0,0 +1,137 @@
+import asyncio
+import sqlite3
+
+from app.message_log import DEAD_LETTER_STREAM_KEY, MESSAGE_GROUP, MessagePersister
+from app.session_store import MESSAGE_STREAM_KEY, SessionStore
+
+
+def reject_question(pool, question: str):
+    """Trigger SQLite làm MySQL từ chối một tin nhắn cụ thể (lỗi ghi không phải lỗi đọc)"""
+    with sqlite3.connect(pool.path) as conn:
+        conn.execute(
+            f"CREATE TRIGGER reject_{question} BEFORE INSERT ON chat_messages "
+            f"WHEN NEW.question = '{question}' BEGIN SELECT RAISE(ABORT, '{question} rejected'); END"
+        )
+
+
+async def stored_questions(pool):
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("SELECT question FROM chat_messages ORDER BY id")
+            return [row["question"] for row in await cursor.fetchall()]
+
+
+async def pending_count(redis_client):
+    return (await redis_client.xpending(MESSAGE_STREAM_KEY, MESSAGE_GROUP))["pending"]
+
+
+async def reclaim_when_idle(persister):
+    """Chờ quá claim_idle_ms (1 ms) rồi reclaim; XPENDING IDLE chỉ trả tin nhắn treo lâu hơn hẳn ngưỡng"""
+    await asyncio.sleep(0.005)
+    return await persister.reclaim()
+
+
+async def save_messages(redis_client, questions):
+    store = SessionStore(redis_client)
+    await store.create("s1")
+    for question in questions:
+        await store.save_exchange("s1", None, question, "a")
+
+
+def test_drain_persists_and_acks(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        await save_messages(redis_client, ["q0", "q1", "q2"])
+        persister = MessagePersister(redis_client, pool, block_ms=None, batch_size=2)
+
+        assert await persister.drain() == 3
+        assert await stored_questions(pool) == ["q0", "q1", "q2"]
+        assert await pending_count(redis_client) == 0
+
+    asyncio.run(scenario())
+
+
+def test_redelivered_message_is_written_once(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        await save_messages(redis_client, ["q0"])
+        (_, fields), = await redis_client.xrange(MESSAGE_STREAM_KEY)
+        # Cùng message_uid được giao lại (worker chết sau khi commit, trước khi XACK)
+        await redis_client.xadd(MESSAGE_STREAM_KEY, fields)
+
+        assert await MessagePersister(redis_client, pool, block_ms=None).drain() == 2
+        assert await stored_questions(pool) == ["q0"]
+
+    asyncio.run(scenario())
+
+
+def test_reclaim_claims_messages_of_a_dead_consumer(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        await save_messages(redis_client, ["q0", "q1"])
+        persister = MessagePersister(redis_client, pool, consumer="alive", block_ms=None, claim_idle_ms=1)
+        await persister.ensure_group()
+        # Một consumer khác nhận tin nhắn rồi dừng trước khi ghi
+        await redis_client.xreadgroup(MESSAGE_GROUP, "dead", {MESSAGE_STREAM_KEY: ">"})
+        assert await persister.process_new() == 0
+
+        assert await reclaim_when_idle(persister) == 2
+        assert persister.reclaimed == 2
+        assert await stored_questions(pool) == ["q0", "q1"]
+        assert await pending_count(redis_client) == 0
+
+    asyncio.run(scenario())
+
+
+def test_failed_batch_falls_back_to_single_rows(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        reject_question(pool, "boom")
+        await save_messages(redis_client, ["q0", "boom", "q1"])
+        persister = MessagePersister(redis_client, pool, block_ms=None)
+
+        assert await persister.drain() == 2
+        assert persister.failed_batches == 1
+        assert await stored_questions(pool) == ["q0", "q1"]
+        # Tin nhắn lỗi nằm lại trong pending list để XCLAIM thử lại
+        assert await pending_count(redis_client) == 1
+
+    asyncio.run(scenario())
+
+
+def test_message_is_dead_lettered_after_max_deliveries(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        reject_question(pool, "boom")
+        await save_messages(redis_client, ["boom"])
+        persister = MessagePersister(redis_client, pool, block_ms=None, claim_idle_ms=1, max_deliveries=2)
+
+        assert await persister.drain() == 0  # Lần giao 1
+        assert await reclaim_when_idle(persister) == 0  # XCLAIM: lần giao 2, vẫn lỗi
+        assert persister.dead_lettered == 0
+        assert await reclaim_when_idle(persister) == 0  # Đã giao đủ max_deliveries lần
+        assert persister.dead_lettered == 1
+        assert await pending_count(redis_client) == 0
+
+        (_, fields), = await redis_client.xrange(DEAD_LETTER_STREAM_KEY)
+        assert fields[b"question"] == b"boom"
+        assert b"boom rejected" in fields[b"error"]
+        assert fields[b"original_id"]
+
+    asyncio.run(scenario())
+
+
+def test_unreadable_message_is_dead_lettered_immediately(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        await save_messages(redis_client, ["q0"])
+        await redis_client.xadd(MESSAGE_STREAM_KEY, {"session_id": "s1", "question": "no uid"})
+        persister = MessagePersister(redis_client, pool, block_ms=None)
+
+        assert await persister.drain() == 1
+        assert persister.dead_lettered == 1
+        (_, fields), = await redis_client.xrange(DEAD_LETTER_STREAM_KEY)
+        assert fields[b"error"].startswith(b"Invalid message")
+        assert await pending_count(redis_client) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,111 @@
+import asyncio
+
+from app.session_store import (
+    DIRTY_SESSIONS_KEY, QUOTA_EXCEEDED, QUOTA_OK, SESSION_FORBIDDEN, SESSION_MISSING,
+    SessionStore, legacy_count_key, meta_key,
+)
+
+
+def test_concurrent_increments_stop_exactly_at_limit(make_redis):
+    async def scenario():
+        store = SessionStore(make_redis(), question_limit=5)
+        await store.create("s1")
+        results = await asyncio.gather(*(store.check_and_increment("s1") for _ in range(20)))
+        statuses = [status for status, _, _ in results]
+        assert statuses.count(QUOTA_OK) == 5
+        assert statuses.count(QUOTA_EXCEEDED) == 15
+        assert await store.get_count("s1") == 5
+        assert await store.redis_client.smembers(DIRTY_SESSIONS_KEY) == {b"s1"}
+
+    asyncio.run(scenario())
+
+
+def test_foreign_user_is_forbidden(make_redis):
+    async def scenario():
+        store = SessionStore(make_redis())
+        await store.create("s1", user_id=7)
+        status, _, _ = await store.check_and_increment("s1", user_id=8)
+        assert status == SESSION_FORBIDDEN
+        assert await store.get_count("s1") == 0
+        assert not await store.redis_client.exists(DIRTY_SESSIONS_KEY)
+
+        status, count, _ = await store.check_and_increment("s1", user_id=7)
+        assert (status, count) == (QUOTA_OK, 1)
+
+    asyncio.run(scenario())
+
+
+def test_exceeded_quota_does_not_increment(make_redis):
+    async def scenario():
+        store = SessionStore(make_redis(), question_limit=3)
+        await store.create("s1", question_count=3)
+        status, count, _ = await store.check_and_increment("s1")
+        assert (status, count) == (QUOTA_EXCEEDED, 3)
+        assert await store.get_count("s1") == 3
+
+    asyncio.run(scenario())
+
+
+def test_check_returns_history_newest_first(make_redis):
+    async def scenario():
+        store = SessionStore(make_redis())
+        await store.create("s1")
+        for i in range(3):
+            await store.check_and_increment("s1")
+            await store.save_exchange("s1", None, f"q{i}", f"a{i}")
+        _, _, history = await store.check_and_increment("s1")
+        assert history == ["User: q2\nAI: a2", "User: q1\nAI: a1", "User: q0\nAI: a0"]
+
+    asyncio.run(scenario())
+
+
+def test_missing_session_is_restored_once(make_redis):
+    async def scenario():
+        store = SessionStore(make_redis())
+        status, _, _ = await store.check_and_increment("s1", user_id=7)
+        assert status == SESSION_MISSING
+
+        await store.restore("s1", question_count=3, user_id=7)
+        status, count, _ = await store.check_and_increment("s1", user_id=7)
+        assert (status, count) == (QUOTA_OK, 4)
+
+        # Request khác khôi phục chậm hơn không ghi đè bộ đếm đã tăng
+        await store.restore("s1", question_count=3, user_id=7)
+        assert await store.get_count("s1") == 4
+
+        status, _, _ = await store.check_and_increment("s1", user_id=8)
+        assert status == SESSION_FORBIDDEN
+
+    asyncio.run(scenario())
+
+
+def test_legacy_count_is_migrated_into_meta(make_redis):
+    async def scenario():
+        redis_client = make_redis()
+        store = SessionStore(redis_client)
+        # Phiên tạo trước khi bộ đếm chuyển vào hash: meta chưa có count, bộ đếm nằm ở khóa cũ
+        await redis_client.hset(meta_key("s1"), mapping={"user_id": 7, "created_at": "2024-01-01T00:00:00"})
+        await redis_client.set(legacy_count_key("s1"), 2)
+
+        status, count, _ = await store.check_and_increment("s1", user_id=7)
+        assert (status, count) == (QUOTA_OK, 3)
+        assert await store.get_count("s1") == 3
+        assert not await redis_client.exists(legacy_count_key("s1"))
+
+    asyncio.run(scenario())
+
+
+def test_restore_prefers_unsynced_legacy_count(make_redis):
+    async def scenario():
+        redis_client = make_redis()
+        store = SessionStore(redis_client)
+        # Bộ đếm cũ đi trước MySQL vì chưa được đồng bộ
+        await redis_client.set(legacy_count_key("s1"), 5)
+        status, _, _ = await store.check_and_increment("s1")
+        assert status == SESSION_MISSING
+
+        await store.restore("s1", question_count=3)
+        assert await store.get_count("s1") == 5
+        assert not await redis_client.exists(legacy_count_key("s1"))
+
+    asyncio.run(scenario())
@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from app.message_log import MessagePersister
+from app.session_store import DIRTY_SESSIONS_KEY, SessionStore, meta_key
+from app.sync_engine import SyncEngine
+
+
+class UnavailablePool:
+    """MySQL không kết nối được"""
+
+    def acquire(self):
+        raise ConnectionError("MySQL is unavailable")
+
+
+async def fetch_sessions(pool):
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("SELECT session_id, user_id, question_count, created_at FROM chat_sessions")
+            return {row["session_id"]: row for row in await cursor.fetchall()}
+
+
+def test_sync_creates_session_row_from_meta(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        store = SessionStore(redis_client)
+        await store.create("s1", user_id=7)
+        await store.check_and_increment("s1", user_id=7)
+        await store.check_and_increment("s1", user_id=7)
+
+        totals = await SyncEngine(redis_client, pool).sync_once()
+        assert totals["sessions"] == 1
+        created_at = datetime.fromisoformat((await redis_client.hget(meta_key("s1"), "created_at")).decode())
+        row = (await fetch_sessions(pool))["s1"]
+        assert (row["user_id"], row["question_count"], row["created_at"]) == (7, 2, created_at)
+        assert not await redis_client.exists(DIRTY_SESSIONS_KEY)
+
+    asyncio.run(scenario())
+
+
+def test_session_without_questions_never_reaches_mysql(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        await SessionStore(redis_client).create("s1", user_id=7)
+        await SyncEngine(redis_client, pool).sync_once()
+        assert await fetch_sessions(pool) == {}
+
+    asyncio.run(scenario())
+
+
+def test_persister_and_sync_share_the_session_row(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        store = SessionStore(redis_client)
+        await store.create("s1", user_id=7)
+        await store.check_and_increment("s1", user_id=7)
+        await store.save_exchange("s1", 7, "q", "a")
+
+        # Tin nhắn được ghi trước khi SyncEngine chạy: dòng phiên được tạo cùng giao dịch
+        assert await MessagePersister(redis_client, pool, block_ms=None).drain() == 1
+        row = (await fetch_sessions(pool))["s1"]
+        assert (row["user_id"], row["question_count"]) == (7, 0)
+
+        await SyncEngine(redis_client, pool).sync_once()
+        assert (await fetch_sessions(pool))["s1"]["question_count"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_failed_sync_requeues_dirty_sessions(make_redis, make_pool):
+    async def scenario():
+        redis_client = make_redis()
+        store = SessionStore(redis_client)
+        for session_id in ("s1", "s2"):
+            await store.create(session_id)
+            await store.check_and_increment(session_id)
+
+        with pytest.raises(ConnectionError):
+            await SyncEngine(redis_client, UnavailablePool()).sync_once()
+        assert await redis_client.smembers(DIRTY_SESSIONS_KEY) == {b"s1", b"s2"}
+
+        pool = make_pool()
+        assert (await SyncEngine(redis_client, pool).sync_once())["sessions"] == 2
+        assert set(await fetch_sessions(pool)) == {"s1", "s2"}
+
+    asyncio.run(scenario())
+
+
+def test_legacy_pending_messages_of_idle_sessions_are_drained(make_redis, make_pool):
+    async def scenario():
+        redis_client, pool = make_redis(), make_pool()
+        # Tin nhắn xếp hàng theo định dạng cũ; phiên không có request mới nên không nằm trong tập dirty
+        await redis_client.hset("session:s1:msg:1700000000", mapping={
+            "session_id": "s1", "question": "q", "answer": "a", "timestamp": "2023-11-14T22:13:20"
+        })
+        await redis_client.sadd("session:s1:pending_msgs", "session:s1:msg:1700000000")
+        engine = SyncEngine(redis_client, pool)
+        assert (await engine.sync_once())["messages"] == 0
+
+        assert await engine.requeue_legacy_pending() == 1
+        assert (await engine.sync_once())["messages"] == 1
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("SELECT session_id, question FROM chat_messages")
+                assert await cursor.fetchall() == [{"session_id": "s1", "question": "q"}]
+        assert not await redis_client.exists("session:s1:pending_msgs", "session:s1:msg:1700000000")
+        assert await engine.requeue_legacy_pending() == 0
+
+    asyncio.run(scenario())
@@ -1,4 +1,8 @@
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
 import pymysql
 import redis
 from dotenv import load_dotenv
@@ -13,7 +17,163 @@ def get_mysql_connection():
         user=os.getenv("MYSQL_USER", "root"),
         password=os.getenv("MYSQL_PASSWORD", ""),
         database=os.getenv("MYSQL_DATABASE", "nutrition_advisor"),
-        cursorclass=pymysql.cursors.DictCursor
+        cursorclass=pymysql.cursors.DictCursor,
+        autocommit=True
+    )
+
+class MySQLConnectionPool:
+    """
+    Pool kết nối MySQL có giới hạn, an toàn giữa các thread.
+
+    Mỗi request mượn một kết nối riêng qua `connection()`. Kết nối nhàn rỗi lâu hơn
+    `ping_interval` giây được ping (kèm reconnect) trước khi dùng, kết nối cũ hơn
+    `recycle` giây được mở lại, để không lỗi sau `wait_timeout` của MySQL.
+    """
+
+    def __init__(self, size=10, timeout=5.0, recycle=3600, ping_interval=30.0, connect=get_mysql_connection):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._waiting = 0
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.pings = 0
+        self.reconnects = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _checkout(self):
+        """Lấy kết nối nhàn rỗi, mở kết nối mới nếu còn chỗ, hoặc chờ tối đa `timeout` giây."""
+        with self._lock:
+            self._waiting += 1
+        try:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    return [self._connect(), time.monotonic(), time.monotonic()]
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            try:
+                return self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self.timeouts += 1
+                raise TimeoutError(f"Timed out after {self.timeout}s waiting for a MySQL connection")
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def _discard(self):
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        """Mượn một kết nối từ pool và trả lại khi xong."""
+        start = time.perf_counter()
+        entry = self._checkout()
+        wait = time.perf_counter() - start
+        with self._lock:
+            self.checkouts += 1
+            self._in_use += 1
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+
+        conn, created_at, last_used = entry
+        healthy = False
+        try:
+            now = time.monotonic()
+            if now - created_at > self.recycle:
+                # Mở lại kết nối quá cũ
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = self._connect()
+                entry[0] = conn
+                entry[1] = now
+                with self._lock:
+                    self.reconnects += 1
+            elif now - last_used > self.ping_interval:
+                with self._lock:
+                    self.pings += 1
+                conn.ping(reconnect=True)
+            yield conn
+            healthy = True
+        except BaseException:
+            # Hủy giao dịch dở dang; kết nối chỉ được trả lại pool nếu rollback thành công
+            try:
+                conn.rollback()
+                healthy = True
+            except Exception:
+                pass
+            raise
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            if healthy and conn.open:
+                entry[2] = time.monotonic()
+                self._idle.put(entry)
+            else:
+                # Không trả lại kết nối đã hỏng
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                self._discard()
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()[0]
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception:
+                pass
+            self._discard()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self._created,
+                "max_size": self.size,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "waiting": self._waiting,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "pings": self.pings,
+                "reconnects": self.reconnects,
+                "wait_seconds_total": round(self.wait_seconds_total, 4),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 4) if self.checkouts else 0.0,
+                "wait_seconds_max": round(self.wait_seconds_max, 4),
+            }
+
+def get_mysql_pool():
+    """Get MySQL connection pool configured from environment variables."""
+    return MySQLConnectionPool(
+        size=int(os.getenv("MYSQL_POOL_SIZE", "10")),
+        timeout=float(os.getenv("MYSQL_POOL_TIMEOUT", "5")),
+        recycle=int(os.getenv("MYSQL_POOL_RECYCLE", "3600")),
+        ping_interval=float(os.getenv("MYSQL_POOL_PING_INTERVAL", "30"))
     )
 
 def get_redis_client():
@@ -22,4 +182,4 @@ def get_redis_client():
         host=os.getenv("REDIS_HOST", "localhost"),
         port=int(os.getenv("REDIS_PORT", 6379)),
         db=int(os.getenv("REDIS_DB", 0))
-    )
\ No newline at end of file
+    )
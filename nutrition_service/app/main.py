@@ -1,6 +1,7 @@
 import logging
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from pydantic import BaseModel
 import os
 import sys
@@ -17,11 +18,12 @@ from datetime import datetime
 
 # Add the parent directory to sys.path to allow imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from src.prompt import create_chat_chain, create_meal_suggestion_chain
+from src.prompt import create_chat_chain, create_meal_suggestion_chain, parse_json_response
 from src.product_matching import ProductMatcher
+from src.metrics import CONTENT_TYPE_LATEST, observe_stage, render_metrics, stats_collector, track_request
 from app.models import (HealthInfo, MealPreferences, MealSuggestionRequest, 
                       QueryRequest, NewSessionRequest)
-from app.database import get_mysql_connection, get_redis_client
+from app.database import get_mysql_pool, get_redis_client
 
 # Load environment variables
 load_dotenv()
@@ -46,12 +48,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Histogram thời gian theo endpoint; endpoint hiện tại được gắn cho các bước đo bên trong
+app.middleware("http")(track_request)
+
 # Initialize global variables
 chat_chain = None
 meal_suggestion_chain = None
 product_matcher = None
 redis_client = None
-mysql_conn = None
+mysql_pool = None
 
 # Sync variables
 sync_interval = int(os.getenv("SYNC_INTERVAL", "300"))
@@ -66,13 +71,13 @@ def sync_to_mysql():
 @app.on_event("startup")
 async def startup_event():
     """Initialize resources on startup"""
-    global chat_chain, meal_suggestion_chain, product_matcher, redis_client, mysql_conn, sync_thread
+    global chat_chain, meal_suggestion_chain, product_matcher, redis_client, mysql_pool, sync_thread
     try:
         # Initialize Redis
         redis_client = get_redis_client()
         
-        # Initialize MySQL
-        mysql_conn = get_mysql_connection()
+        # Initialize MySQL connection pool (kết nối được mở khi cần)
+        mysql_pool = get_mysql_pool()
         
         # Initialize Mistral chains
         if chat_chain is None:
@@ -98,18 +103,79 @@ async def startup_event():
 # Implement endpoints like /new_session, /nutrition/advice, /nutrition/meal-suggestion etc.
 # as shown in the artifacts earlier
 
+def insert_session(session_id: str, user_id: Optional[int]):
+    """Insert a chat session row using a pooled connection"""
+    with mysql_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO chat_sessions (session_id, user_id, question_count) VALUES (%s, %s, %s)", 
+                (session_id, user_id, 0)
+            )
+
+def fetch_session(session_id: str):
+    """Fetch a chat session row using a pooled connection"""
+    with mysql_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT * FROM chat_sessions WHERE session_id = %s", (session_id,))
+            return cursor.fetchone()
+
+async def validate_or_create_session(session_id: Optional[str], user_id: Optional[int]) -> str:
+    """Return a valid session_id, creating a new session if none was provided"""
+    if session_id is None:
+        session_id = str(uuid.uuid4())
+        with observe_stage("session_mysql"):
+            await asyncio.to_thread(insert_session, session_id, user_id)
+        with observe_stage("session_redis"):
+            redis_client.set(f"session:{session_id}:count", 0, ex=86400)  # TTL 24 giờ
+        logger.info(f"New session created for user {user_id}: {session_id}")
+        return session_id
+    
+    with observe_stage("session_redis"):
+        if redis_client.exists(f"session:{session_id}:count"):
+            return session_id
+    
+    # Khôi phục bộ đếm từ MySQL nếu không có trong Redis
+    with observe_stage("session_mysql"):
+        session = await asyncio.to_thread(fetch_session, session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    if user_id is not None and session["user_id"] is not None and str(session["user_id"]) != str(user_id):
+        raise HTTPException(status_code=403, detail="Not authorized to access this chat session")
+    redis_client.set(f"session:{session_id}:count", session["question_count"], ex=86400, nx=True)
+    return session_id
+
+def cache_stats_snapshot():
+    embeddings = getattr(product_matcher, "embeddings", None)
+    return embeddings.stats() if embeddings is not None else None
+
+# Gauge cho /metrics: pool MySQL và cache embedding của product matching, đọc tại thời điểm scrape
+stats_collector.register("mysql_pool", lambda: mysql_pool.stats() if mysql_pool is not None else None)
+stats_collector.register("embedding_cache", cache_stats_snapshot)
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """Embedding cache statistics for product matching"""
+    return {"embedding": cache_stats_snapshot()}
+
+@app.get("/pool_stats")
+async def pool_stats():
+    """MySQL connection pool statistics"""
+    if mysql_pool is None:
+        raise HTTPException(status_code=503, detail="MySQL pool is not initialized")
+    return {"mysql": mysql_pool.stats()}
+
+@app.get("/metrics")
+async def metrics():
+    """Per-stage latency histograms plus pool and cache gauges in Prometheus text format"""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
 @app.post("/new_session")
 async def new_session(request: NewSessionRequest):
     """Create a new chat session"""
     session_id = str(uuid.uuid4())  # Tạo session_id mới bằng UUID
     try:
-        with mysql_conn.cursor() as cursor:
-            user_id_value = request.user_id if request.user_id is not None else None
-            cursor.execute(
-                "INSERT INTO chat_sessions (session_id, user_id, question_count) VALUES (%s, %s, %s)", 
-                (session_id, user_id_value, 0)
-            )
-            mysql_conn.commit()
+        user_id_value = request.user_id if request.user_id is not None else None
+        await asyncio.to_thread(insert_session, session_id, user_id_value)
         # Khởi tạo trong Redis
         redis_client.set(f"session:{session_id}:count", 0, ex=86400)  # TTL 24 giờ
         logger.info(f"New session created: {session_id}")
@@ -121,19 +187,21 @@ async def new_session(request: NewSessionRequest):
 @app.post("/nutrition/advice")
 async def nutrition_advice(request: QueryRequest):
     """Process a nutrition query using Mistral LLM"""
-    global nutrition_chain
+    global chat_chain
     
     # Validate session or create new one
     session_id = await validate_or_create_session(request.session_id, request.user_id)
     
     # Get and increment question count
-    question_count = int(redis_client.get(f"session:{session_id}:count") or 0)
+    with observe_stage("session_redis"):
+        question_count = int(redis_client.get(f"session:{session_id}:count") or 0)
     
     if question_count >= 30:
         raise HTTPException(status_code=429, detail="Giới hạn 30 câu hỏi mỗi phiên đã đạt. Vui lòng bắt đầu phiên mới.")
     
     # Increment question count immediately
-    redis_client.incr(f"session:{session_id}:count")
+    with observe_stage("session_redis"):
+        redis_client.incr(f"session:{session_id}:count")
     
     question = request.question
     logger.info(f"Received nutrition query: {question}")
@@ -143,13 +211,15 @@ async def nutrition_advice(request: QueryRequest):
     
     try:
         # Initialize nutrition chain if not done during startup
-        if nutrition_chain is None:
-            logger.info("Khởi tạo nutrition chain on first request...")
-            nutrition_chain = create_nutrition_chain()
-            logger.info("Nutrition chain đã khởi tạo thành công on first request")
+        if chat_chain is None:
+            logger.info("Khởi tạo chat chain on first request...")
+            with observe_stage("chain_init"):
+                chat_chain = create_chat_chain()
+            logger.info("Chat chain đã khởi tạo thành công on first request")
         
         # Get chat history from Redis
-        chat_history = redis_client.lrange(f"session:{session_id}:history", 0, -1)
+        with observe_stage("history_redis"):
+            chat_history = redis_client.lrange(f"session:{session_id}:history", 0, -1)
         chat_history_str = "\n".join([msg.decode('utf-8') for msg in chat_history]) if chat_history else ""
         
         # Format health info
@@ -159,14 +229,17 @@ async def nutrition_advice(request: QueryRequest):
         
         # Add artificial delay for better user experience
         if question.lower() != "xin chào" and not question.lower().startswith("hello"):
-            await asyncio.sleep(1)  # Delay 1 second
+            with observe_stage("thinking_delay"):
+                await asyncio.sleep(1)  # Delay 1 second
         
         # Process the query with history if available
-        response = nutrition_chain.invoke({
-            "input": question,
-            "history": chat_history_str,
-            "health_info": health_info_str
-        })
+        with observe_stage("generation"):
+            # Chain gọi Ollama đồng bộ; chạy trong thread để không chặn event loop
+            response = await asyncio.to_thread(chat_chain.invoke, {
+                "input": question,
+                "history": chat_history_str,
+                "health_info": health_info_str
+            })
         
         if isinstance(response, dict) and "answer" in response:
             answer = response["answer"]
@@ -174,27 +247,28 @@ async def nutrition_advice(request: QueryRequest):
             answer = str(response)
         
         # Save question and answer to Redis
-        redis_client.lpush(f"session:{session_id}:history", f"User: {question}\nAI: {answer}")
-        redis_client.ltrim(f"session:{session_id}:history", 0, 9)  # Limit history to last 10 messages
-        
-        # Save message info to Redis for later sync
-        chat_msg_key = f"session:{session_id}:msg:{int(time.time())}"
-        message_data = {
-            "question": question,
-            "answer": answer,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        # Add user_id to data if available
-        if request.user_id is not None:
-            message_data["user_id"] = request.user_id
-        
-        redis_client.hmset(chat_msg_key, message_data)
-        redis_client.expire(chat_msg_key, 86400)  # TTL 24 hours
-        
-        # Cache messages to sync
-        redis_client.sadd(f"session:{session_id}:pending_msgs", chat_msg_key)
-        redis_client.expire(f"session:{session_id}:pending_msgs", 86400)
+        with observe_stage("save_redis"):
+            redis_client.lpush(f"session:{session_id}:history", f"User: {question}\nAI: {answer}")
+            redis_client.ltrim(f"session:{session_id}:history", 0, 9)  # Limit history to last 10 messages
+            
+            # Save message info to Redis for later sync
+            chat_msg_key = f"session:{session_id}:msg:{int(time.time())}"
+            message_data = {
+                "question": question,
+                "answer": answer,
+                "timestamp": datetime.now().isoformat()
+            }
+            
+            # Add user_id to data if available
+            if request.user_id is not None:
+                message_data["user_id"] = request.user_id
+            
+            redis_client.hmset(chat_msg_key, message_data)
+            redis_client.expire(chat_msg_key, 86400)  # TTL 24 hours
+            
+            # Cache messages to sync
+            redis_client.sadd(f"session:{session_id}:pending_msgs", chat_msg_key)
+            redis_client.expire(f"session:{session_id}:pending_msgs", 86400)
         
         # Calculate processing time
         processing_time = time.time() - start_time
@@ -212,6 +286,15 @@ async def nutrition_advice(request: QueryRequest):
             detail=f"An error occurred while processing your request: {str(e)}"
         )
 
+def save_meal_suggestion(user_id, session_id, suggestion_json, health_json):
+    """Insert a meal suggestion row using a pooled connection"""
+    with mysql_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO meal_suggestions (user_id, session_id, suggestion_data, health_data) VALUES (%s, %s, %s, %s)",
+                (user_id, session_id, suggestion_json, health_json)
+            )
+
 @app.post("/nutrition/meal-suggestion")
 async def meal_suggestion(request: MealSuggestionRequest):
     """Get meal suggestions based on health information and preferences"""
@@ -229,13 +312,15 @@ async def meal_suggestion(request: MealSuggestionRequest):
         # Initialize meal suggestion chain if not done during startup
         if meal_suggestion_chain is None:
             logger.info("Khởi tạo meal suggestion chain on first request...")
-            meal_suggestion_chain = create_meal_suggestion_chain()
+            with observe_stage("chain_init"):
+                meal_suggestion_chain = create_meal_suggestion_chain()
             logger.info("Meal suggestion chain đã khởi tạo thành công on first request")
         
         # Initialize product matcher if not done during startup
         if product_matcher is None:
             logger.info("Khởi tạo product matcher on first request...")
-            product_matcher = ProductMatcher()
+            with observe_stage("matcher_init"):
+                product_matcher = await asyncio.to_thread(ProductMatcher)
             logger.info("Product matcher đã khởi tạo thành công on first request")
         
         # Format health info
@@ -248,45 +333,44 @@ async def meal_suggestion(request: MealSuggestionRequest):
         query_prompt = f"Gợi ý món ăn phù hợp cho người có thông tin sức khỏe như đã cung cấp. Size gia đình: {request.family_size} người."
         
         # Process the query
-        response = meal_suggestion_chain.invoke({
-            "input": query_prompt,
-            "health_info": health_info_str,
-            "preferences": preferences_str
-        })
+        with observe_stage("generation"):
+            response = await asyncio.to_thread(meal_suggestion_chain.invoke, {
+                "input": query_prompt,
+                "health_info": health_info_str,
+                "preferences": preferences_str
+            })
         
         # Parse the response to get structured data
-        if isinstance(response, str):
-            meal_data = parse_json_response(response)
-        else:
-            meal_data = parse_json_response(str(response))
+        with observe_stage("parse_response"):
+            if isinstance(response, str):
+                meal_data = parse_json_response(response)
+            else:
+                meal_data = parse_json_response(str(response))
         
         # Process ingredients to find matching products
         meals = meal_data.get("meals", [])
-        processed_meals = product_matcher.bulk_process_meals(meals)
+        with observe_stage("product_matching"):
+            # Embedding nguyên liệu và truy vấn Pinecone đều đồng bộ
+            processed_meals = await asyncio.to_thread(product_matcher.bulk_process_meals, meals)
         
         # Save meal suggestion to database
         try:
-            with mysql_conn.cursor() as cursor:
-                suggestion_data = {
-                    "suggestion": processed_meals,
-                    "request": {
-                        "health_info": request.health_info.dict(),
-                        "preferences": request.preferences.dict(),
-                        "family_size": request.family_size
-                    }
+            suggestion_data = {
+                "suggestion": processed_meals,
+                "request": {
+                    "health_info": request.health_info.dict(),
+                    "preferences": request.preferences.dict(),
+                    "family_size": request.family_size
                 }
-                
-                # Insert suggestion data
-                cursor.execute(
-                    "INSERT INTO meal_suggestions (user_id, session_id, suggestion_data, health_data) VALUES (%s, %s, %s, %s)",
-                    (
-                        request.user_id,
-                        session_id,
-                        json.dumps(suggestion_data, ensure_ascii=False),
-                        json.dumps(request.health_info.dict(), ensure_ascii=False)
-                    )
+            }
+            with observe_stage("save_mysql"):
+                await asyncio.to_thread(
+                    save_meal_suggestion,
+                    request.user_id,
+                    session_id,
+                    json.dumps(suggestion_data, ensure_ascii=False),
+                    json.dumps(request.health_info.dict(), ensure_ascii=False)
                 )
-                mysql_conn.commit()
         except Exception as e:
             logger.error(f"Error saving meal suggestion: {str(e)}")
             # Continue even if saving fails
@@ -310,62 +394,72 @@ async def meal_suggestion(request: MealSuggestionRequest):
             detail=f"An error occurred while processing your meal suggestion request: {str(e)}"
         )
 
-@app.get("/chat-history/{session_id}")
-async def get_chat_history(session_id: str):
-    """Get chat history for a specific session"""
-    try:
-        # Check if session exists
-        with mysql_conn.cursor() as cursor:
+def fetch_chat_history(session_id: str):
+    """Fetch a session row and its messages using a pooled connection"""
+    with mysql_pool.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute("SELECT * FROM chat_sessions WHERE session_id = %s", (session_id,))
             session = cursor.fetchone()
             if not session:
-                raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+                return None, []
             
             # Get chat history from MySQL, ordered by most recent first
             cursor.execute(
                 "SELECT question, answer, timestamp FROM chat_messages WHERE session_id = %s ORDER BY timestamp DESC", 
                 (session_id,)
             )
-            messages = cursor.fetchall()
-            
-            # If no messages in MySQL, try Redis
-            if not messages:
-                chat_history = redis_client.lrange(f"session:{session_id}:history", 0, -1)
-                
-                if chat_history:
-                    # Convert format
-                    messages = []
-                    for msg in chat_history:
-                        msg_str = msg.decode('utf-8')
-                        # Split into question and answer
-                        parts = msg_str.split("\nAI: ")
-                        if len(parts) == 2:
-                            question = parts[0].replace("User: ", "")
-                            answer = parts[1]
-                            messages.append({
-                                "question": question,
-                                "answer": answer,
-                                "timestamp": None  # Redis doesn't store timestamp
-                            })
-            
-            # Format messages
-            formatted_messages = []
-            for msg in messages:
-                formatted_msg = {
-                    "question": msg["question"],
-                    "answer": msg["answer"]
-                }
-                # Add timestamp if available
-                if "timestamp" in msg and msg["timestamp"]:
-                    formatted_msg["timestamp"] = msg["timestamp"].isoformat()
-                
-                formatted_messages.append(formatted_msg)
+            return session, cursor.fetchall()
+
+@app.get("/chat-history/{session_id}")
+async def get_chat_history(session_id: str):
+    """Get chat history for a specific session"""
+    try:
+        # Check if session exists and load its messages with one pooled connection
+        with observe_stage("history_mysql"):
+            session, messages = await asyncio.to_thread(fetch_chat_history, session_id)
+        if not session:
+            raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+        
+        # If no messages in MySQL, try Redis
+        if not messages:
+            chat_history = redis_client.lrange(f"session:{session_id}:history", 0, -1)
             
-            return {
-                "session_id": session_id,
-                "messages": formatted_messages,
-                "question_count": session["question_count"]
+            if chat_history:
+                # Convert format
+                messages = []
+                for msg in chat_history:
+                    msg_str = msg.decode('utf-8')
+                    # Split into question and answer
+                    parts = msg_str.split("\nAI: ")
+                    if len(parts) == 2:
+                        question = parts[0].replace("User: ", "")
+                        answer = parts[1]
+                        messages.append({
+                            "question": question,
+                            "answer": answer,
+                            "timestamp": None  # Redis doesn't store timestamp
+                        })
+        
+        # Format messages
+        formatted_messages = []
+        for msg in messages:
+            formatted_msg = {
+                "question": msg["question"],
+                "answer": msg["answer"]
             }
+            # Add timestamp if available
+            if "timestamp" in msg and msg["timestamp"]:
+                formatted_msg["timestamp"] = msg["timestamp"].isoformat()
+            
+            formatted_messages.append(formatted_msg)
+        
+        return {
+            "session_id": session_id,
+            "messages": formatted_messages,
+            "question_count": session["question_count"]
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching chat history: {str(e)}")
         raise HTTPException(
@@ -373,40 +467,44 @@ async def get_chat_history(session_id: str):
             detail=f"An error occurred while fetching chat history: {str(e)}"
         )
 
-@app.get("/meal-history/{user_id}")
-async def get_meal_history(user_id: int):
-    """Get meal suggestion history for a specific user"""
-    try:
-        with mysql_conn.cursor() as cursor:
+def fetch_meal_suggestions(user_id: int):
+    """Fetch a user's meal suggestions using a pooled connection"""
+    with mysql_pool.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute(
                 "SELECT id, session_id, suggestion_data, health_data, timestamp FROM meal_suggestions WHERE user_id = %s ORDER BY timestamp DESC", 
                 (user_id,)
             )
-            suggestions = cursor.fetchall()
-            
-            formatted_suggestions = []
-            for suggestion in suggestions:
-                try:
-                    suggestion_data = json.loads(suggestion["suggestion_data"])
-                    health_data = json.loads(suggestion["health_data"])
-                    
-                    formatted_suggestion = {
-                        "id": suggestion["id"],
-                        "session_id": suggestion["session_id"],
-                        "timestamp": suggestion["timestamp"].isoformat(),
-                        "health_info": health_data,
-                        "meals": suggestion_data.get("suggestion", {}).get("processed_meals", [])
-                    }
-                    
-                    formatted_suggestions.append(formatted_suggestion)
-                except Exception as e:
-                    logger.error(f"Error parsing suggestion data: {str(e)}")
-                    continue
-            
-            return {
-                "user_id": user_id,
-                "suggestions": formatted_suggestions
-            }
+            return cursor.fetchall()
+
+@app.get("/meal-history/{user_id}")
+async def get_meal_history(user_id: int):
+    """Get meal suggestion history for a specific user"""
+    try:
+        suggestions = await asyncio.to_thread(fetch_meal_suggestions, user_id)
+        formatted_suggestions = []
+        for suggestion in suggestions:
+            try:
+                suggestion_data = json.loads(suggestion["suggestion_data"])
+                health_data = json.loads(suggestion["health_data"])
+                
+                formatted_suggestion = {
+                    "id": suggestion["id"],
+                    "session_id": suggestion["session_id"],
+                    "timestamp": suggestion["timestamp"].isoformat(),
+                    "health_info": health_data,
+                    "meals": suggestion_data.get("suggestion", {}).get("processed_meals", [])
+                }
+                
+                formatted_suggestions.append(formatted_suggestion)
+            except Exception as e:
+                logger.error(f"Error parsing suggestion data: {str(e)}")
+                continue
+        
+        return {
+            "user_id": user_id,
+            "suggestions": formatted_suggestions
+        }
     except Exception as e:
         logger.error(f"Error fetching meal history: {str(e)}")
         raise HTTPException(
@@ -426,8 +524,8 @@ async def shutdown_event():
     stop_sync_thread = True
     if sync_thread:
         sync_thread.join(timeout=5)
-    if mysql_conn:
-        mysql_conn.close()
+    if mysql_pool:
+        mysql_pool.close()
 
 if __name__ == "__main__":
     import uvicorn
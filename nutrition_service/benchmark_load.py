@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Benchmark tải chạy hoàn toàn offline cho nutrition service.
+
+App FastAPI được gọi trực tiếp qua ASGI trong cùng tiến trình, với:
+- Chain Mistral/Ollama giả: câu trả lời xác định theo input, độ trễ cấu hình được;
+  chain gợi ý món trả về JSON có nguyên liệu để đi qua parse và product matching
+- Redis giả trong tiến trình (fakeredis)
+- SQLite thay MySQL, cùng giao diện pool `connection()` của app
+- ProductMatcher ở chế độ dummy (không có PINECONE_API_KEY)
+
+Gửi /new_session, /nutrition/advice, /nutrition/meal-suggestion và /chat-history
+với số request đồng thời cho trước, rồi báo thông lượng và p50/p95/p99 của từng
+endpoint; --baseline so với một lần chạy trước và trả exit code 1 khi p95 tệ hơn
+ngưỡng cho phép.
+
+Cài phụ thuộc riêng cho benchmark: pip install -r requirements-dev.txt
+
+Ví dụ:
+    python benchmark_load.py --requests 200 --concurrency 16 --llm-latency 0.3
+    python benchmark_load.py --output bench.json
+    python benchmark_load.py --baseline bench.json --max-regression 0.2
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Add the parent directory to sys.path to allow imports from src and app
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_QUESTIONS = [
+    "Tôi muốn giảm cân, nên ăn gì?",
+    "Người tiểu đường nên ăn sáng thế nào?",
+    "Thực phẩm nào giàu canxi cho trẻ em?",
+    "Phụ nữ mang thai nên bổ sung chất gì?",
+    "Ăn bao nhiêu protein mỗi ngày là đủ?",
+]
+
+HEALTH_PROFILES = [
+    {"age": 30, "gender": "nam", "weight": 72, "height": 172, "activity_level": "moderate", "goals": ["giảm cân"]},
+    {"age": 45, "gender": "nữ", "weight": 58, "height": 158, "activity_level": "light", "restrictions": ["ít muối"]},
+    {"age": 8, "gender": "nam", "weight": 25, "height": 128, "activity_level": "active", "allergies": ["sữa bò"]},
+]
+
+QUESTION_LIMIT = 30  # Giới hạn câu hỏi mỗi phiên của /nutrition/advice
+
+def percentile(values, pct):
+    """Tính percentile theo phương pháp nearest-rank."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+# --- Chain Mistral giả ---
+
+class FakeChain:
+    """
+    Thay `prompt | ChatOllama`: invoke() đồng bộ như chain thật (chặn event loop giống hệt),
+    nội dung và độ trễ chỉ phụ thuộc input. Độ trễ = latency + jitter * (0..1 từ hash của input).
+    """
+
+    def __init__(self, latency: float, jitter: float, meals: bool):
+        self.latency = latency
+        self.jitter = jitter
+        self.meals = meals
+
+    def invoke(self, inputs):
+        digest = hashlib.sha256(json.dumps(inputs, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+        time.sleep(self.latency + self.jitter * int(digest[:4], 16) / 0xFFFF)
+        if not self.meals:
+            return f"Lời khuyên mẫu {digest[4:12]}: ăn nhiều rau xanh, đạm nạc và uống đủ nước."
+        meals = [
+            {
+                "name": f"Món {i + 1} ({digest[4 + i:8 + i]})",
+                "benefits": "Giàu đạm, ít chất béo bão hòa",
+                "preparation": "Sơ chế, luộc hoặc xào nhanh với ít dầu",
+                "ingredients": [
+                    {"name": "Thịt gà", "amount": "200g"},
+                    {"name": "Rau cải", "amount": "300g"},
+                    {"name": "Tỏi", "amount": "2 tép"},
+                    {"name": "Nấm hương", "amount": "50g"},
+                ],
+            }
+            for i in range(3)
+        ]
+        payload = {"analysis": "Phân tích mẫu", "meals": meals, "advice": "Lời khuyên mẫu"}
+        return f"```json\n{json.dumps(payload, ensure_ascii=False)}\n```"
+
+# --- SQLite thay MySQL ---
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    session_id TEXT PRIMARY KEY,
+    user_id INTEGER,
+    question_count INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    user_id INTEGER,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS meal_suggestions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    session_id TEXT NOT NULL,
+    suggestion_data TEXT NOT NULL,
+    health_data TEXT,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda raw: datetime.fromisoformat(raw.decode("utf-8")))
+
+class SQLiteCursor:
+    """Giao diện con trỏ pymysql DictCursor trên SQLite, kèm độ trễ mạng giả lập."""
+
+    def __init__(self, raw, latency: float):
+        self._cursor = raw.cursor()
+        self._latency = latency
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def execute(self, sql, params=()):
+        if self._latency:
+            time.sleep(self._latency)
+        self._cursor.execute(sql.replace("%s", "?"), tuple(params or ()))
+        return self._cursor.rowcount
+
+    def _as_dict(self, row):
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return self._as_dict(row) if row is not None else None
+
+    def fetchall(self):
+        return [self._as_dict(row) for row in self._cursor.fetchall()]
+
+class SQLiteConnection:
+    def __init__(self, path: str, latency: float):
+        # Tự commit từng lệnh giống kết nối pymysql autocommit=True của app
+        self.raw = sqlite3.connect(path, isolation_level=None, check_same_thread=False,
+                                   detect_types=sqlite3.PARSE_DECLTYPES, timeout=30)
+        self.latency = latency
+
+    def cursor(self):
+        return SQLiteCursor(self.raw, self.latency)
+
+class SQLitePool:
+    """Thay MySQLConnectionPool trong benchmark: cùng giao diện connection()/stats()/close()."""
+
+    def __init__(self, path: str, size: int = 10, latency: float = 0.0):
+        self.size = size
+        with sqlite3.connect(path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SQLITE_SCHEMA)
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(SQLiteConnection(path, latency))
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    @contextmanager
+    def connection(self):
+        started = time.perf_counter()
+        conn = self._idle.get()
+        wait = time.perf_counter() - started
+        self.checkouts += 1
+        self.wait_seconds_total += wait
+        self.wait_seconds_max = max(self.wait_seconds_max, wait)
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "max_size": self.size,
+            "in_use": self.size - self._idle.qsize(),
+            "idle": self._idle.qsize(),
+            "checkouts": self.checkouts,
+            "wait_seconds_total": round(self.wait_seconds_total, 4),
+            "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 4) if self.checkouts else 0.0,
+            "wait_seconds_max": round(self.wait_seconds_max, 4),
+        }
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get().raw.close()
+
+# --- Thu thập kết quả ---
+
+class Recorder:
+    """Độ trễ và lỗi theo từng endpoint."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.windows = {}
+
+    def record(self, name: str, started: float, ok: bool):
+        finished = time.perf_counter()
+        first, last = self.windows.get(name, (started, finished))
+        self.windows[name] = (min(first, started), max(last, finished))
+        if ok:
+            self.latencies.setdefault(name, []).append(finished - started)
+        else:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            self.latencies.setdefault(name, [])
+
+    def summary(self):
+        result = {}
+        for name, values in self.latencies.items():
+            first, last = self.windows[name]
+            count = len(values) + self.errors.get(name, 0)
+            result[name] = {
+                "requests": count,
+                "errors": self.errors.get(name, 0),
+                "throughput": count / (last - first) if last > first else 0.0,
+                "mean": statistics.mean(values) if values else 0.0,
+                "p50": percentile(values, 50) if values else 0.0,
+                "p95": percentile(values, 95) if values else 0.0,
+                "p99": percentile(values, 99) if values else 0.0,
+            }
+        return result
+
+async def timed_request(client, recorder, name, method, url, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        ok = response.status_code < 400
+        if not ok:
+            print(f"{name} trả về {response.status_code}: {response.text[:200]}")
+        recorder.record(name, started, ok)
+        return response if ok else None
+    except Exception as e:
+        print(f"{name} lỗi: {str(e)}")
+        recorder.record(name, started, False)
+        return None
+
+async def run_workers(count: int, concurrency: int, job):
+    """Chạy job(i) cho i in range(count) với tối đa `concurrency` job cùng lúc."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(i):
+        async with semaphore:
+            await job(i)
+
+    await asyncio.gather(*(run(i) for i in range(count)))
+
+# --- Chạy benchmark ---
+
+async def run_benchmark(args, workdir):
+    import fakeredis
+    import httpx
+
+    # Không có PINECONE_API_KEY: ProductMatcher chạy chế độ dummy, không cần mạng
+    os.environ["PINECONE_API_KEY"] = ""
+    import app.main as main
+    from src.product_matching import ProductMatcher
+
+    mysql_pool = SQLitePool(os.path.join(workdir, "bench.db"), size=args.mysql_pool_size, latency=args.mysql_latency)
+    main.redis_client = fakeredis.FakeRedis()
+    main.mysql_pool = mysql_pool
+    main.chat_chain = FakeChain(args.llm_latency, args.llm_jitter, meals=False)
+    main.meal_suggestion_chain = FakeChain(args.llm_latency, args.llm_jitter, meals=True)
+    main.product_matcher = ProductMatcher()
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    session_count = max(args.sessions, -(-args.requests // QUESTION_LIMIT))
+    transport = httpx.ASGITransport(app=main.app)
+    started = time.perf_counter()
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        sessions = []
+
+        async def new_session(i):
+            response = await timed_request(client, recorder, "POST /new_session", "POST", "/new_session",
+                                           json={"user_id": None})
+            if response is not None:
+                sessions.append(response.json()["session_id"])
+
+        await run_workers(session_count, args.concurrency, new_session)
+        if not sessions:
+            raise RuntimeError("Không tạo được session nào, dừng benchmark")
+
+        async def advice(i):
+            payload = {
+                "question": rng.choice(DEFAULT_QUESTIONS),
+                "session_id": sessions[i % len(sessions)],
+                "health_info": rng.choice(HEALTH_PROFILES),
+            }
+            await timed_request(client, recorder, "POST /nutrition/advice", "POST", "/nutrition/advice", json=payload)
+
+        async def meal_suggestion(i):
+            payload = {
+                "session_id": sessions[i % len(sessions)],
+                "health_info": rng.choice(HEALTH_PROFILES),
+                "preferences": {"meal_type": rng.choice(["sáng", "trưa", "tối"]), "cuisine": "Việt Nam"},
+                "family_size": rng.randint(1, 5),
+            }
+            await timed_request(client, recorder, "POST /nutrition/meal-suggestion", "POST",
+                                "/nutrition/meal-suggestion", json=payload)
+
+        async def mixed(i):
+            # Xen kẽ hai loại request để đo ảnh hưởng lẫn nhau khi chạy đồng thời
+            await (meal_suggestion(i) if i % args.meal_every == 0 else advice(i))
+
+        print(f"Gửi {args.requests} request advice/meal-suggestion tới {len(sessions)} phiên, "
+              f"{args.concurrency} đồng thời...")
+        await run_workers(args.requests, args.concurrency, mixed)
+
+        async def chat_history(i):
+            session_id = sessions[i % len(sessions)]
+            await timed_request(client, recorder, "GET /chat-history", "GET", f"/chat-history/{session_id}")
+
+        await run_workers(args.history_requests, args.concurrency, chat_history)
+
+    elapsed = time.perf_counter() - started
+    with mysql_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) AS n FROM meal_suggestions")
+            saved_suggestions = cursor.fetchone()["n"]
+    mysql_pool.close()
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "elapsed_seconds": elapsed,
+        "endpoints": recorder.summary(),
+        "meal_suggestions": {
+            "answered": len(recorder.latencies.get("POST /nutrition/meal-suggestion", [])),
+            "saved": saved_suggestions,
+        },
+        "mysql_pool": mysql_pool.stats(),
+    }
+
+def print_report(result):
+    print("\n=== Kết quả ===")
+    print(f"{'endpoint':<32} {'req':>6} {'err':>5} {'req/s':>8} {'mean(s)':>8} {'p50(s)':>8} {'p95(s)':>8} {'p99(s)':>8}")
+    for name, r in result["endpoints"].items():
+        print(f"{name:<32} {r['requests']:>6} {r['errors']:>5} {r['throughput']:>8.2f} {r['mean']:>8.3f} "
+              f"{r['p50']:>8.3f} {r['p95']:>8.3f} {r['p99']:>8.3f}")
+    meals = result["meal_suggestions"]
+    print(f"\nGợi ý món đã trả lời: {meals['answered']}, đã lưu xuống MySQL: {meals['saved']}")
+    pool = result["mysql_pool"]
+    print(f"Pool MySQL: chờ trung bình {pool['wait_seconds_avg']:.4f}s, tối đa {pool['wait_seconds_max']:.4f}s")
+    print(f"Tổng thời gian: {result['elapsed_seconds']:.1f}s")
+
+def check_result(result, baseline, max_regression: float, min_delta: float):
+    """Danh sách vấn đề: lỗi request, gợi ý chưa được lưu, p95 tệ hơn baseline quá ngưỡng."""
+    problems = []
+    for name, r in result["endpoints"].items():
+        if r["errors"]:
+            problems.append(f"{name}: {r['errors']} request lỗi")
+    meals = result["meal_suggestions"]
+    if meals["saved"] < meals["answered"]:
+        problems.append(f"chỉ {meals['saved']}/{meals['answered']} gợi ý món được lưu xuống MySQL")
+    if baseline:
+        for name, r in result["endpoints"].items():
+            base = baseline["endpoints"].get(name)
+            # Bỏ qua chênh lệch vài ms của các endpoint rất nhanh (nhiễu đo)
+            if (base and base["p95"] and r["p95"] > base["p95"] * (1 + max_regression)
+                    and r["p95"] - base["p95"] > min_delta):
+                problems.append(f"{name}: p95 {r['p95']:.3f}s so với baseline {base['p95']:.3f}s "
+                                f"(+{(r['p95'] / base['p95'] - 1) * 100:.0f}%)")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tải offline cho nutrition service")
+    parser.add_argument("--requests", type=int, default=200, help="Số request advice + meal-suggestion")
+    parser.add_argument("--meal-every", type=int, default=2, help="Cứ mỗi N request có một meal-suggestion")
+    parser.add_argument("--history-requests", type=int, default=50, help="Số request /chat-history")
+    parser.add_argument("--concurrency", type=int, default=16, help="Số request đồng thời")
+    parser.add_argument("--sessions", type=int, default=20, help="Số phiên chat tối thiểu")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Độ trễ cơ bản của chain giả (giây)")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="Độ trễ thêm tối đa, xác định theo input (giây)")
+    parser.add_argument("--mysql-pool-size", type=int, default=10, help="Số kết nối của pool SQLite")
+    parser.add_argument("--mysql-latency", type=float, default=0.002, help="Độ trễ mạng giả lập mỗi câu lệnh (giây)")
+    parser.add_argument("--seed", type=int, default=42, help="Seed chọn câu hỏi và hồ sơ sức khỏe")
+    parser.add_argument("--output", type=str, help="Ghi kết quả ra file JSON (dùng làm baseline)")
+    parser.add_argument("--baseline", type=str, help="File JSON của một lần chạy trước để so sánh")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Mức tăng p95 tối đa so với baseline (0.2 = 20%%)")
+    parser.add_argument("--min-delta", type=float, default=0.01, help="Chênh lệch p95 tối thiểu (giây) mới tính là regression")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="nutrition-bench-")
+    try:
+        result = asyncio.run(run_benchmark(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Đã ghi kết quả vào {args.output}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    problems = check_result(result, baseline, args.max_regression, args.min_delta)
+    if problems:
+        print("\n=== Không đạt ===")
+        for problem in problems:
+            print(f"- {problem}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
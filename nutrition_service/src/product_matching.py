@@ -1,6 +1,6 @@
 import logging
 from pinecone import Pinecone, ServerlessSpec
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from src.embeddings import create_cached_embeddings
 import os
 from dotenv import load_dotenv
 from typing import List, Dict, Any
@@ -9,6 +9,10 @@ from typing import List, Dict, Any
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Điểm cosine tối thiểu để coi một sản phẩm là khớp với nguyên liệu
+PRODUCT_MATCH_MIN_SCORE = float(os.getenv("PRODUCT_MATCH_MIN_SCORE", "0.75"))
+PRODUCT_FIELDS = ("name", "price", "image_url", "product_url")
+
 class ProductMatcher:
     def __init__(self):
         """Initialize ProductMatcher."""
@@ -28,9 +32,8 @@ class ProductMatcher:
         if not self.dummy_mode:
             try:
                 self.pc = Pinecone(api_key=self.api_key)
-                self.embeddings = HuggingFaceEmbeddings(
-                    model_name='sentence-transformers/paraphrase-multilingual-mpnet-base-v2'
-                )
+                # Backend theo EMBEDDING_BACKEND (torch hoặc onnx int8), kèm cache embedding nguyên liệu
+                self.embeddings = create_cached_embeddings()
                 
                 # Create index if not exists
                 if self.index_name not in self.pc.list_indexes().names():
@@ -41,6 +44,7 @@ class ProductMatcher:
                         spec=ServerlessSpec(cloud="aws", region="us-east-1")
                     )
                     logger.info(f"Created Pinecone index: {self.index_name}")
+                self.index = self.pc.Index(self.index_name)
             except Exception as e:
                 logger.error(f"Error initializing vector database: {str(e)}")
                 self.dummy_mode = True
@@ -50,9 +54,45 @@ class ProductMatcher:
         if self.dummy_mode:
             return self._dummy_match(ingredients)
         
-        # Trong trường hợp bạn đã kết nối Pinecone, code thật ở đây
-        # Tương tự như trong artifact product-matching
-        pass
+        available = []
+        unavailable = []
+        for ingredient in ingredients:
+            product = self._find_product(ingredient.get("name", ""))
+            if product is not None:
+                available.append({
+                    "ingredient": ingredient,
+                    "product": product
+                })
+            else:
+                unavailable.append(ingredient)
+        
+        return {
+            "available": available,
+            "unavailable": unavailable
+        }
+    
+    def _find_product(self, name: str):
+        """Sản phẩm gần nhất với tên nguyên liệu, hoặc None nếu không đủ giống."""
+        if not name.strip():
+            return None
+        try:
+            # Nguyên liệu lặp lại giữa các món nên embedding lấy từ cache (CachedEmbeddings)
+            vector = self.embeddings.embed_query(name)
+            result = self.index.query(vector=vector, top_k=1, include_metadata=True)
+        except Exception as e:
+            logger.error(f"Error matching ingredient '{name}': {str(e)}")
+            return None
+        
+        matches = result.matches if hasattr(result, "matches") else result.get("matches", [])
+        if not matches:
+            return None
+        match = matches[0]
+        score, metadata = match["score"], match.get("metadata") or {}
+        if score < PRODUCT_MATCH_MIN_SCORE:
+            return None
+        product = {"id": match["id"]}
+        product.update({field: metadata.get(field) for field in PRODUCT_FIELDS})
+        return product
     
     def _dummy_match(self, ingredients: List[Dict[str, str]]):
         """Dummy product matching for testing."""